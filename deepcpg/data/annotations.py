@@ -3,10 +3,14 @@
 from __future__ import division
 from __future__ import print_function
 
+from collections import OrderedDict
+
 import pandas as pd
 import numpy as np
 from six.moves import range
 
+from .utils import format_chromo, read_chromo_cache, write_chromo_cache
+
 
 def read_bed(filename, sort=False, usecols=[0, 1, 2], *args, **kwargs):
     """Read chromo,start,end from BED file without formatting chromo."""
@@ -18,12 +22,69 @@ def read_bed(filename, sort=False, usecols=[0, 1, 2], *args, **kwargs):
     return d
 
 
+def read_anno_index(filename, cache_dir=None):
+    """Read annotations from BED file into index of merged intervals.
+
+    Reads intervals from BED file, formats chromosome names like
+    :func:`format_chromo`, and joins overlapping intervals of each
+    chromosome, such that the index can be used by :func:`in_which`,
+    :func:`is_in`, and :func:`distance`.
+
+    If `cache_dir` is provided, the index is cached in binary format and read
+    from the cache as long as the size and modification time of `filename` do
+    not change.
+
+    Parameters
+    ----------
+    filename: str
+        BED file, which can be gzip compressed.
+    cache_dir: str
+        Directory for caching index.
+
+    Returns
+    -------
+    OrderedDict
+        `OrderedDict (chromo, (start, end))` sorted by chromosome name, with
+        sorted non-overlapping intervals of each chromosome.
+    """
+    names = ['start', 'end']
+    if cache_dir is not None:
+        index = read_chromo_cache(filename, cache_dir, names)
+        if index is not None:
+            return index
+
+    d = read_bed(filename, dtype={0: 'category', 1: np.int32, 2: np.int32},
+                 comment='#')
+    # Chromosome names are only formatted once and stored as categorical
+    # column with sorted categories, such that intervals are sorted by codes.
+    chromos = format_chromo(pd.Series(d['chromo'].cat.categories, dtype=str))
+    chromos, codes = np.unique(chromos.values.astype(str),
+                               return_inverse=True)
+    d['chromo'] = pd.Categorical.from_codes(codes[d['chromo'].cat.codes],
+                                            chromos)
+    d = join_overlapping_frame(d)
+    ends = np.cumsum(np.bincount(d['chromo'].cat.codes,
+                                 minlength=len(chromos)))
+    index = OrderedDict()
+    for chromo, start, end in zip(chromos, ends - np.diff(ends, prepend=0),
+                                  ends):
+        if start < end:
+            index[chromo] = (d['start'].values[start:end].astype(np.int32),
+                             d['end'].values[start:end].astype(np.int32))
+
+    if cache_dir is not None:
+        write_chromo_cache(filename, cache_dir, index, names,
+                           [np.int32, np.int32])
+    return index
+
+
 def in_which(x, ys, ye):
     """Return index of positions in intervals.
 
     Returns for positions `x[i]` index `j`, s.t. `ys[j] <= x[i] <= ye[j]`, or
     -1 if `x[i]` is not overlapped by any interval.
-    Intervals must be non-overlapping!
+    Intervals must be non-overlapping! Positions are matched by binary search,
+    such that `x` need not be sorted.
 
     Parameters
     ----------
@@ -39,19 +100,16 @@ def in_which(x, ys, ye):
     :class:`numpy.ndarray`
         n:class:`numpy.ndarray` with indices of overlapping intervals or -1.
     """
-    n = len(ys)
-    m = len(x)
-    rv = np.empty(m, dtype=np.int)
-    rv.fill(-1)
-    i = 0
-    j = 0
-    while i < n and j < m:
-        while j < m and x[j] <= ye[i]:
-            if x[j] >= ys[i]:
-                rv[j] = i
-            j += 1
-        i += 1
-    return rv
+    x = np.asarray(x)
+    ys = np.asarray(ys)
+    ye = np.asarray(ye)
+    # Index of last interval that starts before or at position
+    idx = np.searchsorted(ys, x, side='right') - 1
+    if len(ye):
+        idx[x > ye[np.maximum(idx, 0)]] = -1
+    else:
+        idx.fill(-1)
+    return idx
 
 
 def is_in(pos, start, end):
@@ -62,6 +120,8 @@ def is_in(pos, start, end):
 def distance(pos, start, end):
     """Return shortest distance between a position and a list of intervals.
 
+    Intervals must be non-overlapping and sorted in ascending order.
+
     Parameters
     ----------
     pos: list
@@ -76,24 +136,83 @@ def distance(pos, start, end):
         :class:`numpy.ndarray` of same length as `pos` with shortest distance
         between each `pos[i]` and any interval.
     """
-    m = len(start)
-    n = len(pos)
-    i = 0
-    j = 0
-    end_prev = -10**7
-    dist = np.zeros(n)
-    while i < m and j < n:
-        while j < n and pos[j] <= end[i]:
-            if pos[j] < start[i]:
-                dist[j] = min(pos[j] - end_prev, start[i] - pos[j])
-            j += 1
-        end_prev = end[i]
-        i += 1
-    dist[j:] = pos[j:] - end_prev
+    pos = np.asarray(pos, dtype=np.float64)
+    start = np.asarray(start)
+    end = np.asarray(end)
+    # Index of last interval that starts before or at position
+    idx = np.searchsorted(start, pos, side='right') - 1
+    end_prev = np.empty(len(pos))
+    end_prev.fill(-10**7)
+    has_prev = idx >= 0
+    end_prev[has_prev] = end[idx[has_prev]]
+    start_next = np.empty(len(pos))
+    start_next.fill(np.inf)
+    has_next = idx + 1 < len(start)
+    start_next[has_next] = start[idx[has_next] + 1]
+    dist = np.minimum(pos - end_prev, start_next - pos)
+    dist[pos <= end_prev] = 0
     assert np.all(dist >= 0)
     return dist
 
 
+def _get_cum_len(x, start, end):
+    """Return number of positions smaller or equal than `x` that are
+    overlapped by non-overlapping intervals `start`-`end`."""
+    lens = end.astype(np.int64) - start + 1
+    cum_lens = np.concatenate([[0], np.cumsum(lens)])
+    # Index of last interval that starts before or at position
+    idx = np.searchsorted(start, x, side='right') - 1
+    cum_len = cum_lens[idx + 1].copy()
+    inner = idx >= 0
+    idx = idx[inner]
+    # Subtract positions of last interval after `x`
+    cum_len[inner] -= np.maximum(end[idx] - x[inner], 0)
+    return cum_len
+
+
+def overlap_frac(pos, start, end, wlen):
+    """Return fraction of windows at positions that is overlapped by
+    intervals.
+
+    Computes overlaps from prefix sums of interval lengths without looping
+    over positions or intervals.
+
+    Parameters
+    ----------
+    pos: list
+        List of integer positions.
+    start: list
+        Start position of non-overlapping intervals sorted in ascending order.
+    end: list
+        End position of intervals.
+    wlen: int
+        Length of windows centered on `pos`.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        :class:`numpy.ndarray` of same length as `pos` with the fraction of
+        positions in windows of length `wlen` centered on `pos[i]` that are
+        overlapped by any interval.
+    """
+    pos = np.asarray(pos, dtype=np.int64)
+    start = np.asarray(start, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64)
+    delta = wlen // 2
+    overlap = _get_cum_len(pos + wlen - delta - 1, start, end) - \
+        _get_cum_len(pos - delta - 1, start, end)
+    return overlap / wlen
+
+
+def _get_group_starts(s, e):
+    """Return boolean array indicating if interval starts a new group of
+    overlapping intervals."""
+    new = np.ones(len(s), dtype=bool)
+    if len(s) > 1:
+        new[1:] = s[1:] > np.maximum.accumulate(e)[:-1]
+    return new
+
+
 def join_overlapping(s, e):
     """Join overlapping intervals.
 
@@ -112,41 +231,43 @@ def join_overlapping(s, e):
     tuple
         `tuple` (s, e) of non-overlapping intervals.
     """
-    rs = []
-    re = []
-    n = len(s)
-    if n == 0:
-        return (rs, re)
-    l = s[0]
-    r = e[0]
-    for i in range(1, n):
-        if s[i] > r:
-            rs.append(l)
-            re.append(r)
-            l = s[i]
-            r = e[i]
-        else:
-            r = max(r, e[i])
-    rs.append(l)
-    re.append(r)
-    return (rs, re)
+    if len(s) == 0:
+        return ([], [])
+    s = np.asarray(s)
+    e = np.asarray(e)
+    idx = np.nonzero(_get_group_starts(s, e))[0]
+    return (s[idx].tolist(), np.maximum.reduceat(e, idx).tolist())
 
 
 def join_overlapping_frame(d):
     """Join overlapping intervals of Pandas DataFrame.
 
-    Uses `join_overlapping` to join overlapping intervals of
-    :class:`pandas.DataFrame` `d`.
+    Joins overlapping intervals of :class:`pandas.DataFrame` `d` like
+    `join_overlapping` on all chromosomes at once.
     """
-    d = d.sort_values(['chromo', 'start', 'end'])
-    e = []
-    for chromo in d.chromo.unique():
-        dc = d.loc[d.chromo == chromo]
-        start, end = join_overlapping(dc.start.values, dc.end.values)
-        ec = pd.DataFrame(dict(chromo=chromo, start=start, end=end))
-        e.append(ec)
-    e = pd.concat(e)
-    e = e.loc[:, ['chromo', 'start', 'end']]
+    # Sort intervals by chromosome, start, and end
+    if hasattr(d['chromo'], 'cat'):
+        codes = d['chromo'].cat.codes.values
+    else:
+        codes = np.unique(d['chromo'].values.astype(str),
+                          return_inverse=True)[1]
+    idx = np.lexsort((d['end'].values, d['start'].values, codes))
+    chromo = d['chromo'].values[idx]
+    codes = codes[idx]
+    start = d['start'].values[idx]
+    end = d['end'].values[idx]
+
+    # End of intervals is accumulated on each chromosome separately
+    new = np.ones(len(d), dtype=bool)
+    if len(d) > 1:
+        new[1:] = codes[1:] != codes[:-1]
+        end_max = pd.Series(end).groupby(codes).cummax().values
+        new[1:] |= start[1:] > end_max[:-1]
+    idx = np.nonzero(new)[0]
+    e = pd.DataFrame({'chromo': chromo[idx], 'start': start[idx],
+                      'end': np.maximum.reduceat(end, idx) if len(idx)
+                      else end},
+                     columns=['chromo', 'start', 'end'])
     return e
 
 
@@ -168,20 +289,9 @@ def group_overlapping(s, e):
     :class:`numpy.ndarray`
         :class:`numpy.ndarray` with group indices.
     """
-    n = len(s)
-    group = np.zeros(n, dtype='int32')
-    if n == 0:
-        return group
-    idx = 0
-    r = e[0]
-    for i in range(1, n):
-        if s[i] > r:
-            idx += 1
-            r = e[i]
-        else:
-            r = max(r, e[i])
-        group[i] = idx
-    return group
+    s = np.asarray(s)
+    e = np.asarray(e)
+    return np.cumsum(_get_group_starts(s, e), dtype='int32') - 1
 
 
 def extend_len(start, end, min_len, min_pos=1):
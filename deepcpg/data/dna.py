@@ -6,12 +6,20 @@ from __future__ import print_function
 from collections import OrderedDict
 
 import numpy as np
+import six
 from six.moves import range
 
 # Mapping of nucleotides to integers
 CHAR_TO_INT = OrderedDict([('A', 0), ('T', 1), ('G', 2), ('C', 3), ('N', 4)])
 # Mapping of integers to nucleotides
 INT_TO_CHAR = {v: k for k, v in CHAR_TO_INT.items()}
+# Lookup table mapping ASCII codes to integers. Characters other than A, T, G,
+# C, e.g. IUPAC ambiguity codes, are mapped to N.
+ASCII_TO_INT = np.empty(256, dtype=np.uint8)
+ASCII_TO_INT.fill(CHAR_TO_INT['N'])
+for _char, _int in CHAR_TO_INT.items():
+    ASCII_TO_INT[ord(_char)] = _int
+    ASCII_TO_INT[ord(_char.lower())] = _int
 
 
 def get_alphabet(special=False, reverse=False):
@@ -53,6 +61,95 @@ def char_to_int(seq):
     return [CHAR_TO_INT[x] for x in seq.upper()]
 
 
+def encode_seq(seq):
+    """Translate chars of single sequence `seq` to a :class:`numpy.ndarray`.
+
+    Vectorized version of :func:`char_to_int` for long sequences, e.g. entire
+    chromosomes. Characters are case-insensitive and characters other than
+    A, T, G, C are encoded as N.
+
+    Parameters
+    ----------
+    seq: str, bytes, or bytearray
+        DNA sequence.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        :class:`numpy.ndarray` of type `uint8` with integer-encoded `seq`.
+    """
+    if isinstance(seq, six.text_type):
+        seq = seq.encode()
+    return ASCII_TO_INT[np.frombuffer(seq, dtype=np.uint8)]
+
+
+def decode_seq(seq):
+    """Translate integer-encoded sequence `seq` to chars.
+
+    Inverse of :func:`encode_seq`.
+
+    Parameters
+    ----------
+    seq: :class:`numpy.ndarray`
+        Integer-encoded DNA sequence.
+
+    Returns
+    -------
+    str
+        DNA sequence.
+    """
+    chars = [INT_TO_CHAR[i] for i in range(len(INT_TO_CHAR))]
+    chars = np.array(chars, dtype='S1')
+    return chars[np.asarray(seq)].tobytes().decode()
+
+
+def get_cpg_pos(seq, start=None, end=None, seq_index=1):
+    """Return positions of CpG sites in sequence `seq`.
+
+    Scans the integer-encoded sequence for C followed by G without looping
+    over positions. If intervals `start`-`end` are provided, only
+    nucleotides within intervals are scanned, such that the runtime depends on
+    the length of intervals instead of the length of `seq`.
+
+    Parameters
+    ----------
+    seq: str or :class:`numpy.ndarray`
+        DNA sequence or integer-encoded DNA sequence, e.g. from
+        :func:`encode_seq`.
+    start: list
+        Start position of intervals, inclusive.
+    end: list
+        End position of intervals, inclusive.
+    seq_index: int
+        Offset at which positions start.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Sorted `int32` :class:`numpy.ndarray` with positions of the C of CpG
+        sites.
+    """
+    if not isinstance(seq, np.ndarray):
+        seq = encode_seq(seq)
+    seq_len = len(seq)
+    if start is None:
+        idx = np.nonzero((seq[:-1] == CHAR_TO_INT['C']) &
+                         (seq[1:] == CHAR_TO_INT['G']))[0]
+    else:
+        # Concatenate indices of all intervals
+        start = np.maximum(np.asarray(start, dtype=np.int64) - seq_index, 0)
+        end = np.minimum(np.asarray(end, dtype=np.int64) - seq_index,
+                         seq_len - 2)
+        lens = np.maximum(end - start + 1, 0)
+        offsets = np.cumsum(lens) - lens
+        idx = np.arange(lens.sum()) + np.repeat(start - offsets, lens)
+        idx = idx[(seq[idx] == CHAR_TO_INT['C']) &
+                  (seq[idx + 1] == CHAR_TO_INT['G'])]
+        # Intervals might be overlapping or unsorted
+        idx = np.unique(idx)
+    return (idx + seq_index).astype(np.int32)
+
+
 def int_to_char(seq, join=True):
     """Translate ints of single sequence `seq` to chars.
 
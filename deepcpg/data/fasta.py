@@ -3,13 +3,23 @@
 from __future__ import division
 from __future__ import print_function
 
+from collections import OrderedDict
+import json
 import os
+import re
 from glob import glob
 import gzip as gz
 
+import numpy as np
+import six
 from six.moves import range
 
-from ..utils import to_list
+from . import dna
+from ..utils import make_dir, to_list
+
+# Name of JSON file that describes genome index created by
+# :func:`build_genome_index`.
+GENOME_INDEX = 'genome_index.json'
 
 
 class FastaSeq(object):
@@ -52,7 +62,134 @@ def parse_lines(lines):
     return seqs
 
 
-def read_file(filename, gzip=None):
+# Whitespace that is removed at the start and end of lines
+_LINE_SPACE = b' \t\f\v'
+_LINE_END = re.compile(b'[ \t\f\v]*[\r\n][ \t\f\v]*')
+
+
+class _SeqBuffer(object):
+    """Growable byte buffer for writing a sequence of unknown length.
+
+    Starts with `capacity` bytes and grows geometrically by 1/8 of its size,
+    such that the memory overhead stays small for long sequences.
+    """
+
+    def __init__(self, capacity=0):
+        self.buf = bytearray(max(0, capacity))
+        self.size = 0
+        self.tail = b''
+
+    def write(self, data):
+        end = self.size + len(data)
+        if end > len(self.buf):
+            self.buf.extend(bytearray(max(end - len(self.buf),
+                                          len(self.buf) // 8)))
+        self.buf[self.size:end] = data
+        self.size = end
+
+    def write_lines(self, data, table=None):
+        """Write lines `data` without line breaks and whitespace at line ends,
+        and translate bytes by `table`.
+
+        Whitespace at the end of `data` is kept back until the next write,
+        since the line might continue.
+        """
+        if self.tail:
+            data = self.tail + data
+        end = len(data.rstrip(_LINE_SPACE + b'\r\n'))
+        self.tail = data[end:]
+        data = data[:end]
+        if self.size == 0:
+            data = data.lstrip(_LINE_SPACE + b'\r\n')
+        if any(c in data for c in _LINE_SPACE):
+            data = _LINE_END.sub(b'', data)
+        self.write(data.translate(table, b'\r\n'))
+
+    def getvalue(self):
+        del self.buf[self.size:]
+        return self.buf
+
+
+def iter_file(filename, gzip=None, encode=False, block_size=2**22):
+    """Iterate over sequences in FASTA file.
+
+    Streams the file in blocks of `block_size` bytes and writes sequences
+    directly into a growing buffer, such that memory usage is proportional to
+    the size of the current sequence instead of the file. As for
+    :func:`parse_lines`, whitespace at the start and end of lines is removed,
+    but whitespace within lines is kept.
+
+    Parameters
+    ----------
+    filename: str
+        File name.
+    gzip: bool
+        If `True`, file is gzip compressed. If `None`, suffix is used to
+        determine if file is compressed.
+    encode: bool
+        If `True`, integer-encode sequences like :func:`dna.encode_seq`.
+    block_size: int
+        Number of bytes read at once.
+
+    Returns
+    -------
+    generator
+        Generator of :class:`FastaSeq` objects. Sequences are `str` or `uint8`
+        :class:`numpy.ndarray` if `encode=True`.
+    """
+    if gzip is None:
+        gzip = filename.endswith('.gz')
+    table = bytes(bytearray(dna.ASCII_TO_INT)) if encode else None
+
+    def to_seq(head, buf):
+        seq = buf.getvalue()
+        if encode:
+            seq = np.frombuffer(seq, dtype=np.uint8)
+        else:
+            seq = seq.decode()
+        return FastaSeq(head.decode().strip(), seq)
+
+    f = gz.open(filename, 'rb') if gzip else open(filename, 'rb')
+    try:
+        head = None
+        buf = None
+        in_head = False
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            while block:
+                if in_head:
+                    end = block.find(b'\n')
+                    if end < 0:
+                        head += block
+                        break
+                    head += block[:end]
+                    block = block[(end + 1):]
+                    in_head = False
+                    buf = _SeqBuffer(block_size)
+                else:
+                    end = block.find(b'>')
+                    data = block if end < 0 else block[:end]
+                    if buf is not None:
+                        buf.write_lines(data, table)
+                    if end < 0:
+                        break
+                    if buf is not None:
+                        yield to_seq(head, buf)
+                        buf = None
+                    head = bytearray(b'>')
+                    block = block[(end + 1):]
+                    in_head = True
+        if in_head:
+            buf = _SeqBuffer()
+        if buf is not None:
+            yield to_seq(head, buf)
+    finally:
+        f.close()
+
+
+def read_file(filename, gzip=None, encode=False):
     """Read FASTA file and return sequences.
 
     Parameters
@@ -62,20 +199,168 @@ def read_file(filename, gzip=None):
     gzip: bool
         If `True`, file is gzip compressed. If `None`, suffix is used to
         determine if file is compressed.
+    encode: bool
+        If `True`, integer-encode sequences like :func:`dna.encode_seq`.
 
     Returns
     -------
+    list
         List of :class:`FastaSeq` objects.
     """
+    return list(iter_file(filename, gzip=gzip, encode=encode))
+
+
+def read_single_seq(filename, encode=False):
+    """Read the single sequence of a FASTA file.
+
+    Raises `ValueError` if the file does not contain exactly one sequence.
+    """
+    fasta_seqs = iter_file(filename, encode=encode)
+    fasta_seq = next(fasta_seqs, None)
+    if fasta_seq is None or next(fasta_seqs, None) is not None:
+        raise ValueError('Single sequence expected in file "%s"!' % filename)
+    return fasta_seq.seq
+
+
+def list_chromo_files(filenames):
+    """List FASTA files of individual chromosomes.
+
+    Parameters
+    ----------
+    filenames: list
+        List of file names or directory with FASTA files.
+
+    Returns
+    -------
+    OrderedDict
+        `OrderedDict` (chromo, filename) with chromosome names and the
+        corresponding FASTA file, sorted by chromosome name.
+    """
+    filenames = to_list(filenames)
+    if len(filenames) == 1 and os.path.isdir(filenames[0]):
+        filenames = glob(os.path.join(filenames[0],
+                                      '*.dna.chromosome.*.fa*'))
+    chromo_files = dict()
+    for filename in filenames:
+        match = re.search(r'chromosome\.([^.]+)\.fa', filename)
+        if match:
+            chromo_files[match.group(1)] = filename
+    return OrderedDict(sorted(chromo_files.items()))
+
+
+def build_genome_index(filenames, out_dir, chromos=None, log=None):
+    """Build genome index from FASTA files.
+
+    Integer-encodes the DNA sequence of each chromosome once using
+    :func:`dna.encode_seq` and stores it as `.npy` file in `out_dir`, which is
+    described by a JSON file :const:`GENOME_INDEX`. Chromosomes can then be
+    read instantly as memory-mapped arrays by :func:`read_chromo`.
+
+    Parameters
+    ----------
+    filenames: list
+        List of FASTA files or directory with FASTA files named
+        "*.dna.chromosome.`chromo`.fa*".
+    out_dir: str
+        Output directory.
+    chromos: list
+        Chromosomes to be indexed. If `None`, index all chromosomes.
+    log: function
+        Function for logging progress.
+
+    Returns
+    -------
+    dict
+        `dict` with genome index.
+    """
+    make_dir(out_dir)
+    index = {'chromos': OrderedDict()}
+    for chromo, filename in six.iteritems(list_chromo_files(filenames)):
+        if chromos is not None and chromo not in chromos:
+            continue
+        if log:
+            log(filename)
+        seq = read_single_seq(filename, encode=True)
+        seq_file = '%s.npy' % chromo
+        np.save(os.path.join(out_dir, seq_file), seq)
+        index['chromos'][chromo] = {'filename': seq_file,
+                                    'length': len(seq),
+                                    'source': os.path.abspath(filename)}
+    with open(os.path.join(out_dir, GENOME_INDEX), 'w') as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+def get_genome_index(filenames):
+    """Return path of genome index if `filenames` points to one.
+
+    Parameters
+    ----------
+    filenames: list
+        List of file names or directory.
+
+    Returns
+    -------
+    str
+        Path of :const:`GENOME_INDEX` file or `None` if `filenames` is not a
+        genome index.
+    """
+    filenames = to_list(filenames)
+    if len(filenames) != 1:
+        return None
+    filename = filenames[0]
+    if os.path.isdir(filename):
+        filename = os.path.join(filename, GENOME_INDEX)
+    if os.path.basename(filename) == GENOME_INDEX and \
+            os.path.isfile(filename):
+        return filename
+    return None
+
+
+def list_chromos(filenames):
+    """List chromosomes that can be read by :func:`read_chromo`.
+
+    Parameters
+    ----------
+    filenames: list
+        List of FASTA files or genome index.
+
+    Returns
+    -------
     list
-    if gzip is None:
-        gzip = filename.endswith('.gz')
-    if gzip:
-        lines = gz.open(filename, 'r').read().decode()
-    else:
-        lines = open(filename, 'r').read()
-    lines = lines.splitlines()
-    return parse_lines(lines)
+        List of chromosome names.
+    """
+    index_file = get_genome_index(filenames)
+    if index_file:
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+        return list(index['chromos'].keys())
+    return list(list_chromo_files(filenames).keys())
+
+
+def read_index_chromo(index_file, chromo):
+    """Read integer-encoded chromosome from genome index.
+
+    Parameters
+    ----------
+    index_file: str
+        Path of :const:`GENOME_INDEX` file.
+    chromo: str
+        Chromosome that is read.
+
+    Returns
+    -------
+    :class:`numpy.memmap`
+        Read-only memory-mapped `uint8` array with encoded DNA sequence.
+    """
+    with open(index_file, 'r') as f:
+        index = json.load(f)
+    if chromo not in index['chromos']:
+        raise ValueError('Chromosome "%s" not in genome index "%s"!' %
+                         (chromo, index_file))
+    seq_file = index['chromos'][chromo]['filename']
+    seq_file = os.path.join(os.path.dirname(index_file), seq_file)
+    return np.load(seq_file, mmap_mode='r')
 
 
 def select_file_by_chromo(filenames, chromo):
@@ -103,26 +388,70 @@ def select_file_by_chromo(filenames, chromo):
             return filename
 
 
-def read_chromo(filenames, chromo):
+def get_chromo_file(filenames, chromo):
+    """Return file from which :func:`read_chromo` reads chromosome `chromo`.
+
+    Parameters
+    ----------
+    filenames: list
+        List of FASTA files or genome index.
+    chromo: str
+        Chromosome name.
+
+    Returns
+    -------
+    str
+        Path of `.npy` file if `filenames` is a genome index, and of FASTA file
+        otherwise.
+    """
+    index_file = get_genome_index(filenames)
+    if index_file:
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+        if chromo not in index['chromos']:
+            raise ValueError('Chromosome "%s" not in genome index "%s"!' %
+                             (chromo, index_file))
+        return os.path.join(os.path.dirname(index_file),
+                            index['chromos'][chromo]['filename'])
+
+    filename = select_file_by_chromo(filenames, chromo)
+    if not filename:
+        raise ValueError('DNA file for chromosome "%s" not found!' % chromo)
+    return filename
+
+
+def read_chromo(filenames, chromo, encode=False):
     """Read DNA sequence of chromosome `chromo`.
 
+    Reads from a genome index created by :func:`build_genome_index` if
+    `filenames` is the directory or JSON file of an index, and from FASTA files
+    otherwise.
+
     Parameters
     ----------
     filenames: list
-        List of FASTA files.
+        List of FASTA files or genome index.
     chromo: str
         Chromosome that is read.
+    encode: bool
+        If `True`, return integer-encoded sequence, which is a memory-mapped
+        array if read from a genome index.
 
     Returns
     -------
-    str
-        DNA sequence of chromosome `chromo`.
+    str or :class:`numpy.ndarray`
+        DNA sequence of chromosome `chromo`, or integer-encoded DNA sequence if
+        `encode=True`.
     """
+    index_file = get_genome_index(filenames)
+    if index_file:
+        seq = read_index_chromo(index_file, chromo)
+        if not encode:
+            seq = dna.decode_seq(seq)
+        return seq
+
     filename = select_file_by_chromo(filenames, chromo)
     if not filename:
         raise ValueError('DNA file for chromosome "%s" not found!' % chromo)
 
-    fasta_seqs = read_file(filename)
-    if len(fasta_seqs) != 1:
-        raise ValueError('Single sequence expected in file "%s"!' % filename)
-    return fasta_seqs[0].seq
+    return read_single_seq(filename, encode=encode)
@@ -6,6 +6,8 @@ from __future__ import print_function
 import numpy as np
 from six.moves import range
 
+from . import annotations as an
+
 
 class KnnCpgFeatureExtractor(object):
     """Extract k CpG sites next to target sites. Exclude CpG sites at the
@@ -42,46 +44,26 @@ class KnnCpgFeatureExtractor(object):
         m = len(y)
         k = self.k
         kk = 2 * self.k
-        yc = self.__larger_equal(x, y)
         knn_cpg = np.empty((n, kk), dtype=np.float16)
         knn_cpg.fill(np.nan)
         knn_dist = np.empty((n, kk), dtype=np.float32)
         knn_dist.fill(np.nan)
+        if n == 0 or m == 0:
+            return (knn_cpg, knn_dist)
 
-        for i in range(n):
-            # Left side
-            yl = yc[i] - k
-            yr = yc[i] - 1
-            if yr >= 0:
-                xl = 0
-                xr = k - 1
-                if yl < 0:
-                    xl += np.abs(yl)
-                    yl = 0
-                xr += 1
-                yr += 1
-                knn_cpg[i, xl:xr] = ys[yl:yr]
-                knn_dist[i, xl:xr] = np.abs(y[yl:yr] - x[i])
-
-            # Right side
-            yl = yc[i]
-            if yl >= m:
-                continue
-            if x[i] == y[yl]:
-                yl += 1
-                if yl >= m:
-                    continue
-            yr = yl + k - 1
-            xl = 0
-            xr = k - 1
-            if yr >= m:
-                xr -= yr - m + 1
-                yr = m - 1
-            xl += k
-            xr += k + 1
-            yr += 1
-            knn_cpg[i, xl:xr] = ys[yl:yr]
-            knn_dist[i, xl:xr] = np.abs(y[yl:yr] - x[i])
+        x = np.asarray(x)
+        y = np.asarray(y)
+        ys = np.asarray(ys)
+        yc = self.__larger_equal(x, y)
+        # Exclude source site at the same position as the target site
+        yr = yc + (y[np.minimum(yc, m - 1)] == x) * (yc < m)
+        # Index of the k sites to the left and right of each target site
+        idx = np.hstack((yc[:, np.newaxis] + np.arange(-k, 0),
+                         yr[:, np.newaxis] + np.arange(k)))
+        valid = (idx >= 0) & (idx < m)
+        idx = np.clip(idx, 0, m - 1)
+        knn_cpg[valid] = ys[idx[valid]]
+        knn_dist[valid] = np.abs(y[idx] - x[:, np.newaxis])[valid]
 
         return (knn_cpg, knn_dist)
 
@@ -96,24 +78,14 @@ class KnnCpgFeatureExtractor(object):
             :class:`numpy.ndarray` of with positions sorted in ascending order.
         """
 
-        n = len(x)
-        m = len(y)
-        rv = np.empty(n, dtype=np.int)
-        i = 0
-        j = 0
-        while i < n and j < m:
-            while j < m and x[i] > y[j]:
-                j += 1
-            rv[i] = j
-            i += 1
-        if i < n:
-            # x[i] > y[m - 1]
-            rv[i:] = m
-        return rv
+        return np.searchsorted(y, x, side='left')
 
 
 class IntervalFeatureExtractor(object):
-    """Check if positions are in a list of intervals (start, end)."""
+    """Check if positions are in a list of intervals (start, end).
+
+    Uses the interval functions of :mod:`deepcpg.data.annotations`.
+    """
 
     @staticmethod
     def join_intervals(s, e):
@@ -132,25 +104,7 @@ class IntervalFeatureExtractor(object):
         tuple
             Tuple (s, e) of non-overlapping intervals.
         """
-
-        rs = []
-        re = []
-        n = len(s)
-        if n == 0:
-            return (rs, re)
-        l = s[0]
-        r = e[0]
-        for i in range(1, n):
-            if s[i] > r:
-                rs.append(l)
-                re.append(r)
-                l = s[i]
-                r = e[i]
-            else:
-                r = max(r, e[i])
-        rs.append(l)
-        re.append(r)
-        return (rs, re)
+        return an.join_overlapping(s, e)
 
     @staticmethod
     def index_intervals(x, ys, ye):
@@ -171,23 +125,10 @@ class IntervalFeatureExtractor(object):
         :class:`numpy.ndarray`
             :class:`numpy.ndarray` of same length than x with index or -1.
         """
-
-        n = len(ys)
-        m = len(x)
-        rv = np.empty(m, dtype=np.int)
-        rv.fill(-1)
-        i = 0
-        j = 0
-        while i < n and j < m:
-            while j < m and x[j] <= ye[i]:
-                if x[j] >= ys[i]:
-                    rv[j] = i
-                j += 1
-            i += 1
-        return rv
+        return an.in_which(x, ys, ye)
 
     def extract(self, x, ys, ye):
-        return self.index_intervals(x, ys, ye) >= 0
+        return an.is_in(x, ys, ye)
 
 
 class KmersFeatureExtractor(object):
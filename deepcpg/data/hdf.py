@@ -3,7 +3,12 @@
 from __future__ import division
 from __future__ import print_function
 
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import os
 import re
+import threading
 
 import h5py as h5
 import numpy as np
@@ -12,6 +17,268 @@ from six.moves import range
 
 from ..utils import filter_regex, to_list
 
+# Maximum number of HDF5 files that are kept open by :func:`open_file`.
+FILE_POOL_SIZE = 64
+
+
+class FilePool(object):
+    """LRU pool of HDF5 files that are open for reading.
+
+    Keeps up to `max_size` files open, such that reading the same file
+    repeatedly, e.g. by :func:`ls`, :func:`reader`, and in every epoch, only
+    opens it once. Files are acquired by :meth:`acquire` and must be released
+    by :meth:`release`. Only released files are closed if the pool is full.
+    Files that changed since they were opened are reopened. Handles of changed
+    files that are still acquired are retired and closed when released.
+
+    Parameters
+    ----------
+    max_size: int
+        Maximum number of open files that are not acquired.
+
+    Attributes
+    ----------
+    nb_open: int
+        Number of times a file was opened.
+    nb_hit: int
+        Number of times an open file was reused.
+    """
+
+    def __init__(self, max_size=FILE_POOL_SIZE):
+        self.max_size = max_size
+        self.nb_open = 0
+        self.nb_hit = 0
+        self._files = OrderedDict()
+        self._retired = []
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+
+    def __len__(self):
+        return len(self._files)
+
+    def _check_pid(self):
+        # Handles inherited from parent process are not used in child
+        # processes, but also not closed since they are owned by the parent.
+        if os.getpid() != self._pid:
+            self._files = OrderedDict()
+            self._retired = []
+            self._pid = os.getpid()
+
+    def acquire(self, filename):
+        """Return open HDF5 file `filename`, which must be released by
+        :meth:`release`."""
+        key = os.path.abspath(filename)
+        stat = os.stat(key)
+        stat = (stat.st_ino, stat.st_size, stat.st_mtime)
+        with self._lock:
+            self._check_pid()
+            entry = self._files.pop(key, None)
+            if entry is not None and entry[1] != stat:
+                # File changed since it was opened
+                if entry[2] == 0:
+                    entry[0].close()
+                else:
+                    self._retired.append(entry)
+                entry = None
+            if entry is None:
+                entry = [h5.File(key, 'r'), stat, 0]
+                self.nb_open += 1
+            else:
+                self.nb_hit += 1
+            entry[2] += 1
+            self._files[key] = entry
+            self._evict()
+            return entry[0]
+
+    def release(self, filename, h5_file=None):
+        """Release HDF5 file `filename` acquired by :meth:`acquire`.
+
+        Parameters
+        ----------
+        filename: str
+            Name of HDF5 file.
+        h5_file: :class:`h5py.File`
+            File returned by :meth:`acquire`. Required to release the right
+            handle if the file changed while it was acquired. If `None`, the
+            most recently opened handle of `filename` is released.
+        """
+        key = os.path.abspath(filename)
+        with self._lock:
+            self._check_pid()
+            entry = self._files.get(key)
+            if h5_file is not None and \
+                    (entry is None or entry[0] is not h5_file):
+                for i, retired in enumerate(self._retired):
+                    if retired[0] is h5_file:
+                        retired[2] -= 1
+                        if retired[2] == 0:
+                            retired[0].close()
+                            del self._retired[i]
+                        break
+            elif entry is not None and entry[2] > 0:
+                entry[2] -= 1
+            self._evict()
+
+    def _evict(self):
+        # Close least recently used files that are not acquired
+        nb_close = len(self._files) - self.max_size
+        for key in list(self._files.keys()):
+            if nb_close <= 0:
+                break
+            entry = self._files[key]
+            if entry[2] == 0:
+                entry[0].close()
+                del self._files[key]
+                nb_close -= 1
+
+    def close(self):
+        """Close all files that are not acquired."""
+        with self._lock:
+            self._check_pid()
+            for key in list(self._files.keys()):
+                if self._files[key][2] == 0:
+                    self._files.pop(key)[0].close()
+
+    def stats(self):
+        """Return `OrderedDict` with number of open files, file opens, and
+        hits."""
+        return OrderedDict([('nb_file', len(self._files)),
+                            ('nb_open', self.nb_open),
+                            ('nb_hit', self.nb_hit)])
+
+
+_file_pool = FilePool()
+
+
+def get_file_pool():
+    """Return :class:`FilePool` shared by :func:`open_file`."""
+    return _file_pool
+
+
+@contextmanager
+def open_file(filename):
+    """Open HDF5 file `filename` for reading from shared :class:`FilePool`.
+
+    File is kept open after leaving the context, such that it is not opened
+    again by following calls. Files that are replaced, e.g. by renaming a new
+    file, are reopened, but files must be closed by
+    :meth:`FilePool.close` of :func:`get_file_pool` before they are
+    overwritten in place.
+
+    Examples
+    --------
+    .. code:: python
+
+        with open_file('c1_000000-032768.h5') as h5_file:
+            pos = h5_file['pos'][()]
+    """
+    h5_file = _file_pool.acquire(filename)
+    try:
+        yield h5_file
+    finally:
+        _file_pool.release(filename, h5_file)
+
+
+# Name of JSON file that describes data files in the same directory. Created
+# by `dcpg_data.py`.
+SAMPLE_INDEX = 'sample_index.json'
+
+_sample_indexes = dict()
+_sample_indexes_lock = threading.Lock()
+
+
+def read_sample_index(dirname):
+    """Read sample index of data files in directory `dirname`.
+
+    The index is only parsed once and reused as long as its modification time
+    and size do not change.
+
+    Parameters
+    ----------
+    dirname: str
+        Directory with data files.
+
+    Returns
+    -------
+    dict
+        `dict` with key 'files', which maps the name of data files to their
+        description, or `None` if `dirname` does not contain a
+        :const:`SAMPLE_INDEX` file.
+    """
+    filename = os.path.join(os.path.abspath(dirname), SAMPLE_INDEX)
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    key = (stat.st_mtime, stat.st_size)
+    with _sample_indexes_lock:
+        cached = _sample_indexes.get(filename)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+    with open(filename, 'r') as f:
+        index = json.load(f, object_pairs_hook=OrderedDict)
+    with _sample_indexes_lock:
+        _sample_indexes[filename] = (key, index)
+    return index
+
+
+def write_sample_index(dirname, files):
+    """Write sample index of data files in directory `dirname` atomically.
+
+    Parameters
+    ----------
+    dirname: str
+        Directory with data files.
+    files: OrderedDict
+        `OrderedDict (name, entry)` with the name of data files in `dirname`
+        and their description, e.g. from :func:`data.describe_data_file`.
+    """
+    filename = os.path.join(dirname, SAMPLE_INDEX)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump({'files': files}, f)
+    os.rename(filename + '.tmp', filename)
+
+
+def get_index_entry(data_file):
+    """Return description of `data_file` from the sample index of its
+    directory.
+
+    Returns
+    -------
+    dict
+        `dict` with description of `data_file` or `None` if `data_file` is not
+        indexed or its size or modification time changed since it was
+        indexed.
+    """
+    index = read_sample_index(os.path.dirname(data_file) or '.')
+    if index is None:
+        return None
+    entry = index['files'].get(os.path.basename(data_file))
+    if entry is None:
+        return None
+    try:
+        stat = os.stat(data_file)
+    except OSError:
+        return None
+    if stat.st_size != entry['size'] or stat.st_mtime != entry['mtime']:
+        return None
+    return entry
+
+
+def iter_nb_sample(data_files):
+    """Yield number of samples of each file in `data_files`.
+
+    Numbers are read from the sample index if files are indexed, and files are
+    only opened otherwise.
+    """
+    for data_file in data_files:
+        entry = get_index_entry(data_file)
+        if entry is None:
+            with open_file(data_file) as h5_file:
+                yield len(h5_file['pos'])
+        else:
+            yield entry['nb_sample']
+
 
 def _ls(item, recursive=False, groups=False, level=0):
     keys = []
@@ -54,13 +321,12 @@ def ls(filename, group='/', recursive=False, groups=False,
     """
     if not group.startswith('/'):
         group = '/%s' % group
-    h5_file = h5.File(filename, 'r')
-    if not must_exist and group not in h5_file:
-        return None
-    keys = _ls(h5_file[group], recursive, groups)
+    with open_file(filename) as h5_file:
+        if not must_exist and group not in h5_file:
+            return None
+        keys = _ls(h5_file[group], recursive, groups)
     for i, key in enumerate(keys):
         keys[i] = re.sub('^%s/' % group, '', key)
-    h5_file.close()
     if regex:
         keys = filter_regex(keys, regex)
     if nb_key is not None:
@@ -82,6 +348,101 @@ def write_data(data, filename):
         group.close()
 
 
+# Compression filters supported by :func:`get_storage_kwargs`.
+COMPRESSIONS = ['gzip', 'lzf', 'none']
+
+# Minimum number of bytes of HDF5 chunks created by :func:`get_storage_kwargs`.
+MIN_CHUNK_BYTES = 2**16
+
+
+def get_storage_kwargs(shape, dtype, compression='gzip',
+                       compression_level=None, shuffle=False,
+                       chunk_rows=None):
+    """Return keyword arguments of `create_dataset` for storing a dataset.
+
+    Parameters
+    ----------
+    shape: tuple
+        Shape of dataset.
+    dtype: :class:`numpy.dtype`
+        Data type of dataset.
+    compression: str
+        Compression filter in :const:`COMPRESSIONS`. 'none' disables
+        compression.
+    compression_level: int
+        Compression level between 0 and 9 if `compression='gzip'`. Uses the
+        default level of h5py if `None`.
+    shuffle: bool
+        If `True`, apply byte-shuffle filter before compression.
+    chunk_rows: int
+        If provided, the number of samples of HDF5 chunks along the first
+        dimension is the smallest multiple of `chunk_rows`, e.g. the batch
+        size, such that chunks have at least :const:`MIN_CHUNK_BYTES`. Batches
+        of `chunk_rows` samples then do not cross chunk borders. Uses the
+        chunk shape of h5py if `None`.
+
+    Returns
+    -------
+    dict
+        `dict` with keyword arguments of :meth:`h5py.Group.create_dataset`.
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError('Invalid compression "%s"!' % compression)
+    kwargs = dict()
+    if compression != 'none':
+        kwargs['compression'] = compression
+    if compression_level is not None:
+        if compression != 'gzip':
+            raise ValueError('Compression level requires gzip compression!')
+        kwargs['compression_opts'] = compression_level
+    if shuffle:
+        kwargs['shuffle'] = True
+    if chunk_rows and len(shape) and shape[0] > 0:
+        row_bytes = max(1, int(np.prod(shape[1:])) * np.dtype(dtype).itemsize)
+        nb_row = chunk_rows * int(np.ceil(MIN_CHUNK_BYTES /
+                                          (chunk_rows * row_bytes)))
+        kwargs['chunks'] = (min(nb_row, shape[0]),) + tuple(shape[1:])
+    return kwargs
+
+
+def add_storage_args(parser):
+    """Add command line arguments of :func:`get_storage_kwargs` to `parser`.
+
+    Parsed arguments can be converted to keyword arguments of
+    :func:`get_storage_kwargs` by :func:`get_storage_opts`.
+    """
+    g = parser.add_argument_group('HDF5 storage arguments')
+    g.add_argument(
+        '--compression',
+        help='Compression filter of HDF5 datasets',
+        choices=COMPRESSIONS,
+        default='gzip')
+    g.add_argument(
+        '--compression_level',
+        help='Compression level between 0 and 9 for gzip compression',
+        type=int,
+        choices=range(10))
+    g.add_argument(
+        '--shuffle_filter',
+        help='Apply byte-shuffle filter before compression',
+        action='store_true')
+    g.add_argument(
+        '--chunk_rows',
+        help='Align HDF5 chunks to multiples of this number of samples, e.g.'
+        ' the batch size used for reading data',
+        type=int)
+    return g
+
+
+def get_storage_opts(opts):
+    """Return storage options of parsed arguments of
+    :func:`add_storage_args`."""
+    return dict(compression=opts.compression,
+                compression_level=opts.compression_level,
+                shuffle=opts.shuffle_filter,
+                chunk_rows=opts.chunk_rows)
+
+
 def hnames_to_names(hnames):
     """Flattens `dict` `hnames` of hierarchical names.
 
@@ -103,8 +464,123 @@ def hnames_to_names(hnames):
     return names
 
 
+class _ShuffleBuffer(object):
+    """Buffer of samples from which random batches are drawn.
+
+    Samples are stored in preallocated arrays of `capacity` rows. Drawn
+    samples are replaced by samples from the end of the buffer, such that
+    drawing a batch only copies as many rows as the batch size.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, data):
+        nb_sample = len(list(data.values())[0])
+        assert self.size + nb_sample <= self.capacity
+        if self.data is None:
+            self.data = dict()
+            for name, value in six.iteritems(data):
+                self.data[name] = np.empty((self.capacity,) + value.shape[1:],
+                                           dtype=value.dtype)
+        for name, value in six.iteritems(data):
+            self.data[name][self.size:(self.size + nb_sample)] = value
+        self.size += nb_sample
+
+    def pop(self, nb_sample):
+        nb_sample = min(nb_sample, self.size)
+        # Draw random subset of samples without permuting the entire buffer
+        idx = np.unique(np.random.randint(0, self.size, 2 * nb_sample))
+        if len(idx) >= nb_sample:
+            idx = idx[np.random.permutation(len(idx))[:nb_sample]]
+        else:
+            idx = np.random.choice(self.size, nb_sample, replace=False)
+        data = dict()
+        for name, value in six.iteritems(self.data):
+            data[name] = value[idx]
+        # Move samples at the end of the buffer that were not drawn into gaps
+        end = self.size - nb_sample
+        gaps = idx[idx < end]
+        is_drawn = np.zeros(nb_sample, dtype=bool)
+        is_drawn[idx[idx >= end] - end] = True
+        tail = np.arange(end, self.size)[~is_drawn]
+        for value in six.itervalues(self.data):
+            value[gaps] = value[tail]
+        self.size = end
+        return data
+
+
+def _read_shuffled_blocks(data_files, names, batch_size, nb_sample, loop,
+                          block_size, buffer_size):
+    """Read batches by shuffling blocks of samples. See :func:`reader`."""
+    buf = _ShuffleBuffer(buffer_size + block_size)
+    while True:
+        np.random.shuffle(data_files)
+        nb_seen = 0
+        for data_file in data_files:
+            if nb_seen >= nb_sample:
+                break
+            with open_file(data_file) as h5_file:
+                nb_sample_file = len(h5_file[names[0]])
+                blocks = np.arange(0, nb_sample_file, block_size)
+                np.random.shuffle(blocks)
+                for block_start in blocks:
+                    block_end = min(nb_sample_file, block_start + block_size,
+                                    block_start + nb_sample - nb_seen)
+                    if block_end <= block_start:
+                        break
+                    data_block = dict()
+                    for name in names:
+                        data_block[name] = h5_file[name][block_start:block_end]
+                    buf.add(data_block)
+                    nb_seen += block_end - block_start
+                    while len(buf) >= buffer_size:
+                        yield buf.pop(batch_size)
+        while len(buf):
+            yield buf.pop(batch_size)
+        if not loop:
+            break
+
+
 def reader(data_files, names, batch_size=128, nb_sample=None, shuffle=False,
-           loop=False):
+           loop=False, shuffle_block=None, shuffle_buffer=None):
+    """Read batches of datasets from data files.
+
+    Parameters
+    ----------
+    data_files: list
+        Data files.
+    names: list
+        Names of datasets or hierarchical `dict` of names that are read.
+    batch_size: int
+        Batch size.
+    nb_sample: int
+        Maximum number of samples that are read from the first files.
+    shuffle: bool
+        If `True`, shuffle files and samples within files.
+    loop: bool
+        If `True`, loop over files indefinitely.
+    shuffle_block: int
+        If provided and `shuffle=True`, shuffle the order of contiguous blocks
+        of `shuffle_block` samples within files instead of reading entire
+        files into memory, and shuffle samples in a buffer. Should be a
+        multiple of the chunk size of datasets, e.g. `--chunk_rows` of
+        `dcpg_data.py`.
+    shuffle_buffer: int
+        Number of samples in the buffer from which batches are drawn randomly
+        if `shuffle_block` is provided. Defaults to 16 blocks. Larger buffers
+        mix samples of more blocks and files.
+
+    Returns
+    -------
+    generator
+        Generator of `dict (name, value)` with batches of datasets.
+    """
     if isinstance(names, dict):
         names = hnames_to_names(names)
     else:
@@ -113,21 +589,19 @@ def reader(data_files, names, batch_size=128, nb_sample=None, shuffle=False,
     data_files = list(to_list(data_files))
 
     # Check if names exist
-    h5_file = h5.File(data_files[0], 'r')
-    for name in names:
-        if name not in h5_file:
-            raise ValueError('%s does not exist!' % name)
-    h5_file.close()
+    with open_file(data_files[0]) as h5_file:
+        for name in names:
+            if name not in h5_file:
+                raise ValueError('%s does not exist!' % name)
 
     if nb_sample:
         # Select the first k files s.t. the total sample size is at least
         # nb_sample. Only these files will be shuffled.
         _data_files = []
         nb_seen = 0
-        for data_file in data_files:
-            h5_file = h5.File(data_file, 'r')
-            nb_seen += len(h5_file[names[0]])
-            h5_file.close()
+        for data_file, nb_sample_file in zip(data_files,
+                                             iter_nb_sample(data_files)):
+            nb_seen += nb_sample_file
             _data_files.append(data_file)
             if nb_seen >= nb_sample:
                 break
@@ -135,45 +609,53 @@ def reader(data_files, names, batch_size=128, nb_sample=None, shuffle=False,
     else:
         nb_sample = np.inf
 
+    if shuffle and shuffle_block:
+        if not shuffle_buffer:
+            shuffle_buffer = 16 * shuffle_block
+        for data_batch in _read_shuffled_blocks(data_files, names, batch_size,
+                                                nb_sample, loop, shuffle_block,
+                                                shuffle_buffer):
+            yield data_batch
+        return
+
     file_idx = 0
     nb_seen = 0
     while True:
         if shuffle and file_idx == 0:
             np.random.shuffle(data_files)
 
-        h5_file = h5.File(data_files[file_idx], 'r')
-        data_file = dict()
-        for name in names:
-            data_file[name] = h5_file[name]
-        nb_sample_file = len(list(data_file.values())[0])
-
-        if shuffle:
-            # Shuffle data within the entire file, which requires reading
-            # the entire file into memory
-            idx = np.arange(nb_sample_file)
-            np.random.shuffle(idx)
-            for name, value in six.iteritems(data_file):
-                data_file[name] = value[:len(idx)][idx]
-
-        nb_batch = int(np.ceil(nb_sample_file / batch_size))
-        for batch in range(nb_batch):
-            batch_start = batch * batch_size
-            nb_read = min(nb_sample - nb_seen, batch_size)
-            batch_end = min(nb_sample_file, batch_start + nb_read)
-            _batch_size = batch_end - batch_start
-            if _batch_size == 0:
-                break
-
-            data_batch = dict()
+        with open_file(data_files[file_idx]) as h5_file:
+            data_file = dict()
             for name in names:
-                data_batch[name] = data_file[name][batch_start:batch_end]
-            yield data_batch
-
-            nb_seen += _batch_size
-            if nb_seen >= nb_sample:
-                break
+                data_file[name] = h5_file[name]
+            nb_sample_file = len(list(data_file.values())[0])
+
+            if shuffle:
+                # Shuffle data within the entire file, which requires reading
+                # the entire file into memory
+                idx = np.arange(nb_sample_file)
+                np.random.shuffle(idx)
+                for name, value in six.iteritems(data_file):
+                    data_file[name] = value[:len(idx)][idx]
+
+            nb_batch = int(np.ceil(nb_sample_file / batch_size))
+            for batch in range(nb_batch):
+                batch_start = batch * batch_size
+                nb_read = min(nb_sample - nb_seen, batch_size)
+                batch_end = min(nb_sample_file, batch_start + nb_read)
+                _batch_size = batch_end - batch_start
+                if _batch_size == 0:
+                    break
+
+                data_batch = dict()
+                for name in names:
+                    data_batch[name] = data_file[name][batch_start:batch_end]
+                yield data_batch
+
+                nb_seen += _batch_size
+                if nb_seen >= nb_sample:
+                    break
 
-        h5_file.close()
         file_idx += 1
         assert nb_seen <= nb_sample
         if nb_sample == nb_seen or file_idx == len(data_files):
@@ -0,0 +1,451 @@
+"""Functions for loading data batches in background processes."""
+
+from __future__ import division
+from __future__ import print_function
+
+from collections import deque, OrderedDict
+import multiprocessing as mp
+import sys
+import threading
+import time
+import traceback
+
+import numpy as np
+import six
+from six.moves import range
+from six.moves.queue import Empty, Full, Queue
+
+from . import hdf
+from ..utils import to_list
+
+# Alignment of arrays in shared memory buffers in bytes.
+ALIGN = 64
+
+
+class _ArrayRef(object):
+    """Placeholder of the `index`-th array of a flattened batch."""
+
+    def __init__(self, index):
+        self.index = index
+
+
+def _flatten(data, arrays):
+    """Replace arrays in nested `data` by :class:`_ArrayRef` and append them
+    to `arrays`."""
+    if isinstance(data, np.ndarray):
+        arrays.append(data)
+        return _ArrayRef(len(arrays) - 1)
+    elif isinstance(data, dict):
+        return data.__class__((key, _flatten(value, arrays))
+                              for key, value in six.iteritems(data))
+    elif isinstance(data, (list, tuple)):
+        return data.__class__(_flatten(value, arrays) for value in data)
+    return data
+
+
+def _unflatten(data, arrays):
+    """Inverse of :func:`_flatten`."""
+    if isinstance(data, _ArrayRef):
+        return arrays[data.index]
+    elif isinstance(data, dict):
+        return data.__class__((key, _unflatten(value, arrays))
+                              for key, value in six.iteritems(data))
+    elif isinstance(data, (list, tuple)):
+        return data.__class__(_unflatten(value, arrays) for value in data)
+    return data
+
+
+def _get_aligned(nbytes):
+    return int(np.ceil(nbytes / ALIGN)) * ALIGN
+
+
+def write_batch(batch, buf):
+    """Write arrays of `batch` into shared memory buffer `buf`.
+
+    Parameters
+    ----------
+    batch: object
+        Batch, which can be an array, or a nested `dict`, `list`, or `tuple` of
+        arrays.
+    buf: :class:`numpy.ndarray`
+        `uint8` buffer.
+
+    Returns
+    -------
+    tuple
+        `tuple` (template, meta) for reading the batch by :func:`read_batch`.
+    """
+    arrays = []
+    template = _flatten(batch, arrays)
+    meta = []
+    offset = 0
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        if offset + array.nbytes > len(buf):
+            raise ValueError('Batch does not fit into buffer of %d bytes!' %
+                             len(buf))
+        buf[offset:(offset + array.nbytes)] = array.reshape(-1).view(np.uint8)
+        meta.append((array.dtype.str, array.shape, offset))
+        offset += _get_aligned(array.nbytes)
+    return (template, meta)
+
+
+def read_batch(template, meta, buf):
+    """Read batch written by :func:`write_batch` from `buf` without copying
+    arrays."""
+    arrays = []
+    for dtype, shape, offset in meta:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        array = np.frombuffer(buf, dtype=dtype, count=count, offset=offset)
+        arrays.append(array.reshape(shape))
+    return _unflatten(template, arrays)
+
+
+def get_batch_nbytes(batch, batch_size):
+    """Return number of bytes of buffer for batches of size `batch_size` with
+    the same arrays as `batch`."""
+    arrays = []
+    _flatten(batch, arrays)
+    nbytes = 0
+    for array in arrays:
+        sample_nbytes = array.nbytes / max(len(array), 1)
+        nbytes += _get_aligned(int(np.ceil(sample_nbytes * batch_size)))
+    return nbytes
+
+
+def split_data_files(data_files, nb_worker, nb_sample=None):
+    """Split data files between workers.
+
+    Parameters
+    ----------
+    data_files: list
+        `list` of data files.
+    nb_worker: int
+        Number of workers.
+    nb_sample: int
+        Maximum number of samples. If defined, only the first files with at
+        least `nb_sample` samples are selected, like by :func:`hdf.reader`.
+
+    Returns
+    -------
+    list
+        `list` with `tuple` (data_files, nb_sample) of each worker, which is
+        empty for workers without files.
+    """
+    data_files = to_list(data_files)
+    files = []
+    nb_samples = []
+    nb_seen = 0
+    for data_file, nb_sample_file in zip(data_files,
+                                         hdf.iter_nb_sample(data_files)):
+        if nb_sample:
+            nb_sample_file = min(nb_sample_file, nb_sample - nb_seen)
+        files.append(data_file)
+        nb_samples.append(nb_sample_file)
+        nb_seen += nb_sample_file
+        if nb_sample and nb_seen >= nb_sample:
+            break
+    splits = []
+    for worker in range(min(nb_worker, len(files))):
+        splits.append((files[worker::nb_worker],
+                       int(np.sum(nb_samples[worker::nb_worker]))))
+    return splits
+
+
+def _read_worker(worker, reader, data_files, seed, buffers, free_queue,
+                 ready_queue, kwargs):
+    """Writes batches of `reader` into shared memory buffers."""
+    try:
+        np.random.seed(seed)
+        buffers = [np.frombuffer(buf, dtype=np.uint8) for buf in buffers]
+        for batch in reader(data_files, **kwargs):
+            slot = free_queue.get()
+            template, meta = write_batch(batch, buffers[slot])
+            ready_queue.put((worker, slot, template, meta))
+        ready_queue.put((worker, None, None, None))
+    except Exception:
+        ready_queue.put((worker, None, traceback.format_exc(), None))
+
+
+class ProcessReader(object):
+    """Reads data batches in multiple processes.
+
+    Splits `data_files` between `nb_worker` processes, which read batches with
+    `reader` from their files and write them into a ring of shared memory
+    buffers. Batches are returned as views on buffers without copying, and a
+    buffer is only reused after `nb_hold` following batches were returned,
+    such that the last `nb_hold` batches can be held, e.g. in the queue of
+    :meth:`keras.models.Model.fit_generator`.
+
+    Batches of different workers are returned in the order in which they are
+    completed, such that :class:`ProcessReader` should not be used if the order
+    of batches matters.
+
+    Processes are started on construction. Forking a process that runs other
+    threads, e.g. of TensorFlow, can deadlock child processes, such that
+    :class:`ProcessReader` should then either be created before these threads
+    are started, or use the start method `'forkserver'` or `'spawn'`, which
+    requires `reader` and `kwargs` to be picklable.
+
+    Parameters
+    ----------
+    reader: function
+        Function `reader(data_files, batch_size, nb_sample, loop, **kwargs)`
+        that returns a generator of batches, e.g. :func:`hdf.reader`. Batches
+        can be arrays, or nested `dict`, `list`, or `tuple` of arrays, which
+        are not larger than the first batch of `data_files` times
+        `batch_size`.
+    data_files: list
+        `list` of data files.
+    nb_worker: int
+        Number of processes.
+    nb_hold: int
+        Number of returned batches that are not overwritten.
+    batch_size: int
+        Batch size.
+    nb_sample: int
+        Maximum number of samples that are read.
+    loop: bool
+        If `True`, loop over samples infinitely.
+    nb_slot: int
+        Number of shared memory buffers. Defaults to two buffers per worker
+        plus the buffers of held batches.
+    start_method: str
+        Start method of processes, e.g. `'forkserver'`, as supported by
+        :func:`multiprocessing.get_context` on Python 3. If `None`, use the
+        default start method.
+    **kwargs: dict
+        Named arguments passed to `reader`.
+    """
+
+    def __init__(self, reader, data_files, nb_worker=2, nb_hold=1,
+                 batch_size=128, nb_sample=None, loop=False, nb_slot=None,
+                 start_method=None, **kwargs):
+        data_files = to_list(data_files)
+        kwargs['batch_size'] = batch_size
+
+        # Allocate buffers for batches with the size of the first batch
+        first_kwargs = dict(kwargs)
+        first_kwargs.update(nb_sample=batch_size, loop=False)
+        first_reader = reader(data_files[:1], **first_kwargs)
+        batch = next(first_reader)
+        first_reader.close()
+        nbytes = get_batch_nbytes(batch, batch_size)
+        # HDF5 files should not be open when forking processes
+        hdf.get_file_pool().close()
+        if nb_slot is None:
+            nb_slot = 2 * nb_worker + nb_hold + 1
+        if nb_slot <= nb_hold + 1:
+            raise ValueError('nb_slot must be larger than nb_hold + 1!')
+        self.nb_hold = nb_hold
+        ctx = mp.get_context(start_method) if start_method else mp
+        self._buffers = [ctx.RawArray('B', nbytes) for slot in range(nb_slot)]
+        self._views = [np.frombuffer(buf, dtype=np.uint8)
+                       for buf in self._buffers]
+        self._free_queue = ctx.Queue()
+        for slot in range(nb_slot):
+            self._free_queue.put(slot)
+        self._ready_queue = ctx.Queue()
+        self._held = deque()
+
+        self._processes = []
+        for worker, (worker_files, worker_nb_sample) in enumerate(
+                split_data_files(data_files, nb_worker, nb_sample)):
+            worker_kwargs = dict(kwargs)
+            worker_kwargs.update(nb_sample=worker_nb_sample, loop=loop)
+            seed = np.random.randint(0, 2**31 - 1)
+            process = ctx.Process(target=_read_worker,
+                                  args=(worker, reader, worker_files, seed,
+                                        self._buffers, self._free_queue,
+                                        self._ready_queue, worker_kwargs))
+            process.daemon = True
+            process.start()
+            self._processes.append(process)
+        self._running = set(range(len(self._processes)))
+
+    def _check(self):
+        for worker in self._running:
+            process = self._processes[worker]
+            if not process.is_alive():
+                raise RuntimeError('Reader process terminated with exit code '
+                                   '%s!' % process.exitcode)
+
+    def _get(self):
+        while True:
+            try:
+                return self._ready_queue.get(timeout=1)
+            except Empty:
+                self._check()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while self._running:
+            worker, slot, template, meta = self._get()
+            if slot is None:
+                if template is not None:
+                    self.close()
+                    raise RuntimeError('Reader process failed:\n%s' %
+                                       template)
+                self._running.discard(worker)
+                continue
+            self._held.append(slot)
+            if len(self._held) > self.nb_hold + 1:
+                self._free_queue.put(self._held.popleft())
+            batch = read_batch(template, meta, self._views[slot])
+            return batch
+        raise StopIteration()
+
+    def next(self):
+        return self.__next__()
+
+    def close(self):
+        """Terminate reader processes."""
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        self._running = set()
+
+
+class Prefetcher(object):
+    """Reads batches of a generator in a background thread.
+
+    Reads up to `depth` batches of `generator` ahead into a queue, such that
+    reading and preprocessing data overlaps with computations on the previous
+    batch, e.g. :meth:`keras.models.Model.predict`. Batches are returned in the
+    same order as by `generator`.
+
+    Statistics about the occupancy of the queue are returned by
+    :meth:`stats`. If the queue is mostly empty, the consumer is waiting for
+    data (I/O-bound). If the queue is mostly full, the generator is waiting
+    for the consumer (compute-bound).
+
+    Parameters
+    ----------
+    generator: generator
+        Generator of batches, e.g. from :func:`hdf.reader` or
+        :class:`models.DataReader`.
+    depth: int
+        Maximum number of batches that are read ahead.
+    """
+
+    _END = object()
+
+    def __init__(self, generator, depth=2):
+        self.depth = depth
+        self.nb_batch = 0
+        self.nb_empty = 0
+        self.nb_full = 0
+        self.sum_size = 0
+        self.wait_get = 0.0
+        self.wait_put = 0.0
+        self._error = None
+        self._queue = Queue(depth)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read, args=(generator,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        start = time.time()
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                break
+            except Full:
+                pass
+        self.wait_put += time.time() - start
+
+    def _read(self, generator):
+        try:
+            for batch in generator:
+                if self._stop.is_set():
+                    break
+                if self._queue.full():
+                    self.nb_full += 1
+                self._put(batch)
+        except Exception:
+            self._error = sys.exc_info()
+        finally:
+            if hasattr(generator, 'close'):
+                generator.close()
+        self._put(self._END)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._thread is None:
+            raise StopIteration()
+        size = self._queue.qsize()
+        start = time.time()
+        batch = self._queue.get()
+        self.wait_get += time.time() - start
+        if batch is self._END:
+            self._thread.join()
+            self._thread = None
+            if self._error is not None:
+                six.reraise(*self._error)
+            raise StopIteration()
+        self.nb_batch += 1
+        self.sum_size += size
+        if size == 0:
+            self.nb_empty += 1
+        return batch
+
+    def next(self):
+        return self.__next__()
+
+    def close(self):
+        """Stop reading batches."""
+        if self._thread is not None:
+            self._stop.set()
+            while self._thread.is_alive():
+                try:
+                    self._queue.get(timeout=0.1)
+                except Empty:
+                    pass
+            self._thread = None
+
+    def stats(self):
+        """Return statistics about the occupancy of the queue.
+
+        Returns
+        -------
+        OrderedDict
+            `OrderedDict` with the number of returned batches ('nb_batch'),
+            the mean number of queued batches when a batch was requested
+            ('mean_size'), the fraction of requests to an empty queue
+            ('frac_empty'), the fraction of batches that were read while the
+            queue was full ('frac_full'), and the total time in seconds the
+            consumer waited for batches ('wait_get') and the generator waited
+            for free space ('wait_put').
+        """
+        nb_batch = max(self.nb_batch, 1)
+        stats = OrderedDict()
+        stats['nb_batch'] = self.nb_batch
+        stats['mean_size'] = self.sum_size / nb_batch
+        stats['frac_empty'] = self.nb_empty / nb_batch
+        stats['frac_full'] = self.nb_full / nb_batch
+        stats['wait_get'] = self.wait_get
+        stats['wait_put'] = self.wait_put
+        return stats
+
+    def __str__(self):
+        stats = self.stats()
+        return ('%d batches, mean queue size %.1f / %d, %.0f%% empty, '
+                '%.0f%% full, consumer waited %.1fs, reader waited %.1fs' %
+                (stats['nb_batch'], stats['mean_size'], self.depth,
+                 stats['frac_empty'] * 100, stats['frac_full'] * 100,
+                 stats['wait_get'], stats['wait_put']))
+
+
+def prefetch(generator, depth=2):
+    """Return :class:`Prefetcher` of `generator` if `depth` is larger than
+    zero and `generator` otherwise."""
+    if depth and depth > 0:
+        return Prefetcher(generator, depth)
+    return generator
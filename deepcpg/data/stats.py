@@ -8,6 +8,8 @@ CpG matrix x assumed to have shape
 from __future__ import division
 from __future__ import print_function
 
+from collections import OrderedDict
+
 import numpy as np
 
 from ..utils import EPS, get_from_module
@@ -72,3 +74,165 @@ def diff(x):
 def get(name):
     """Return object from module by its name."""
     return get_from_module(name, globals())
+
+
+def _derive_stats(names, mean, get_var, get_min_max, mask):
+    """Derive statistics `names` from the mean, variance, minimum and maximum
+    of methylation states.
+
+    `get_var` and `get_min_max` are functions, which are only evaluated if
+    required.
+    """
+    stats = OrderedDict()
+    for name in names:
+        _name = name.lower()
+        if _name == 'mean':
+            stat = mean
+        elif _name == 'mode':
+            stat = mean.round().astype(np.int8)
+        elif _name == 'var':
+            stat = get_var()
+        elif _name in ['cat_var', 'cat2_var']:
+            bins = np.linspace(-EPS, 0.25, 3 + 1)
+            stat = np.digitize(get_var(), bins, right=True) - 1
+            if _name == 'cat2_var':
+                stat[stat > 0] = 1
+        elif _name == 'entropy':
+            p1 = np.minimum(1 - EPS, np.maximum(EPS, mean))
+            p0 = 1 - p1
+            stat = -(p1 * np.log(p1) + p0 * np.log(p0))
+        elif _name == 'diff':
+            _min, _max = get_min_max()
+            stat = _min != _max.astype(np.int8)
+        else:
+            raise ValueError('Invalid identifier "%s"!' % name)
+        stats[name] = np.ma.masked_array(stat, mask)
+    return stats
+
+
+def sparse_stats(names, indptr, values):
+    """Compute per CpG statistics from sparse CpG matrix.
+
+    Computes statistics of this module for a [sites, cells] matrix in
+    compressed sparse row (CSR) format, where `values[indptr[i]:indptr[i + 1]]`
+    are the observed states of site `i`. Unlike functions for masked arrays,
+    unobserved states are never materialized.
+
+    Parameters
+    ----------
+    names: list
+        Names of statistics, e.g. ['mean', 'var'].
+    indptr: :class:`numpy.ndarray`
+        :class:`numpy.ndarray` of size [sites + 1] with row pointers.
+    values: :class:`numpy.ndarray`
+        :class:`numpy.ndarray` with observed states.
+
+    Returns
+    -------
+    OrderedDict
+        `OrderedDict` (name, stat) with :class:`numpy.ma.MaskedArray` of size
+        [sites]. Sites without observations are masked.
+    """
+    nb_site = len(indptr) - 1
+    nb_obs = np.diff(indptr)
+    mask = nb_obs == 0
+    sites = np.repeat(np.arange(nb_site), nb_obs)
+    _nb_obs = np.maximum(nb_obs, 1)
+    mean = np.bincount(sites, weights=values, minlength=nb_site) / _nb_obs
+
+    def get_var():
+        dev = values - mean[sites]
+        var = np.bincount(sites, weights=dev * dev, minlength=nb_site)
+        return var / _nb_obs
+
+    def get_min_max():
+        _min = np.zeros(nb_site, dtype=values.dtype)
+        _max = np.zeros(nb_site, dtype=values.dtype)
+        if len(values):
+            starts = indptr[:-1][~mask]
+            _min[~mask] = np.minimum.reduceat(values, starts)
+            _max[~mask] = np.maximum.reduceat(values, starts)
+        return (_min, _max)
+
+    return _derive_stats(names, mean, get_var, get_min_max, mask)
+
+
+class WindowStats(object):
+    """Window-based statistics of CpG profiles.
+
+    Computes statistics of this module in windows centered on target sites.
+    As for [sites, cells, context] matrices, states of each cell are first
+    averaged within windows, and the resulting means then summarized across
+    cells. Windows include the state of target sites themselves. Window bounds
+    are found by binary search and window sums by prefix sums, such that the
+    costs do not depend on the window length.
+
+    Parameters
+    ----------
+    cpg_tables: list
+        List of tuples `(pos, value)` with sorted positions and states of each
+        cell.
+    """
+
+    def __init__(self, cpg_tables):
+        self.pos = []
+        self.csum = []
+        for pos, value in cpg_tables:
+            csum = np.zeros(len(value) + 1)
+            np.cumsum(value, out=csum[1:])
+            self.pos.append(pos)
+            self.csum.append(csum)
+
+    def __call__(self, names, pos, wlen):
+        """Compute statistics `names` in windows of length `wlen`.
+
+        Parameters
+        ----------
+        names: list
+            Names of statistics, e.g. ['mean', 'var'].
+        pos: :class:`numpy.ndarray`
+            Positions of target sites.
+        wlen: int
+            Window length.
+
+        Returns
+        -------
+        OrderedDict
+            `OrderedDict` (name, stat) with :class:`numpy.ma.MaskedArray` of
+            size [sites]. Sites without observations in windows are masked.
+        """
+        delta = wlen // 2
+        nb_site = len(pos)
+        nb_cell = np.zeros(nb_site, dtype=np.int32)
+        sum1 = np.zeros(nb_site)
+        sum2 = np.zeros(nb_site)
+        _min = np.empty(nb_site)
+        _min.fill(np.inf)
+        _max = np.empty(nb_site)
+        _max.fill(-np.inf)
+        for cell_pos, cell_csum in zip(self.pos, self.csum):
+            if not len(cell_pos):
+                continue
+            start = np.searchsorted(cell_pos, pos - delta, side='left')
+            end = np.searchsorted(cell_pos, pos + delta, side='right')
+            cell_sum = cell_csum[end] - cell_csum[start]
+            cell_nb = end - start
+            obs = cell_nb > 0
+            cell_mean = cell_sum[obs] / cell_nb[obs]
+            nb_cell[obs] += 1
+            sum1[obs] += cell_mean
+            sum2[obs] += cell_mean**2
+            _min[obs] = np.minimum(_min[obs], cell_mean)
+            _max[obs] = np.maximum(_max[obs], cell_mean)
+
+        mask = nb_cell == 0
+        _nb_cell = np.maximum(nb_cell, 1)
+        mean = sum1 / _nb_cell
+
+        def get_var():
+            return np.maximum(0, sum2 / _nb_cell - mean**2)
+
+        def get_min_max():
+            return (np.where(mask, 0, _min), np.where(mask, 0, _max))
+
+        return _derive_stats(names, mean, get_var, get_min_max, mask)
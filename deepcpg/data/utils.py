@@ -3,17 +3,21 @@
 from __future__ import division
 from __future__ import print_function
 
+from collections import OrderedDict
 import gzip
+import hashlib
+import json
+import os
 import threading
 import re
 
-import h5py as h5
 import numpy as np
 import pandas as pd
 import six
 from six.moves import range
 
 from . import hdf
+from ..utils import make_dir
 
 # Constant for missing labels.
 CPG_NAN = -1
@@ -108,10 +112,8 @@ def get_nb_sample(data_files, nb_max=None, batch_size=None):
         Number of samples in `data_files`.
     """
     nb_sample = 0
-    for data_file in data_files:
-        data_file = h5.File(data_file, 'r')
-        nb_sample += len(data_file['pos'])
-        data_file.close()
+    for nb_sample_file in hdf.iter_nb_sample(data_files):
+        nb_sample += nb_sample_file
         if nb_max and nb_sample > nb_max:
             nb_sample = nb_max
             break
@@ -122,8 +124,8 @@ def get_nb_sample(data_files, nb_max=None, batch_size=None):
 
 def get_dna_wlen(data_file, max_len=None):
     """Return length of DNA sequence windows stored in `data_file`."""
-    data_file = h5.File(data_file, 'r')
-    wlen = data_file['/inputs/dna'].shape[1]
+    with hdf.open_file(data_file) as h5_file:
+        wlen = h5_file['/inputs/dna'].shape[1]
     if max_len:
         wlen = min(max_len, wlen)
     return wlen
@@ -131,9 +133,9 @@ def get_dna_wlen(data_file, max_len=None):
 
 def get_cpg_wlen(data_file, max_len=None):
     """Return number of CpG neighbors stored in `data_file`."""
-    data_file = h5.File(data_file, 'r')
-    group = data_file['/inputs/cpg']
-    wlen = group['%s/dist' % list(group.keys())[0]].shape[1]
+    with hdf.open_file(data_file) as h5_file:
+        group = h5_file['/inputs/cpg']
+        wlen = group['%s/dist' % list(group.keys())[0]].shape[1]
     if max_len:
         wlen = min(max_len, wlen)
     return wlen
@@ -163,6 +165,130 @@ def get_anno_names(data_file, *args, **kwargs):
                   *args, **kwargs)
 
 
+def count_output(output):
+    """Count observed values of output `output`.
+
+    Returns
+    -------
+    OrderedDict
+        `OrderedDict` with the number of samples ('nb_tot') and observed
+        samples ('nb_obs'), the sum ('sum') and sum of squares ('sum2') of
+        observed values, and the number of observed samples per label
+        ('counts') if `output` is integer-valued, where index `i` of 'counts'
+        is the number of samples with label `i`.
+    """
+    output = np.asarray(output)
+    obs = output[output != CPG_NAN]
+    counts = OrderedDict()
+    counts['nb_tot'] = len(output)
+    counts['nb_obs'] = len(obs)
+    counts['sum'] = float(np.sum(obs, dtype=np.float64))
+    counts['sum2'] = float(np.sum(np.square(obs, dtype=np.float64)))
+    counts['counts'] = None
+    if np.issubdtype(output.dtype, np.integer) and np.all(obs >= 0):
+        counts['counts'] = np.bincount(obs).tolist()
+    return counts
+
+
+def add_output_counts(counts, other):
+    """Add counts `other` from :func:`count_output` to `counts` in-place."""
+    for key in ['nb_tot', 'nb_obs', 'sum', 'sum2']:
+        counts[key] += other[key]
+    if counts['counts'] is None or other['counts'] is None:
+        counts['counts'] = None
+    else:
+        a, b = counts['counts'], other['counts']
+        if len(a) < len(b):
+            a, b = b, a
+        counts['counts'] = [x + (b[i] if i < len(b) else 0)
+                            for i, x in enumerate(a)]
+    return counts
+
+
+def describe_data_file(data_file):
+    """Describe DeepCpG data file for the sample index.
+
+    Parameters
+    ----------
+    data_file: str
+        Name of DeepCpG data file.
+
+    Returns
+    -------
+    OrderedDict
+        `OrderedDict` with the size and modification time of `data_file`, the
+        number of samples, chromosomes, minimum and maximum position, the
+        shape of all datasets, and label counts of outputs like
+        :func:`count_output`.
+    """
+    stat = os.stat(data_file)
+    entry = OrderedDict()
+    entry['size'] = stat.st_size
+    entry['mtime'] = stat.st_mtime
+    names = [name.lstrip('/') for name in hdf.ls(data_file, recursive=True)]
+    with hdf.open_file(data_file) as h5_file:
+        pos = h5_file['pos'][()]
+        entry['nb_sample'] = len(pos)
+        entry['chromos'] = [chromo.decode() for chromo in
+                            np.unique(h5_file['chromo'][()])]
+        entry['pos_min'] = int(pos.min()) if len(pos) else None
+        entry['pos_max'] = int(pos.max()) if len(pos) else None
+        entry['shapes'] = OrderedDict()
+        entry['outputs'] = OrderedDict()
+        for name in names:
+            entry['shapes'][name] = list(h5_file[name].shape)
+            if name.startswith('outputs/'):
+                entry['outputs'][name[len('outputs/'):]] = count_output(
+                    h5_file[name][()])
+    return entry
+
+
+def get_output_counts(data_files, name, nb_sample=None):
+    """Count observed values of output `name` in `data_files`.
+
+    Counts are read from the sample index if files are indexed, and outputs
+    are only read from files that are not indexed. If `nb_sample` is defined,
+    only the first `nb_sample` samples are counted.
+
+    Parameters
+    ----------
+    data_files: list
+        `list` with file name of DeepCpG data files.
+    name: str
+        Output name, e.g. 'cpg/cell'.
+    nb_sample: int
+        Maximum number of samples.
+
+    Returns
+    -------
+    OrderedDict
+        `OrderedDict` with counts like :func:`count_output`.
+    """
+    counts = None
+    nb_seen = 0
+    for data_file in data_files:
+        if nb_sample and nb_seen >= nb_sample:
+            break
+        entry = hdf.get_index_entry(data_file)
+        if entry is not None and name in entry['outputs'] and \
+                (not nb_sample or nb_seen + entry['nb_sample'] <= nb_sample):
+            file_counts = entry['outputs'][name]
+        else:
+            with hdf.open_file(data_file) as h5_file:
+                output = h5_file['outputs/%s' % name]
+                if nb_sample:
+                    output = output[:(nb_sample - nb_seen)]
+                else:
+                    output = output[()]
+            file_counts = count_output(output)
+        nb_seen += file_counts['nb_tot']
+        if counts is None:
+            counts = OrderedDict(file_counts)
+        else:
+            add_output_counts(counts, file_counts)
+    return counts
+
+
 def is_bedgraph(filename):
     """Test if `filename` is a bedGraph file.
 
@@ -186,7 +312,7 @@ def format_chromo(chromo):
     Makes name upper case, e.g. 'mt' -> 'MT' and removes 'chr',
     e.g. 'chr1' -> '1'.
     """
-    return chromo.str.upper().str.replace('^CHR', '')
+    return chromo.str.upper().str.replace('^CHR', '', regex=True)
 
 
 def sample_from_chromo(frame, nb_sample):
@@ -275,6 +401,288 @@ def read_cpg_profile(filename, chromos=None, nb_sample=None, round=False,
     return d
 
 
+def iter_cpg_profile(filename, chromos=None, chunksize=2**20):
+    """Iterate over blocks of CpG profile.
+
+    Reads TSV or bedGraph file like :func:`read_cpg_profile`, but in blocks of
+    `chunksize` rows, such that only one block is kept in memory as text.
+
+    Parameters
+    ----------
+    filename: str
+        Path of file, which can be gzip compressed.
+    chromos: list
+        List of formatted chromosomes to be read, e.g. ['1', 'X'].
+    chunksize: int
+        Maximum number of rows per block.
+
+    Returns
+    -------
+    generator
+        Generator of :class:`pandas.DataFrame` with columns `chromo`, `pos`,
+        `value` in file order. `chromo` is categorical with formatted
+        chromosome names, `pos` `int32`, and `value` `float32`.
+    """
+    if chromos is not None and not isinstance(chromos, list):
+        chromos = [str(chromos)]
+    cpg_file = GzipFile(filename, 'r')
+    try:
+        if is_bedgraph(cpg_file):
+            usecols = [0, 1, 3]
+            skiprows = 1
+        else:
+            usecols = [0, 1, 2]
+            skiprows = 0
+        dtype = {usecols[0]: 'category', usecols[1]: np.int32,
+                 usecols[2]: np.float32}
+        reader = pd.read_table(cpg_file, header=None, comment='#',
+                               usecols=usecols, dtype=dtype,
+                               skiprows=skiprows, chunksize=chunksize)
+        for d in reader:
+            d.columns = ['chromo', 'pos', 'value']
+            if np.any((d['value'] < 0) | (d['value'] > 1)):
+                raise ValueError('Methylation values must be between 0 and'
+                                 ' 1!')
+            # Format categories instead of individual rows
+            names = format_chromo(pd.Series(d['chromo'].cat.categories))
+            names, codes = np.unique(names.values.astype(str),
+                                     return_inverse=True)
+            codes = codes[d['chromo'].cat.codes.values]
+            d['chromo'] = pd.Categorical.from_codes(codes, names)
+            if chromos is not None:
+                d = d.loc[d['chromo'].isin(chromos)]
+            yield d
+    finally:
+        cpg_file.close()
+
+
+def get_file_fingerprint(filename):
+    """Return fingerprint of `filename` from its path, size, and modification
+    time."""
+    stat = os.stat(filename)
+    return [os.path.abspath(filename), stat.st_size, stat.st_mtime]
+
+
+def get_file_cache_dir(filename, cache_dir):
+    """Return directory in `cache_dir` for caching data parsed from
+    `filename`."""
+    key = hashlib.md5(os.path.abspath(filename).encode()).hexdigest()[:10]
+    return os.path.join(cache_dir, '%s_%s' % (os.path.basename(filename), key))
+
+
+def read_chromo_cache(filename, cache_dir, names):
+    """Read arrays of each chromosome parsed from `filename` from cache in
+    `cache_dir`.
+
+    Parameters
+    ----------
+    filename: str
+        File from which arrays were parsed.
+    cache_dir: str
+        Cache directory.
+    names: list
+        Names of arrays.
+
+    Returns
+    -------
+    OrderedDict
+        `OrderedDict (chromo, arrays)` with a tuple of memory-mapped arrays
+        `names` of each chromosome, or `None` if data are not cached or
+        `filename` changed since it was cached.
+    """
+    file_dir = get_file_cache_dir(filename, cache_dir)
+    index_file = os.path.join(file_dir, 'index.json')
+    if not os.path.isfile(index_file):
+        return None
+    with open(index_file, 'r') as f:
+        index = json.load(f)
+    if index['source'] != get_file_fingerprint(filename) or \
+            index.get('names') != list(names):
+        return None
+    arrays = [np.load(os.path.join(file_dir, '%s.npy' % name), mmap_mode='r')
+              for name in names]
+    data = OrderedDict()
+    for chromo, start, end in index['chromos']:
+        data[chromo] = tuple([array[start:end] for array in arrays])
+    return data
+
+
+def write_chromo_cache(filename, cache_dir, data, names, dtypes):
+    """Write arrays of each chromosome parsed from `filename` to cache in
+    `cache_dir`.
+
+    Arrays of all chromosomes are concatenated and stored in one `.npy` file
+    per name, such that they can be memory-mapped by
+    :func:`read_chromo_cache`.
+
+    Parameters
+    ----------
+    filename: str
+        File from which arrays were parsed.
+    cache_dir: str
+        Cache directory.
+    data: dict
+        `dict (chromo, arrays)` with a tuple of arrays `names` of each
+        chromosome.
+    names: list
+        Names of arrays.
+    dtypes: list
+        Data types of arrays.
+    """
+    file_dir = get_file_cache_dir(filename, cache_dir)
+    make_dir(file_dir)
+    index_file = os.path.join(file_dir, 'index.json')
+    # Invalidate cache before overwriting arrays
+    if os.path.exists(index_file):
+        os.remove(index_file)
+    index = {'source': get_file_fingerprint(filename), 'names': list(names),
+             'chromos': []}
+    start = 0
+    for chromo, arrays in six.iteritems(data):
+        index['chromos'].append([chromo, start, start + len(arrays[0])])
+        start += len(arrays[0])
+    for i, (name, dtype) in enumerate(zip(names, dtypes)):
+        array = [arrays[i] for arrays in six.itervalues(data)]
+        array = np.concatenate(array).astype(dtype) if array else \
+            np.empty(0, dtype=dtype)
+        np.save(os.path.join(file_dir, '%s.npy' % name), array)
+    with open(index_file + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.rename(index_file + '.tmp', index_file)
+
+
+def read_cpg_profile_cache(filename, cache_dir):
+    """Read CpG profile `filename` from cache in `cache_dir`.
+
+    Returns
+    -------
+    OrderedDict
+        CpG profile like :func:`read_cpg_profile_chromos` with memory-mapped
+        arrays, or `None` if the profile is not cached or changed since it was
+        cached.
+    """
+    return read_chromo_cache(filename, cache_dir, ['pos', 'value'])
+
+
+def write_cpg_profile_cache(filename, cache_dir, profile):
+    """Write CpG profile `profile` read from `filename` to cache in
+    `cache_dir`.
+
+    Positions and values of all chromosomes are stored in one `.npy` file each,
+    such that they can be memory-mapped by :func:`read_cpg_profile_cache`.
+    """
+    dtype = np.int8 if all([value.dtype == np.int8 for _, value
+                            in six.itervalues(profile)]) else np.float32
+    write_chromo_cache(filename, cache_dir, profile, ['pos', 'value'],
+                       [np.int32, dtype])
+
+
+def read_cpg_profile_chromos(filename, chromos=None, nb_sample=None,
+                             round=False, nb_sample_chromo=None,
+                             chunksize=2**20, cache_dir=None):
+    """Read CpG profile split by chromosome into compact arrays.
+
+    Streams the file with :func:`iter_cpg_profile` and stores positions and
+    methylation states of each chromosome as `int32` and `int8` (or `float32`)
+    arrays. Requires an order of magnitude less memory than
+    :func:`read_cpg_profile`, which stores chromosome names of each row.
+    Arguments and sampling are the same as for :func:`read_cpg_profile`.
+
+    If `cache_dir` is provided, the parsed profile is cached in binary format
+    and read from the cache as long as the size and modification time of
+    `filename` do not change. The cache is not used with `nb_sample` or
+    `nb_sample_chromo`, which depend on the order of rows in `filename`.
+
+    Returns
+    -------
+    OrderedDict
+        `OrderedDict (chromo, (pos, value))` sorted by chromosome name, with
+        sorted positions `pos` and methylation states `value`. States are
+        `int8` if binary and `float32` otherwise.
+    """
+    if cache_dir is not None and nb_sample is None and \
+            nb_sample_chromo is None:
+        profile = read_cpg_profile_cache(filename, cache_dir)
+        if profile is None:
+            profile = read_cpg_profile_chromos(filename, chunksize=chunksize)
+            write_cpg_profile_cache(filename, cache_dir, profile)
+        if chromos is not None:
+            if not isinstance(chromos, list):
+                chromos = [str(chromos)]
+            profile = OrderedDict([(chromo, value) for chromo, value
+                                   in six.iteritems(profile)
+                                   if chromo in chromos])
+            if not profile:
+                raise ValueError('No data available for selected'
+                                 ' chromosomes!')
+        # States are binary if binary on all selected chromosomes
+        values = [value for _, value in six.itervalues(profile)]
+        if round:
+            values = [np.round(value) for value in values]
+        if all([is_binary(value) for value in values]):
+            values = [value.astype(np.int8, copy=False) for value in values]
+        for chromo, value in zip(list(profile.keys()), values):
+            profile[chromo] = (profile[chromo][0], value)
+        return profile
+
+    chromo_pos = dict()
+    chromo_values = dict()
+    binary = True
+    limit = nb_sample if nb_sample_chromo is None else None
+    nb_read = 0
+    for d in iter_cpg_profile(filename, chromos=chromos, chunksize=chunksize):
+        if limit is not None:
+            d = d.iloc[:(limit - nb_read)]
+        nb_read += len(d)
+        values = d['value'].values
+        if round:
+            values = np.round(values)
+        if is_binary(values):
+            values = values.astype(np.int8)
+        else:
+            binary = False
+        # Stable sort keeps file order within chromosomes
+        codes = d['chromo'].cat.codes.values
+        idx = np.argsort(codes, kind='mergesort')
+        codes = codes[idx]
+        bounds = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+        bounds = np.hstack(([0], bounds, [len(codes)]))
+        pos = d['pos'].values
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if start == end:
+                continue
+            chromo = d['chromo'].cat.categories[codes[start]]
+            chromo_pos.setdefault(chromo, []).append(pos[idx[start:end]])
+            chromo_values.setdefault(chromo, []).append(
+                values[idx[start:end]])
+        if limit is not None and nb_read >= limit:
+            break
+
+    if chromos is not None and not chromo_pos:
+        raise ValueError('No data available for selected chromosomes!')
+
+    profile = OrderedDict()
+    nb_read = 0
+    for chromo in sorted(chromo_pos.keys()):
+        pos = np.concatenate(chromo_pos.pop(chromo))
+        values = np.concatenate(chromo_values.pop(chromo))
+        if not binary:
+            values = values.astype(np.float32)
+        if nb_sample_chromo is not None and len(pos) > nb_sample_chromo:
+            idx = np.random.choice(len(pos), nb_sample_chromo, replace=False)
+            pos = pos[idx]
+            values = values[idx]
+        if nb_sample is not None and nb_sample_chromo is not None:
+            pos = pos[:(nb_sample - nb_read)]
+            values = values[:(nb_sample - nb_read)]
+            nb_read += len(pos)
+            if not len(pos):
+                continue
+        idx = np.argsort(pos, kind='mergesort')
+        profile[chromo] = (pos[idx], values[idx])
+    return profile
+
+
 class GzipFile(object):
     """Wrapper to read and write gzip-compressed files.
 
@@ -16,6 +16,7 @@ import pandas as pd
 from .. import data as dat
 from .. import evaluation as ev
 from ..data import hdf, OUTPUT_SEP
+from ..data.loader import ProcessReader
 from ..data.dna import int_to_onehot
 from ..utils import to_list
 
@@ -586,7 +587,6 @@ class DataReader(object):
             prepro_dists = prepro_dists[:, :, tmp]
         return (prepro_states, prepro_dists)
 
-    @dat.threadsafe_generator
     def __call__(self, data_files, class_weights=None, *args, **kwargs):
         """Return generator for reading data from `data_files`.
 
@@ -596,6 +596,16 @@ class DataReader(object):
             List of data files to be read.
         class_weights: dict
             dict of dict with class weights of individual outputs.
+        nb_proc: int
+            If larger than one, read and preprocess data in `nb_proc`
+            processes using :class:`loader.ProcessReader`, which does not
+            preserve the order of batches.
+        nb_hold: int
+            Number of batches that are held by the caller if `nb_proc` is
+            larger than one. See :class:`loader.ProcessReader`.
+        start_method: str
+            Start method of processes if `nb_proc` is larger than one. See
+            :class:`loader.ProcessReader`.
         *args: list
             Unnamed arguments passed to :func:`hdf.reader`
         *kwargs: dict
@@ -604,8 +614,34 @@ class DataReader(object):
         Returns
         -------
         generator
-            Python generator for reading data.
+            Thread-safe Python generator for reading data. If `nb_proc` is
+            larger than one, processes are started before returning, and not
+            by the thread that first reads from the generator.
         """
+        nb_proc = kwargs.pop('nb_proc', 1)
+        nb_hold = kwargs.pop('nb_hold', 1)
+        start_method = kwargs.pop('start_method', None)
+        if nb_proc > 1:
+            if args:
+                raise ValueError('Arguments must be named if nb_proc > 1!')
+            reader = ProcessReader(self._read, data_files, nb_worker=nb_proc,
+                                   nb_hold=nb_hold, start_method=start_method,
+                                   class_weights=class_weights, **kwargs)
+            return dat.threadsafe_iter(self._iter_reader(reader))
+        return dat.threadsafe_iter(self._read(data_files, class_weights,
+                                              *args, **kwargs))
+
+    def _iter_reader(self, reader):
+        """Yield batches of :class:`loader.ProcessReader` `reader` and close
+        it afterwards."""
+        try:
+            for data in reader:
+                yield data
+        finally:
+            reader.close()
+
+    def _read(self, data_files, class_weights=None, *args, **kwargs):
+        """Read and preprocess data from `data_files`."""
         names = []
         if self.use_dna:
             names.append('inputs/dna')
@@ -47,9 +47,14 @@ from __future__ import print_function
 from __future__ import division
 
 from collections import OrderedDict
+from glob import glob
+import hashlib
+import json
+import multiprocessing as mp
 import os
 import sys
 import warnings
+import zlib
 
 import argparse
 import logging
@@ -59,33 +64,80 @@ import pandas as pd
 
 import six
 from six.moves import range
+from six.moves.queue import Full
 
 from deepcpg import data as dat
 from deepcpg.data import annotations as an
 from deepcpg.data import stats
 from deepcpg.data import dna
 from deepcpg.data import fasta
+from deepcpg.data import hdf
 from deepcpg.data import feature_extractor as fext
 from deepcpg.utils import make_dir
 
+# Name of manifest file in output directory, which records the fingerprint
+# and chunk files of each chromosome for resuming data creation.
+MANIFEST = 'manifest.json'
+
+# Version of chunk files, which is part of fingerprints.
+FORMAT_VERSION = 1
+
+# Options that do not change chunk files, or whose effect is captured by
+# fingerprints of input data.
+FINGERPRINT_EXCLUDE = ['pos_file', 'all_cpgs', 'regions', 'cpg_profiles',
+                       'dna_files', 'anno_files', 'anno_cache_dir', 'out_dir',
+                       'chromos', 'nb_sample', 'nb_sample_chromo',
+                       'cpg_cache_dir', 'nb_worker', 'write_queue',
+                       'overwrite', 'verbose', 'log_file']
+
 
 def prepro_pos_table(pos_tables):
-    """Extracts unique positions and sorts them."""
+    """Extracts unique positions and sorts them.
+
+    Positions of all tables are encoded as `int64` keys of chromosome code and
+    position, such that the union of tables is computed by a single
+    :func:`numpy.unique` instead of repeatedly merging tables.
+
+    Parameters
+    ----------
+    pos_tables: list
+        :class:`pandas.DataFrame` or list of :class:`pandas.DataFrame` with
+        columns `chromo` and `pos`.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        :class:`pandas.DataFrame` with unique positions sorted by columns
+        `chromo` and `pos`. `chromo` is categorical.
+    """
     if not isinstance(pos_tables, list):
         pos_tables = [pos_tables]
 
-    pos_table = None
-    for next_pos_table in pos_tables:
-        if pos_table is None:
-            pos_table = next_pos_table
+    # Chromosome names and codes of each table
+    table_chromos = []
+    for pos_table in pos_tables:
+        chromo = pos_table['chromo']
+        if hasattr(chromo, 'cat'):
+            names = np.asarray(chromo.cat.categories, dtype=str)
+            codes = chromo.cat.codes.values
         else:
-            pos_table = pd.concat([pos_table, next_pos_table])
-        pos_table = pos_table.groupby('chromo').apply(
-            lambda df: pd.DataFrame({'pos': np.unique(df['pos'])}))
-        pos_table.reset_index(inplace=True)
-        pos_table = pos_table[['chromo', 'pos']]
-        pos_table.sort_values(['chromo', 'pos'], inplace=True)
-    return pos_table
+            names, codes = np.unique(chromo.values.astype(str),
+                                     return_inverse=True)
+        table_chromos.append((names, codes))
+    chromos = np.unique(np.concatenate(
+        [names for names, _ in table_chromos] + [np.empty(0, dtype=str)]))
+
+    keys = []
+    for pos_table, (names, codes) in zip(pos_tables, table_chromos):
+        codes = np.searchsorted(chromos, names)[codes].astype(np.int64)
+        pos = pos_table['pos'].values.astype(np.int64)
+        keys.append((codes << 32) | pos)
+    keys = np.unique(np.concatenate(keys + [np.empty(0, dtype=np.int64)]))
+
+    chromo = pd.Categorical.from_codes(keys >> 32, chromos)
+    pos = (keys & 0xffffffff).astype(np.int32)
+    return pd.DataFrame({'chromo': chromo, 'pos': pos},
+                        columns=['chromo', 'pos'])
 
 
 def split_ext(filename):
@@ -93,37 +145,157 @@ def split_ext(filename):
     return os.path.basename(filename).split(os.extsep)[0]
 
 
-def read_cpg_profiles(filenames, log=None, *args, **kwargs):
+def _read_cpg_profile_job(job):
+    """Reads CpG profile in worker process."""
+    filename, kwargs = job
+    return dat.read_cpg_profile_chromos(filename, **kwargs)
+
+
+def read_cpg_profiles(filenames, log=None, nb_worker=1, **kwargs):
     """Read methylation profiles.
 
-    Input files can be gzip compressed.
+    Input files can be gzip compressed. Files are read in blocks and stored as
+    compact arrays by :func:`dat.read_cpg_profile_chromos`.
+
+    Parameters
+    ----------
+    filenames: list
+        Profile files.
+    log: function
+        Function for logging progress.
+    nb_worker: int
+        Number of processes for reading files in parallel. Files are read
+        sequentially if `nb_sample_chromo` is provided, since random samples
+        would otherwise depend on the number of processes.
+    **kwargs: dict
+        Named arguments passed to :func:`dat.read_cpg_profile_chromos`.
 
     Returns
     -------
     dict
         `dict (key, value)`, where `key` is the output name and `value` the CpG
-        table.
+        table, i.e. a `dict (chromo, (pos, value))` with sorted positions and
+        values of each chromosome. Keys are in the order of `filenames`.
     """
 
     cpg_profiles = OrderedDict()
-    for filename in filenames:
-        if log:
-            log(filename)
-        cpg_file = dat.GzipFile(filename, 'r')
-        output_name = split_ext(filename)
-        cpg_profile = dat.read_cpg_profile(cpg_file, sort=True, *args, **kwargs)
-        cpg_profiles[output_name] = cpg_profile
-        cpg_file.close()
+    nb_worker = min(nb_worker, len(filenames))
+    if nb_worker > 1 and kwargs.get('nb_sample_chromo') is None:
+        # Arrays of profiles are compact and cheap to transfer. Results are
+        # returned in the order of `filenames`.
+        pool = mp.Pool(nb_worker)
+        try:
+            jobs = [(filename, kwargs) for filename in filenames]
+            results = pool.imap(_read_cpg_profile_job, jobs)
+            for filename, cpg_profile in zip(filenames, results):
+                if log:
+                    log(filename)
+                cpg_profiles[split_ext(filename)] = cpg_profile
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for filename in filenames:
+            if log:
+                log(filename)
+            cpg_profiles[split_ext(filename)] = dat.read_cpg_profile_chromos(
+                filename, **kwargs)
     return cpg_profiles
 
 
-def extract_seq_windows(seq, pos, wlen, seq_index=1, assert_cpg=False):
+def get_pos_table(cpg_table):
+    """Returns table with positions of CpG table.
+
+    Chromosomes are stored as categorical column to reduce memory usage.
+    """
+    chromos = list(cpg_table.keys())
+    lens = [len(pos) for pos, _ in six.itervalues(cpg_table)]
+    codes = np.repeat(np.arange(len(chromos)), lens)
+    pos = [pos for pos, _ in six.itervalues(cpg_table)]
+    pos = np.concatenate(pos) if pos else np.empty(0, dtype=np.int32)
+    return pd.DataFrame({'chromo': pd.Categorical.from_codes(codes, chromos),
+                         'pos': pos}, columns=['chromo', 'pos'])
+
+
+def select_regions(pos_table, regions):
+    """Selects positions of `pos_table` that are within `regions`.
+
+    Parameters
+    ----------
+    pos_table: :class:`pandas.DataFrame`
+        :class:`pandas.DataFrame` with columns `chromo` and `pos`, which is
+        sorted by :func:`prepro_pos_table`.
+    regions: dict
+        `dict (chromo, (start, end))` with regions read by
+        :func:`an.read_anno_index`.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        :class:`pandas.DataFrame` with positions within regions.
+    """
+    idx = np.zeros(len(pos_table), dtype=bool)
+    for chromo, (start, end) in six.iteritems(regions):
+        chromo_idx = np.nonzero((pos_table.chromo == chromo).values)[0]
+        if len(chromo_idx):
+            idx[chromo_idx] = an.is_in(pos_table.pos.values[chromo_idx],
+                                       start, end)
+    return pos_table.loc[idx]
+
+
+def get_genome_pos_table(dna_files, chromos=None, regions=None, log=None):
+    """Returns table with positions of all CpG sites in DNA files.
+
+    CpG sites are enumerated from the integer-encoded sequence of each
+    chromosome by :func:`dna.get_cpg_pos`.
+
+    Parameters
+    ----------
+    dna_files: list
+        List of FASTA files or genome index.
+    chromos: list
+        Chromosomes that are scanned. If `None`, scan all chromosomes.
+    regions: dict
+        `dict (chromo, (start, end))` with regions read by
+        :func:`an.read_anno_index`. If provided, only regions are scanned.
+    log: function
+        Function for logging progress.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        :class:`pandas.DataFrame` with columns `chromo` and `pos`.
+    """
+    chromo_pos = OrderedDict()
+    for chromo in fasta.list_chromos(dna_files):
+        if chromos is not None and chromo not in chromos:
+            continue
+        if regions is not None and chromo not in regions:
+            continue
+        if log:
+            log(chromo)
+        seq = fasta.read_chromo(dna_files, chromo, encode=True)
+        if regions is None:
+            chromo_pos[chromo] = (dna.get_cpg_pos(seq), None)
+        else:
+            chromo_pos[chromo] = (dna.get_cpg_pos(seq, *regions[chromo]),
+                                  None)
+    return get_pos_table(chromo_pos)
+
+
+def extract_seq_windows(seq, pos, wlen, seq_index=1, assert_cpg=False,
+                        rng=None):
     """Extracts DNA sequence windows at positions.
 
+    Windows are gathered from a strided view of the integer-encoded sequence
+    without looping over positions. Windows that overlap with the ends of the
+    sequence are padded with N.
+
     Parameters
     ----------
-    seq: str
-        DNA sequence.
+    seq: str or :class:`numpy.ndarray`
+        DNA sequence or integer-encoded DNA sequence, e.g. from
+        :func:`dna.encode_seq`.
     pos: list
         Positions at which windows are extracted.
     wlen: int
@@ -132,6 +304,9 @@ def extract_seq_windows(seq, pos, wlen, seq_index=1, assert_cpg=False):
         Offset at which positions start.
     assert_cpg: bool
         If `True`, check if positions in `pos` point to CpG sites.
+    rng: :class:`numpy.random.RandomState`
+        Random number generator for replacing missing nucleotides. Uses
+        global generator if `None`.
 
     Returns
     -------
@@ -140,25 +315,43 @@ def extract_seq_windows(seq, pos, wlen, seq_index=1, assert_cpg=False):
     """
 
     delta = wlen // 2
-    nb_win = len(pos)
-    seq = seq.upper()
-    seq_wins = np.zeros((nb_win, wlen), dtype='int8')
-
-    for i in range(nb_win):
-        p = pos[i] - seq_index
-        if p < 0 or p >= len(seq):
-            raise ValueError('Position %d not on chromosome!' % (p + seq_index))
-        if seq[p:p + 2] != 'CG':
-            warnings.warn('No CpG site at position %d!' % (p + seq_index))
-        win = seq[max(0, p - delta): min(len(seq), p + delta + 1)]
-        if len(win) < wlen:
-            win = max(0, delta - p) * 'N' + win
-            win += max(0, p + delta + 1 - len(seq)) * 'N'
-            assert len(win) == wlen
-        seq_wins[i] = dna.char_to_int(win)
+    if not isinstance(seq, np.ndarray):
+        seq = dna.encode_seq(seq)
+    seq_len = len(seq)
+    nan = dna.CHAR_TO_INT['N']
+    pos = np.asarray(pos, dtype=np.int64) - seq_index
+
+    idx = (pos < 0) | (pos >= seq_len)
+    if np.any(idx):
+        raise ValueError('Position %d not on chromosome!' %
+                         (pos[idx][0] + seq_index))
+    is_cpg = seq[pos] == dna.CHAR_TO_INT['C']
+    is_cpg &= seq[np.minimum(pos + 1, seq_len - 1)] == dna.CHAR_TO_INT['G']
+    is_cpg &= pos + 1 < seq_len
+    for p in pos[~is_cpg]:
+        warnings.warn('No CpG site at position %d!' % (p + seq_index))
+
+    seq_wins = np.empty((len(pos), wlen), dtype='int8')
+    # Windows within sequence borders
+    inner = (pos >= delta) & (pos + delta < seq_len)
+    if seq_len >= wlen:
+        stride = seq.strides[0]
+        wins = np.lib.stride_tricks.as_strided(
+            seq, shape=(seq_len - wlen + 1, wlen), strides=(stride, stride))
+        seq_wins[inner] = wins[pos[inner] - delta]
+    # Windows overlapping with sequence borders
+    outer = ~inner
+    if np.any(outer):
+        idx = pos[outer, np.newaxis] + np.arange(-delta, delta + 1)
+        valid = (idx >= 0) & (idx < seq_len)
+        seq_wins[outer] = np.where(valid,
+                                   seq[np.clip(idx, 0, seq_len - 1)], nan)
+
     # Randomly choose missing nucleotides
-    idx = seq_wins == dna.CHAR_TO_INT['N']
-    seq_wins[idx] = np.random.randint(0, 4, idx.sum())
+    if rng is None:
+        rng = np.random
+    idx = seq_wins == nan
+    seq_wins[idx] = rng.randint(0, 4, idx.sum())
     assert seq_wins.max() < 4
     if assert_cpg:
         assert np.all(seq_wins[:, delta] == 3)
@@ -166,55 +359,154 @@ def extract_seq_windows(seq, pos, wlen, seq_index=1, assert_cpg=False):
     return seq_wins
 
 
-def map_values(values, pos, target_pos, dtype=None, nan=dat.CPG_NAN):
-    """Maps `values` array at positions `pos` to `target_pos`.
+def get_chromo_cpg_tables(cpg_tables, chromo):
+    """Returns `(pos, value)` arrays of all cells for chromosome `chromo`.
 
-    Inserts `nan` for uncovered positions.
+    `cpg_tables` are CpG tables read by :func:`read_cpg_profiles`. Returns
+    empty arrays for cells without CpG sites on `chromo`.
     """
-    assert len(values) == len(pos)
-    assert np.all(pos == np.sort(pos))
-    assert np.all(target_pos == np.sort(target_pos))
-
-    values = values.ravel()
-    pos = pos.ravel()
-    target_pos = target_pos.ravel()
-    idx = np.in1d(pos, target_pos)
-    pos = pos[idx]
-    values = values[idx]
-    if not dtype:
-        dtype = values.dtype
-    target_values = np.empty(len(target_pos), dtype=dtype)
-    target_values.fill(nan)
-    idx = np.in1d(target_pos, pos).nonzero()[0]
-    assert len(idx) == len(values)
-    assert np.all(target_pos[idx] == pos)
-    target_values[idx] = values
-    return target_values
-
-
-def map_cpg_tables(cpg_tables, chromo, chromo_pos):
-    """Maps values from cpg_tables to `chromo_pos`.
-
-    Positions in `cpg_tables` for `chromo`  must be a subset of `chromo_pos`.
-    Inserts `dat.CPG_NAN` for uncovered positions.
-    """
-    chromo_pos.sort()
-    mapped_tables = OrderedDict()
+    chromo_tables = OrderedDict()
     for name, cpg_table in six.iteritems(cpg_tables):
-        cpg_table = cpg_table.loc[cpg_table.chromo == chromo]
-        cpg_table = cpg_table.sort_values('pos')
-        mapped_table = map_values(cpg_table.value.values,
-                                  cpg_table.pos.values,
-                                  chromo_pos)
-        assert len(mapped_table) == len(chromo_pos)
-        mapped_tables[name] = mapped_table
-    return mapped_tables
+        if chromo in cpg_table:
+            chromo_tables[name] = cpg_table[chromo]
+        else:
+            dtypes = [value.dtype for _, value in six.itervalues(cpg_table)]
+            dtype = dtypes[0] if dtypes else np.float32
+            chromo_tables[name] = (np.empty(0, dtype=np.int32),
+                                   np.empty(0, dtype=dtype))
+    return chromo_tables
+
+
+def get_chromo_annos(annos, chromo):
+    """Returns `(start, end)` intervals of all annotations on chromosome
+    `chromo`.
+
+    `annos` are annotations read by :func:`an.read_anno_index`. Returns empty
+    arrays for annotations without intervals on `chromo`.
+    """
+    chromo_annos = OrderedDict()
+    for name, anno in six.iteritems(annos):
+        if chromo in anno:
+            chromo_annos[name] = anno[chromo]
+        else:
+            chromo_annos[name] = (np.empty(0, dtype=np.int32),
+                                  np.empty(0, dtype=np.int32))
+    return chromo_annos
+
+
+class CpgMatrix(object):
+    """Sparse site x cell matrix of observed methylation states.
+
+    Stores observed states in compressed sparse row (CSR) format, i.e. the
+    states of site `i` are `values[indptr[i]:indptr[i + 1]]`, which were
+    observed in cells `cells[indptr[i]:indptr[i + 1]]`. Unobserved states are
+    only materialized by :meth:`to_dense`.
+
+    Parameters
+    ----------
+    names: list
+        Names of cells.
+    indptr: :class:`numpy.ndarray`
+        Row pointers of size [sites + 1].
+    cells: :class:`numpy.ndarray`
+        Cell index of observed states.
+    values: :class:`numpy.ndarray`
+        Observed states.
+    """
+
+    def __init__(self, names, indptr, cells, values):
+        self.names = names
+        self.indptr = indptr
+        self.cells = cells
+        self.values = values
+
+    @classmethod
+    def from_tables(cls, cpg_tables, pos):
+        """Maps values from `cpg_tables` to sorted positions `pos`.
+
+        `cpg_tables` contains `(pos, value)` arrays of each cell as returned by
+        :func:`get_chromo_cpg_tables`. Values at positions that are not in
+        `pos` are ignored.
+        """
+        sites = []
+        cells = []
+        values = []
+        for cell, cpg_table in enumerate(six.itervalues(cpg_tables)):
+            cpg_pos, cpg_value = cpg_table
+            idx = np.searchsorted(pos, cpg_pos)
+            found = idx < len(pos)
+            found[found] = pos[idx[found]] == cpg_pos[found]
+            sites.append(idx[found])
+            cells.append(np.empty(found.sum(), dtype=np.int32))
+            cells[-1].fill(cell)
+            values.append(cpg_value[found])
+        sites = np.concatenate(sites)
+        # Stable sort, such that states of a site are ordered by cell
+        idx = np.argsort(sites, kind='mergesort')
+        indptr = np.zeros(len(pos) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(sites, minlength=len(pos)))
+        return cls(list(cpg_tables.keys()), indptr,
+                   np.concatenate(cells)[idx], np.concatenate(values)[idx])
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def coverage(self):
+        """Return number of observed states of each site."""
+        return np.diff(self.indptr)
+
+    def select(self, idx):
+        """Select sites by slice or boolean index `idx`."""
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            assert step == 1
+            indptr = self.indptr[start:(stop + 1)]
+            values = slice(indptr[0], indptr[-1])
+            return CpgMatrix(self.names, indptr - indptr[0],
+                             self.cells[values], self.values[values])
+        cov = self.coverage()
+        values = np.repeat(idx, cov)
+        indptr = np.zeros(idx.sum() + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(cov[idx])
+        return CpgMatrix(self.names, indptr,
+                         self.cells[values], self.values[values])
+
+    def stats(self, names):
+        """Compute per CpG statistics using :func:`stats.sparse_stats`."""
+        return stats.sparse_stats(names, self.indptr, self.values)
+
+    def to_dense(self, nan=dat.CPG_NAN):
+        """Return dense [sites, cells] matrix with `nan` for unobserved
+        states."""
+        mat = np.empty((len(self), len(self.names)), dtype=self.values.dtype)
+        mat.fill(nan)
+        sites = np.repeat(np.arange(len(self)), self.coverage())
+        mat[sites, self.cells] = self.values
+        return mat
 
 
 def format_out_of(out, of):
     return '%d / %d (%.1f%%)' % (out, of, out / of * 100)
 
 
+def get_cov_filter(cov, min_cov, keep_uncovered=False):
+    """Return boolean index of sites that are observed in at least `min_cov`
+    cells.
+
+    Sites that are not observed in any cell, e.g. sites enumerated with
+    `--all_cpgs`, are kept if `keep_uncovered` is `True`, since they are to be
+    imputed. Otherwise, all sites must be observed in at least one cell.
+    """
+    idx = cov >= min_cov
+    if keep_uncovered:
+        idx |= cov == 0
+    elif np.any(cov < 1):
+        raise ValueError('%d CpG sites are not observed in any cell! Use'
+                         ' --all_cpgs to keep sites without coverage.' %
+                         np.sum(cov < 1))
+    return idx
+
+
 def get_stats_meta(names):
     funs = OrderedDict()
     for name in names:
@@ -227,28 +519,490 @@ def get_stats_meta(names):
     return funs
 
 
-def select_dict(data, idx):
-    data = data.copy()
-    for key, value in six.iteritems(data):
-        if isinstance(value, dict):
-            data[key] = select_dict(value, idx)
+def write_chunk(filename, datasets):
+    """Writes data chunk file atomically.
+
+    Datasets are first written to a temporary file, which is renamed to
+    `filename` once complete. Partially written chunk files therefore never
+    appear in the output directory.
+
+    Parameters
+    ----------
+    filename: str
+        Name of chunk file.
+    datasets: OrderedDict
+        `OrderedDict (name, kwargs)` with keyword arguments of
+        :meth:`h5py.Group.create_dataset` for each dataset `name`. Empty groups
+        are created if `kwargs` is `None`.
+    """
+    tmp_filename = filename + '.tmp'
+    try:
+        chunk_file = h5.File(tmp_filename, 'w')
+        try:
+            for name, kwargs in six.iteritems(datasets):
+                if kwargs is None:
+                    chunk_file.require_group(name)
+                else:
+                    chunk_file.create_dataset(name, **kwargs)
+        finally:
+            chunk_file.close()
+        os.rename(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def _write_chunks(queue):
+    """Writes chunk files from `queue` until receiving `None`."""
+    while True:
+        chunk = queue.get()
+        if chunk is None:
+            break
+        write_chunk(*chunk)
+
+
+class ChunkWriter(object):
+    """Writes data chunk files in a background process.
+
+    Compressing and writing datasets with h5py does not release the GIL and
+    is therefore done by a separate process, such that the next chunk can be
+    computed while the previous chunk is written. At most `queue_size` chunks
+    are queued, which bounds memory usage.
+
+    Parameters
+    ----------
+    queue_size: int
+        Maximum number of queued chunks.
+    """
+
+    def __init__(self, queue_size=2):
+        self.queue = mp.Queue(queue_size)
+        self.process = mp.Process(target=_write_chunks, args=(self.queue,))
+        self.process.daemon = True
+        self.process.start()
+
+    def _check(self):
+        if not self.process.is_alive():
+            raise RuntimeError('Chunk writer terminated with exit code %s!' %
+                               self.process.exitcode)
+
+    def _put(self, chunk):
+        while True:
+            self._check()
+            try:
+                self.queue.put(chunk, timeout=1)
+                return
+            except Full:
+                pass
+
+    def write(self, filename, datasets):
+        """Queues chunk for writing. See :func:`write_chunk`."""
+        self._put((filename, datasets))
+
+    def close(self):
+        """Waits until all queued chunks are written."""
+        if self.process.is_alive():
+            self._put(None)
+            self.process.join()
+        if self.process.exitcode:
+            raise RuntimeError('Chunk writer terminated with exit code %s!' %
+                               self.process.exitcode)
+
+
+def is_chunk_complete(filename, nb_sample):
+    """Test if chunk file `filename` is complete with `nb_sample` samples."""
+    if not os.path.isfile(filename):
+        return False
+    try:
+        chunk_file = h5.File(filename, 'r')
+        try:
+            return len(chunk_file['pos']) == nb_sample
+        finally:
+            chunk_file.close()
+    except (IOError, OSError, KeyError):
+        return False
+
+
+def get_chromo_fingerprint(chromo, chromo_pos, cpg_tables, annos, opts):
+    """Return fingerprint of inputs and options of chromosome `chromo`.
+
+    Chunk files of `chromo` only need to be recreated if the fingerprint
+    changes.
+
+    Returns
+    -------
+    str
+        MD5 hex digest.
+    """
+    config = dict()
+    for key, value in six.iteritems(vars(opts)):
+        if key not in FINGERPRINT_EXCLUDE:
+            config[key] = value
+    config['format_version'] = FORMAT_VERSION
+    config['chromo'] = chromo
+    if opts.dna_files:
+        config['dna_file'] = dat.get_file_fingerprint(
+            fasta.get_chromo_file(opts.dna_files, chromo))
+
+    md5 = hashlib.md5()
+    md5.update(json.dumps(config, sort_keys=True).encode())
+    md5.update(np.ascontiguousarray(chromo_pos, dtype=np.int64))
+    if cpg_tables:
+        for name, (cpg_pos, cpg_value) in six.iteritems(cpg_tables):
+            md5.update(name.encode())
+            md5.update(cpg_value.dtype.str.encode())
+            md5.update(np.ascontiguousarray(cpg_pos, dtype=np.int64))
+            md5.update(np.ascontiguousarray(cpg_value))
+    if annos:
+        for name, (start, end) in six.iteritems(annos):
+            md5.update(name.encode())
+            md5.update(np.ascontiguousarray(start, dtype=np.int64))
+            md5.update(np.ascontiguousarray(end, dtype=np.int64))
+    return md5.hexdigest()
+
+
+def read_manifest(out_dir):
+    """Read manifest of output directory `out_dir`.
+
+    Returns
+    -------
+    dict
+        `dict` with key 'chromos' that maps chromosomes to their fingerprint
+        and chunk files. Chunk files are `None` if the chromosome was not
+        completed.
+    """
+    filename = os.path.join(out_dir, MANIFEST)
+    if not os.path.isfile(filename):
+        return {'chromos': OrderedDict()}
+    with open(filename, 'r') as f:
+        return json.load(f, object_pairs_hook=OrderedDict)
+
+
+def write_manifest(out_dir, manifest):
+    """Write manifest of output directory `out_dir` atomically."""
+    filename = os.path.join(out_dir, MANIFEST)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.rename(filename + '.tmp', filename)
+
+
+def update_sample_index(out_dir, manifest):
+    """Write sample index of chunk files in `out_dir`.
+
+    Describes all chunk files of completed chromosomes in `manifest` with
+    :func:`dat.describe_data_file`, such that training and evaluation tools
+    need not open every file to count samples or labels. Entries of the
+    previous index are reused for files that did not change.
+    """
+    index = hdf.read_sample_index(out_dir)
+    prev_files = index['files'] if index else dict()
+    files = OrderedDict()
+    for entry in six.itervalues(manifest['chromos']):
+        for chunk_file in entry['chunks'] or []:
+            filename = os.path.join(out_dir, chunk_file)
+            if not os.path.isfile(filename):
+                continue
+            stat = os.stat(filename)
+            file_entry = prev_files.get(chunk_file)
+            if file_entry is None or \
+                    file_entry['size'] != stat.st_size or \
+                    file_entry['mtime'] != stat.st_mtime:
+                file_entry = dat.describe_data_file(filename)
+            files[chunk_file] = file_entry
+    hdf.write_sample_index(out_dir, files)
+
+
+def remove_chunk_files(out_dir, chromo, chunk_files=None):
+    """Remove chunk files of chromosome `chromo` from `out_dir`.
+
+    Removes `chunk_files` if provided, and all chunk files of `chromo`
+    otherwise.
+    """
+    if chunk_files is None:
+        chunk_files = glob(os.path.join(out_dir, 'c%s_*.h5' % chromo))
+        chunk_files += glob(os.path.join(out_dir, 'c%s_*.h5.tmp' % chromo))
+    for chunk_file in chunk_files:
+        chunk_file = os.path.join(out_dir, chunk_file)
+        if os.path.exists(chunk_file):
+            os.remove(chunk_file)
+
+
+def process_chromo(chromo, chromo_pos, cpg_tables, annos, opts, log,
+                   writer=None, resume=False):
+    """Creates data chunk files of a single chromosome.
+
+    Parameters
+    ----------
+    chromo: str
+        Chromosome name.
+    chromo_pos: :class:`numpy.ndarray`
+        Sorted positions on `chromo` for which data are created.
+    cpg_tables: dict
+        `dict (key, value)` with sorted `(pos, value)` arrays of all cells on
+        `chromo`, or `None` if no CpG profiles were provided.
+    annos: dict
+        `dict (name, (start, end))` with merged intervals of annotations on
+        `chromo`, or `None` if no annotations were provided.
+    opts: :class:`argparse.Namespace`
+        Command line options.
+    log: :class:`logging.Logger`
+        Logger or :class:`LogBuffer` for writing log messages.
+    writer: :class:`ChunkWriter`
+        Writer of chunk files. If `None`, chunk files are written
+        synchronously.
+    resume: bool
+        If `True`, skip chunks whose files are already complete.
+
+    Returns
+    -------
+    OrderedDict
+        `OrderedDict (name, nb_sample)` with the name and number of samples of
+        chunk files.
+    """
+    log.info('-' * 80)
+    log.info('Chromosome %s ...' % (chromo))
+
+    # Parse functions for computing output statistics
+    cpg_stats_meta = None
+    win_stats_meta = None
+    if opts.cpg_stats:
+        cpg_stats_meta = get_stats_meta(opts.cpg_stats)
+    if opts.win_stats:
+        win_stats_meta = get_stats_meta(opts.win_stats)
+
+    cpg_mat = None
+    if cpg_tables:
+        # Map CpG tables to sparse nb_site x nb_output matrix
+        chromo_pos.sort()
+        cpg_mat = CpgMatrix.from_tables(cpg_tables, chromo_pos)
+        assert len(cpg_mat) == len(chromo_pos)
+
+    if cpg_mat is not None and opts.cpg_cov:
+        idx = get_cov_filter(cpg_mat.coverage(), opts.cpg_cov,
+                             keep_uncovered=opts.all_cpgs)
+        tmp = '%s sites matched minimum coverage filter'
+        tmp %= format_out_of(idx.sum(), len(idx))
+        log.info(tmp)
+        if idx.sum() == 0:
+            return OrderedDict()
+
+        chromo_pos = chromo_pos[idx]
+        cpg_mat = cpg_mat.select(idx)
+
+    # Read DNA of chromosome
+    chromo_dna = None
+    if opts.dna_files:
+        chromo_dna = fasta.read_chromo(opts.dna_files, chromo, encode=True)
+
+    anno_data = None
+    if annos:
+        log.info('Annotating CpG sites ...')
+        anno_data = OrderedDict()
+        for name, (start, end) in six.iteritems(annos):
+            anno_data[name] = (an.is_in(chromo_pos, start, end), np.int8)
+            if opts.anno_dist:
+                # Distance is undefined without intervals on chromosome
+                if len(start):
+                    dist = an.distance(chromo_pos, start, end)
+                else:
+                    dist = np.empty(len(chromo_pos))
+                    dist.fill(dat.CPG_NAN)
+                anno_data['%s_dist' % name] = (dist, np.int32)
+            for wlen in opts.anno_overlap_wlen or []:
+                anno_data['%s_overlap_%d' % (name, wlen)] = (
+                    an.overlap_frac(chromo_pos, start, end, wlen), np.float16)
+
+    # Extractor of neighboring CpG sites, which is shared by all chunks
+    cpg_ext = None
+    if opts.cpg_wlen:
+        cpg_ext = fext.KnnCpgFeatureExtractor(opts.cpg_wlen // 2)
+
+    # Prefix sums of CpG states for computing window-based statistics
+    win_stats = None
+    if cpg_mat is not None and win_stats_meta is not None:
+        win_stats = stats.WindowStats(six.itervalues(cpg_tables))
+
+    # Compression and chunking of datasets
+    storage = hdf.get_storage_opts(opts)
+
+    def compressed(data, dtype=None):
+        if dtype is None:
+            dtype = data.dtype
+        kwargs = hdf.get_storage_kwargs(data.shape, dtype, **storage)
+        kwargs.update(data=data, dtype=dtype)
+        return kwargs
+
+    # Iterate over chunks
+    # -------------------
+    chunk_files = OrderedDict()
+    nb_chunk = int(np.ceil(len(chromo_pos) / opts.chunk_size))
+    for chunk in range(nb_chunk):
+        log.info('Chunk \t%d / %d' % (chunk + 1, nb_chunk))
+        chunk_start = chunk * opts.chunk_size
+        chunk_end = min(len(chromo_pos), chunk_start + opts.chunk_size)
+        chunk_idx = slice(chunk_start, chunk_end)
+        chunk_pos = chromo_pos[chunk_idx]
+
+        chunk_file = 'c%s_%06d-%06d.h5' % (chromo, chunk_start, chunk_end)
+        chunk_files[chunk_file] = len(chunk_pos)
+        filename = os.path.join(opts.out_dir, chunk_file)
+        if resume and is_chunk_complete(filename, len(chunk_pos)):
+            log.info('Skipping complete chunk')
+            continue
+
+        chunk_mat = None
+        if cpg_mat is not None:
+            chunk_mat = cpg_mat.select(chunk_idx)
+
+        # Random numbers only depend on the chunk, such that chunks can be
+        # skipped without changing other chunks.
+        rng = get_rng(opts.seed, chromo, chunk_start)
+        # Datasets of chunk file, which are written at the end
+        chunk_data = OrderedDict()
+
+        # Write positions
+        chunk_data['chromo'] = dict(data=np.repeat(chromo.encode(),
+                                                   len(chunk_pos)),
+                                    dtype='S2')
+        chunk_data['pos'] = dict(data=chunk_pos, dtype=np.int32)
+
+        # Write cpg profiles
+        if chunk_mat is not None:
+            chunk_data['outputs'] = None
+            # Unobserved states are only materialized for writing
+            chunk_dense = chunk_mat.to_dense()
+            for i, name in enumerate(chunk_mat.names):
+                value = chunk_dense[:, i]
+                assert len(value) == len(chunk_pos)
+                # Round continuous values
+                chunk_data['outputs/cpg/%s' % name] = compressed(
+                    value.round(), np.int8)
+            del chunk_dense
+            # Compute and write statistics
+            if cpg_stats_meta is not None:
+                log.info('Computing per CpG statistics ...')
+                mask = chunk_mat.coverage() < opts.cpg_stats_cov
+                chunk_stats = chunk_mat.stats(list(cpg_stats_meta.keys()))
+                for name, fun in six.iteritems(cpg_stats_meta):
+                    stat = chunk_stats[name].data.astype(fun[1])
+                    stat[mask] = dat.CPG_NAN
+                    assert len(stat) == len(chunk_pos)
+                    chunk_data['outputs/cpg_stats/%s' % name] = compressed(
+                        stat, fun[1])
+
+        # Write input features
+        chunk_data['inputs'] = None
+
+        # DNA windows
+        if chromo_dna is not None:
+            log.info('Extracting DNA sequence windows ...')
+            dna_wins = extract_seq_windows(chromo_dna, pos=chunk_pos,
+                                           wlen=opts.dna_wlen, rng=rng)
+            assert len(dna_wins) == len(chunk_pos)
+            chunk_data['inputs/dna'] = compressed(dna_wins, np.int8)
+
+        # CpG neighbors
+        if cpg_ext is not None:
+            log.info('Extracting CpG neighbors ...')
+            chunk_data['inputs/cpg'] = None
+            # cpg_tables, since neighboring CpG sites might lie
+            # outside chunk borders and un-mapped values are needed
+            for name, (cpg_pos, cpg_value) in six.iteritems(cpg_tables):
+                state, dist = cpg_ext.extract(chunk_pos, cpg_pos, cpg_value)
+                nan = np.isnan(state)
+                state[nan] = dat.CPG_NAN
+                dist[nan] = dat.CPG_NAN
+                # States can be binary (np.int8) or continuous
+                # (np.float32).
+                state = state.astype(cpg_value.dtype, copy=False)
+                dist = dist.astype(np.float32, copy=False)
+
+                assert len(state) == len(chunk_pos)
+                assert len(dist) == len(chunk_pos)
+                assert np.all((dist > 0) | (dist == dat.CPG_NAN))
+
+                group = 'inputs/cpg/%s/' % name
+                chunk_data[group + 'state'] = compressed(state)
+                chunk_data[group + 'dist'] = compressed(dist)
+
+        if win_stats is not None:
+            log.info('Computing window-based statistics ...')
+            for wlen in opts.win_stats_wlen:
+                group = 'outputs/win_stats/%d/' % wlen
+                wlen_stats = win_stats(list(win_stats_meta.keys()),
+                                       chunk_pos, wlen)
+                for name, fun in six.iteritems(win_stats_meta):
+                    stat = wlen_stats[name]
+                    mask = stat.mask
+                    stat = stat.data.astype(fun[1])
+                    stat[mask] = dat.CPG_NAN
+                    chunk_data[group + name] = compressed(stat, fun[1])
+
+        if anno_data:
+            log.info('Adding annotations ...')
+            chunk_data['inputs/annos'] = None
+            for name, (anno, dtype) in six.iteritems(anno_data):
+                chunk_data['inputs/annos/%s' % name] = compressed(
+                    anno[chunk_idx].astype(dtype), dtype)
+
+        if writer is None:
+            write_chunk(filename, chunk_data)
         else:
-            data[key] = value[idx]
-    return data
+            writer.write(filename, chunk_data)
+
+    return chunk_files
+
+
+class LogBuffer(object):
+    """Buffers log messages of a worker process.
+
+    Messages are replayed by the parent process with :meth:`replay`, such that
+    log lines of different chromosomes are not interleaved and appear in the
+    same order as in a sequential run.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def log(self, level, msg):
+        self.records.append((level, msg))
+
+    def debug(self, msg):
+        self.log(logging.DEBUG, msg)
+
+    def info(self, msg):
+        self.log(logging.INFO, msg)
 
+    def warning(self, msg):
+        self.log(logging.WARNING, msg)
 
-def annotate(anno_file, chromo, pos):
-    anno_file = dat.GzipFile(anno_file, 'r')
-    anno = pd.read_table(anno_file, header=None, usecols=[0, 1, 2],
-                         dtype={0: 'str', 1: 'int32', 2: 'int32'})
-    anno_file.close()
-    anno.columns = ['chromo', 'start', 'end']
-    anno.chromo = anno.chromo.str.upper().str.replace('CHR', '')
-    anno = anno.loc[anno.chromo == chromo]
-    anno.sort_values('start', inplace=True)
-    start, end = an.join_overlapping(anno.start.values, anno.end.values)
-    anno = np.array(an.is_in(pos, start, end), dtype='int8')
-    return anno
+    def replay(self, log):
+        for level, msg in self.records:
+            log.log(level, msg)
+
+
+def get_rng(seed, chromo, chunk_start):
+    """Return random number generator of chunk starting at `chunk_start` on
+    chromosome `chromo`.
+
+    The generator only depends on `seed`, `chromo`, and `chunk_start` such
+    that results do not depend on the order in which chromosomes and chunks
+    are processed. Returns an unseeded generator if `seed` is `None`.
+    """
+    if seed is None:
+        return np.random.RandomState()
+    return np.random.RandomState([seed, zlib.crc32(chromo.encode()),
+                                  chunk_start])
+
+
+def _process_chromo_job(job):
+    """Runs :func:`process_chromo` in worker process and returns log and
+    chunk files."""
+    chromo, chromo_pos, cpg_tables, annos, opts, resume = job
+    log = LogBuffer()
+    chunk_files = process_chromo(chromo, chromo_pos, cpg_tables, annos, opts,
+                                 log, resume=resume)
+    return (log, chunk_files)
 
 
 class App(object):
@@ -271,11 +1025,22 @@ class App(object):
             help='File with positions of CpG sites that are to be predicted.'
             ' If missing, only CpG sites that are observed in at least one of'
             ' the given cells will be used.')
+        p.add_argument(
+            '--all_cpgs',
+            help='Use all CpG sites of the DNA sequences in `--dna_files` as'
+            ' positions that are to be predicted instead of `--pos_file`.'
+            ' Useful for genome-wide imputation.',
+            action='store_true')
         p.add_argument(
             '--cpg_profiles',
             help='Input single-cell methylation profiles in dcpg or bedGraph'
             ' format that are to be imputed',
             nargs='+')
+        p.add_argument(
+            '--cpg_cache_dir',
+            help='Directory for caching parsed CpG profiles in binary format.'
+            ' Later runs read profiles from the cache unless files changed.'
+            ' Not used with `--nb_sample` or `--nb_sample_chromo`.')
         p.add_argument(
             '--cpg_wlen',
             help='If provided, extract `cpg_wlen`//2 neighboring CpG sites',
@@ -289,7 +1054,8 @@ class App(object):
         p.add_argument(
             '--dna_files',
             help='Directory or FASTA files named "*.chromosome.`chromo`.fa*"'
-            ' with the DNA sequences for chromosome `chromo`.',
+            ' with the DNA sequences for chromosome `chromo`, or directory of'
+            ' a genome index created by `dcpg_genome_index.py`.',
             nargs='+')
         p.add_argument(
             '--dna_wlen',
@@ -301,6 +1067,22 @@ class App(object):
             help='Files with genomic annotations that are used as input'
             ' features. Currently ignored by `dcpg_train.py`.',
             nargs='+')
+        p.add_argument(
+            '--anno_dist',
+            help='Also store the distance of CpG sites to the nearest interval'
+            ' of each annotation.',
+            action='store_true')
+        p.add_argument(
+            '--anno_overlap_wlen',
+            help='Also store the fraction of windows of these lengths centered'
+            ' on CpG sites that is overlapped by each annotation.',
+            type=int,
+            nargs='+')
+        p.add_argument(
+            '--anno_cache_dir',
+            help='Directory for caching parsed annotation files in binary'
+            ' format. Later runs read annotations from the cache unless files'
+            ' changed.')
         p.add_argument(
             '-o', '--out_dir',
             help='Output directory',
@@ -324,7 +1106,8 @@ class App(object):
             '--win_stats',
             help='Window-based output statistics derived from single-cell'
             ' profiles. Required, e.g., for predicting mean methylation levels'
-            ' or cell-to-cell variance.',
+            ' or cell-to-cell variance. Computed from all observed CpG sites'
+            ' in windows of length `--win_stats_wlen`.',
             nargs='+',
             choices=['mean', 'mode', 'var', 'cat_var', 'cat2_var', 'entropy',
                      'diff', 'cov'])
@@ -340,6 +1123,12 @@ class App(object):
             '--chromos',
             nargs='+',
             help='Chromosomes that are used')
+        g.add_argument(
+            '--regions',
+            help='BED file with regions, e.g. of a targeted panel. Only CpG'
+            ' sites within regions are used. Neighboring CpG sites and'
+            ' window-based statistics are still computed from entire'
+            ' profiles.')
         g.add_argument(
             '--nb_sample',
             type=int,
@@ -354,6 +1143,25 @@ class App(object):
             default=32768,
             help='Maximum number of samples per output file. Should be'
             ' divisible by batch size.')
+        g.add_argument(
+            '--nb_worker',
+            help='Number of processes for reading CpG profiles and'
+            ' processing chromosomes in parallel',
+            type=int,
+            default=1)
+        g.add_argument(
+            '--write_queue',
+            help='Maximum number of chunks that are queued for writing by a'
+            ' background process if `--nb_worker` is 1. Chunks are written'
+            ' synchronously if 0.',
+            type=int,
+            default=2)
+        g.add_argument(
+            '--overwrite',
+            help='Recreate all chunk files. By default, chromosomes and chunks'
+            ' that are complete and whose inputs did not change since the'
+            ' last run are skipped.',
+            action='store_true')
         g.add_argument(
             '--seed',
             help='Seed of random number generator',
@@ -366,6 +1174,8 @@ class App(object):
         g.add_argument(
             '--log_file',
             help='Write log messages to file')
+
+        hdf.add_storage_args(p)
         return p
 
     def main(self, name, opts):
@@ -385,31 +1195,42 @@ class App(object):
         if not opts.cpg_profiles:
             if not (opts.pos_file or opts.dna_files):
                 raise ValueError('Position table and DNA database expected!')
+        if opts.all_cpgs and not opts.dna_files:
+            raise ValueError('--all_cpgs requires --dna_files!')
 
         if opts.dna_wlen and opts.dna_wlen % 2 == 0:
             raise '--dna_wlen must be odd!'
         if opts.cpg_wlen and opts.cpg_wlen % 2 != 0:
             raise '--cpg_wlen must be even!'
 
-        # Parse functions for computing output statistics
-        cpg_stats_meta = None
-        win_stats_meta = None
-        if opts.cpg_stats:
-            cpg_stats_meta = get_stats_meta(opts.cpg_stats)
-        if opts.win_stats:
-            win_stats_meta = get_stats_meta(opts.win_stats)
-
         make_dir(opts.out_dir)
         outputs = OrderedDict()
 
+        # Read regions and only use chromosomes with regions
+        chromos = opts.chromos
+        regions = None
+        if opts.regions:
+            log.info('Reading regions ...')
+            regions = an.read_anno_index(opts.regions)
+            if chromos:
+                regions = OrderedDict([(chromo, regions[chromo])
+                                       for chromo in regions
+                                       if chromo in chromos])
+            chromos = list(regions.keys())
+            log.info('%d regions on %d chromosomes' % (
+                sum([len(start) for start, _ in six.itervalues(regions)]),
+                len(regions)))
+
         # Read single-cell profiles if provided
         if opts.cpg_profiles:
             log.info('Reading CpG profiles ...')
             outputs['cpg'] = read_cpg_profiles(
                 opts.cpg_profiles,
-                chromos=opts.chromos,
+                chromos=chromos,
                 nb_sample=opts.nb_sample,
                 nb_sample_chromo=opts.nb_sample_chromo,
+                cache_dir=opts.cpg_cache_dir,
+                nb_worker=opts.nb_worker,
                 log=log.info)
 
         # Create table with unique positions
@@ -422,15 +1243,25 @@ class App(object):
             pos_table.columns = ['chromo', 'pos']
             pos_table['chromo'] = dat.format_chromo(pos_table['chromo'])
             pos_table = prepro_pos_table(pos_table)
+        elif opts.all_cpgs:
+            # Enumerate CpG sites from DNA sequences
+            log.info('Enumerating CpG sites ...')
+            pos_table = get_genome_pos_table(opts.dna_files,
+                                             chromos=chromos,
+                                             regions=regions,
+                                             log=log.info)
+            pos_table = prepro_pos_table(pos_table)
         else:
             # Extract positions from profiles
             pos_tables = []
-            for cpg_table in list(outputs['cpg'].values()):
-                pos_tables.append(cpg_table[['chromo', 'pos']])
+            for cpg_table in six.itervalues(outputs['cpg']):
+                pos_tables.append(get_pos_table(cpg_table))
             pos_table = prepro_pos_table(pos_tables)
 
-        if opts.chromos:
-            pos_table = pos_table.loc[pos_table.chromo.isin(opts.chromos)]
+        if chromos is not None:
+            pos_table = pos_table.loc[pos_table.chromo.isin(chromos)]
+        if regions is not None:
+            pos_table = select_regions(pos_table, regions)
         if opts.nb_sample_chromo:
             pos_table = dat.sample_from_chromo(pos_table, opts.nb_sample_chromo)
         if opts.nb_sample:
@@ -438,187 +1269,99 @@ class App(object):
 
         log.info('%d samples' % len(pos_table))
 
-        make_dir(opts.out_dir)
+        # Read each annotation file once into an index of merged intervals
+        annos = None
+        if opts.anno_files:
+            log.info('Reading annotations ...')
+            annos = OrderedDict()
+            for anno_file in opts.anno_files:
+                log.info(anno_file)
+                annos[split_ext(anno_file)] = an.read_anno_index(
+                    anno_file, cache_dir=opts.anno_cache_dir)
+
+        # Fingerprints of chromosomes for skipping complete chromosomes and
+        # chunks
+        if opts.overwrite:
+            manifest = {'chromos': OrderedDict()}
+        else:
+            manifest = read_manifest(opts.out_dir)
+
+        def get_jobs():
+            for chromo in pos_table.chromo.unique():
+                idx = pos_table.chromo == chromo
+                chromo_pos = pos_table.loc[idx].pos.values
+                cpg_tables = None
+                if 'cpg' in outputs:
+                    cpg_tables = get_chromo_cpg_tables(outputs['cpg'], chromo)
+                chromo_annos = None
+                if annos:
+                    chromo_annos = get_chromo_annos(annos, chromo)
+
+                fingerprint = get_chromo_fingerprint(chromo, chromo_pos,
+                                                     cpg_tables, chromo_annos,
+                                                     opts)
+                entry = manifest['chromos'].get(chromo)
+                resume = not opts.overwrite and entry is not None and \
+                    entry['fingerprint'] == fingerprint
+                if resume and entry['chunks'] is not None and \
+                        all([is_chunk_complete(
+                            os.path.join(opts.out_dir, chunk_file), nb_sample)
+                            for chunk_file, nb_sample
+                            in six.iteritems(entry['chunks'])]):
+                    log.info('Skipping complete chromosome %s' % chromo)
+                    continue
+                if not resume:
+                    # Remove chunk files created from different inputs
+                    remove_chunk_files(opts.out_dir, chromo,
+                                       entry['chunks'] if entry else None)
+                manifest['chromos'][chromo] = OrderedDict(
+                    [('fingerprint', fingerprint), ('chunks', None)])
+                yield (chromo, chromo_pos, cpg_tables, chromo_annos, opts,
+                       resume)
+
+        def complete_chromo(chromo, chunk_files):
+            manifest['chromos'][chromo]['chunks'] = chunk_files
+            write_manifest(opts.out_dir, manifest)
+
+        # Jobs are created before processing chromosomes, such that the
+        # manifest is only updated by the main thread.
+        jobs = list(get_jobs())
+        write_manifest(opts.out_dir, manifest)
 
         # Iterate over chromosomes
         # ------------------------
-        for chromo in pos_table.chromo.unique():
-            log.info('-' * 80)
-            log.info('Chromosome %s ...' % (chromo))
-            idx = pos_table.chromo == chromo
-            chromo_pos = pos_table.loc[idx].pos.values
-            chromo_outputs = OrderedDict()
-
-            if 'cpg' in outputs:
-                # Concatenate CpG tables into single nb_site x nb_output matrix
-                chromo_outputs['cpg'] = map_cpg_tables(outputs['cpg'],
-                                                       chromo, chromo_pos)
-                chromo_outputs['cpg_mat'] = np.vstack(
-                    list(chromo_outputs['cpg'].values())).T
-                assert len(chromo_outputs['cpg_mat']) == len(chromo_pos)
-
-            if 'cpg_mat' in chromo_outputs and opts.cpg_cov:
-                cov = np.sum(chromo_outputs['cpg_mat'] != dat.CPG_NAN, axis=1)
-                assert np.all(cov >= 1)
-                idx = cov >= opts.cpg_cov
-                tmp = '%s sites matched minimum coverage filter'
-                tmp %= format_out_of(idx.sum(), len(idx))
-                log.info(tmp)
-                if idx.sum() == 0:
-                    continue
-
-                chromo_pos = chromo_pos[idx]
-                chromo_outputs = select_dict(chromo_outputs, idx)
-
-            # Read DNA of chromosome
-            chromo_dna = None
-            if opts.dna_files:
-                chromo_dna = fasta.read_chromo(opts.dna_files, chromo)
-
-            annos = None
-            if opts.anno_files:
-                log.info('Annotating CpG sites ...')
-                annos = dict()
-                for anno_file in opts.anno_files:
-                    name = split_ext(anno_file)
-                    annos[name] = annotate(anno_file, chromo, chromo_pos)
-
-            # Iterate over chunks
-            # -------------------
-            nb_chunk = int(np.ceil(len(chromo_pos) / opts.chunk_size))
-            for chunk in range(nb_chunk):
-                log.info('Chunk \t%d / %d' % (chunk + 1, nb_chunk))
-                chunk_start = chunk * opts.chunk_size
-                chunk_end = min(len(chromo_pos), chunk_start + opts.chunk_size)
-                chunk_idx = slice(chunk_start, chunk_end)
-                chunk_pos = chromo_pos[chunk_idx]
-
-                chunk_outputs = select_dict(chromo_outputs, chunk_idx)
-
-                filename = 'c%s_%06d-%06d.h5' % (chromo, chunk_start, chunk_end)
-                filename = os.path.join(opts.out_dir, filename)
-                chunk_file = h5.File(filename, 'w')
-
-                # Write positions
-                chunk_file.create_dataset('chromo', shape=(len(chunk_pos),),
-                                          dtype='S2')
-                chunk_file['chromo'][:] = chromo.encode()
-                chunk_file.create_dataset('pos', data=chunk_pos, dtype=np.int32)
-
-                if len(chunk_outputs):
-                    out_group = chunk_file.create_group('outputs')
-
-                # Write cpg profiles
-                if 'cpg' in chunk_outputs:
-                    for name, value in six.iteritems(chunk_outputs['cpg']):
-                        assert len(value) == len(chunk_pos)
-                        # Round continuous values
-                        out_group.create_dataset('cpg/%s' % name,
-                                                 data=value.round(),
-                                                 dtype=np.int8,
-                                                 compression='gzip')
-                    # Compute and write statistics
-                    if cpg_stats_meta is not None:
-                        log.info('Computing per CpG statistics ...')
-                        cpg_mat = np.ma.masked_values(chunk_outputs['cpg_mat'],
-                                                      dat.CPG_NAN)
-                        mask = np.sum(~cpg_mat.mask, axis=1)
-                        mask = mask < opts.cpg_stats_cov
-                        for name, fun in six.iteritems(cpg_stats_meta):
-                            stat = fun[0](cpg_mat).data.astype(fun[1])
-                            stat[mask] = dat.CPG_NAN
-                            assert len(stat) == len(chunk_pos)
-                            out_group.create_dataset('cpg_stats/%s' % name,
-                                                     data=stat,
-                                                     dtype=fun[1],
-                                                     compression='gzip')
-
-                # Write input features
-                in_group = chunk_file.create_group('inputs')
-
-                # DNA windows
-                if chromo_dna:
-                    log.info('Extracting DNA sequence windows ...')
-                    dna_wins = extract_seq_windows(chromo_dna, pos=chunk_pos,
-                                                   wlen=opts.dna_wlen)
-                    assert len(dna_wins) == len(chunk_pos)
-                    in_group.create_dataset('dna', data=dna_wins, dtype=np.int8,
-                                            compression='gzip')
-
-                # CpG neighbors
-                if opts.cpg_wlen:
-                    log.info('Extracting CpG neighbors ...')
-                    cpg_ext = fext.KnnCpgFeatureExtractor(opts.cpg_wlen // 2)
-                    context_group = in_group.create_group('cpg')
-                    # outputs['cpg'], since neighboring CpG sites might lie
-                    # outside chunk borders and un-mapped values are needed
-                    for name, cpg_table in six.iteritems(outputs['cpg']):
-                        cpg_table = cpg_table.loc[cpg_table.chromo == chromo]
-                        state, dist = cpg_ext.extract(chunk_pos,
-                                                      cpg_table.pos.values,
-                                                      cpg_table.value.values)
-                        nan = np.isnan(state)
-                        state[nan] = dat.CPG_NAN
-                        dist[nan] = dat.CPG_NAN
-                        # States can be binary (np.int8) or continuous
-                        # (np.float32).
-                        state = state.astype(cpg_table.value.dtype, copy=False)
-                        dist = dist.astype(np.float32, copy=False)
-
-                        assert len(state) == len(chunk_pos)
-                        assert len(dist) == len(chunk_pos)
-                        assert np.all((dist > 0) | (dist == dat.CPG_NAN))
-
-                        group = context_group.create_group(name)
-                        group.create_dataset('state', data=state,
-                                             compression='gzip')
-                        group.create_dataset('dist', data=dist,
-                                             compression='gzip')
-
-                if win_stats_meta is not None and opts.cpg_wlen:
-                    log.info('Computing window-based statistics ...')
-                    states = []
-                    dists = []
-                    cpg_states = []
-                    cpg_group = out_group['cpg']
-                    context_group = in_group['cpg']
-                    for output_name in six.iterkeys(cpg_group):
-                        state = context_group[output_name]['state'].value
-                        states.append(np.expand_dims(state, 2))
-                        dist = context_group[output_name]['dist'].value
-                        dists.append(np.expand_dims(dist, 2))
-                        cpg_states.append(cpg_group[output_name].value)
-                    # samples x outputs x cpg_wlen
-                    states = np.swapaxes(np.concatenate(states, axis=2), 1, 2)
-                    dists = np.swapaxes(np.concatenate(dists, axis=2), 1, 2)
-                    cpg_states = np.expand_dims(np.vstack(cpg_states).T, 2)
-                    cpg_dists = np.zeros_like(cpg_states)
-                    states = np.concatenate([states, cpg_states], axis=2)
-                    dists = np.concatenate([dists, cpg_dists], axis=2)
-
-                    for wlen in opts.win_stats_wlen:
-                        idx = (states == dat.CPG_NAN) | (dists > wlen // 2)
-                        states_wlen = np.ma.masked_array(states, idx)
-                        group = out_group.create_group('win_stats/%d' % wlen)
-                        for name, fun in six.iteritems(win_stats_meta):
-                            stat = fun[0](states_wlen)
-                            if hasattr(stat, 'mask'):
-                                idx = stat.mask
-                                stat = stat.data
-                                if np.sum(idx):
-                                    stat[idx] = dat.CPG_NAN
-                            group.create_dataset(name, data=stat, dtype=fun[1],
-                                                 compression='gzip')
-
-                if annos:
-                    log.info('Adding annotations ...')
-                    group = in_group.create_group('annos')
-                    for name, anno in six.iteritems(annos):
-                        group.create_dataset(name, data=anno[chunk_idx],
-                                             dtype='int8',
-                                             compression='gzip')
-
-                chunk_file.close()
+        if opts.nb_worker > 1:
+            # Chromosomes are processed in parallel but log messages are
+            # replayed in the order of chromosomes.
+            pool = mp.Pool(opts.nb_worker)
+            try:
+                results = pool.imap(_process_chromo_job, jobs)
+                for job, (chromo_log, chunk_files) in zip(jobs, results):
+                    chromo_log.replay(log)
+                    complete_chromo(job[0], chunk_files)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            # Chunks are written in the background while the next chunk is
+            # computed.
+            writer = None
+            if opts.write_queue > 0:
+                writer = ChunkWriter(opts.write_queue)
+            try:
+                for chromo, chromo_pos, cpg_tables, chromo_annos, _, resume \
+                        in jobs:
+                    chunk_files = process_chromo(chromo, chromo_pos,
+                                                 cpg_tables, chromo_annos,
+                                                 opts, log, writer=writer,
+                                                 resume=resume)
+                    complete_chromo(chromo, chunk_files)
+            finally:
+                if writer is not None:
+                    writer.close()
+
+        log.info('Writing sample index ...')
+        update_sample_index(opts.out_dir, manifest)
 
         log.info('Done!')
         return 0
@@ -29,17 +29,19 @@ import seaborn as sns
 import six
 
 from deepcpg import data as dat
-from deepcpg.data import hdf
 
 
-def get_output_stats(output):
+def get_output_stats(counts):
     stats = OrderedDict()
-    output = np.ma.masked_values(output, dat.CPG_NAN)
-    stats['nb_tot'] = len(output)
-    stats['nb_obs'] = np.sum(output != dat.CPG_NAN)
+    stats['nb_tot'] = counts['nb_tot']
+    stats['nb_obs'] = counts['nb_obs']
     stats['frac_obs'] = stats['nb_obs'] / stats['nb_tot']
-    stats['mean'] = float(np.mean(output))
-    stats['var'] = float(np.var(output))
+    stats['mean'] = np.nan
+    stats['var'] = np.nan
+    if stats['nb_obs']:
+        stats['mean'] = counts['sum'] / stats['nb_obs']
+        stats['var'] = max(counts['sum2'] / stats['nb_obs'] -
+                           stats['mean']**2, 0)
     return stats
 
 
@@ -110,10 +112,9 @@ class App(object):
                                             regex=opts.output_names)
         stats = OrderedDict()
         for name in output_names:
-            output = hdf.read(opts.data_files, 'outputs/%s' % name,
-                              nb_sample=opts.nb_sample)
-            output = list(output.values())[0]
-            stats[name] = get_output_stats(output)
+            counts = dat.get_output_counts(opts.data_files, name,
+                                           nb_sample=opts.nb_sample)
+            stats[name] = get_output_stats(counts)
         tmp = []
         for key, value in six.iteritems(stats):
             tmp.append(pd.DataFrame(value, index=[key]))
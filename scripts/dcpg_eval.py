@@ -42,26 +42,28 @@ import six
 from deepcpg import data as dat
 from deepcpg import evaluation as ev
 from deepcpg import models as mod
-from deepcpg.data import hdf
+from deepcpg.data import hdf, loader
 from deepcpg.utils import ProgressBar, to_list
 
 
 class H5Writer(object):
 
-    def __init__(self, filename, nb_sample):
+    def __init__(self, filename, nb_sample, storage=None):
         self.out_file = h5.File(filename, 'w')
         self.nb_sample = nb_sample
+        self.storage = storage or dict()
         self.idx = 0
 
-    def __call__(self, name, data, dtype=None, compression='gzip', stay=False):
+    def __call__(self, name, data, dtype=None, stay=False):
         if name not in self.out_file:
             if dtype is None:
                 dtype = data.dtype
+            shape = [self.nb_sample] + list(data.shape[1:])
             self.out_file.create_dataset(
                 name=name,
-                shape=[self.nb_sample] + list(data.shape[1:]),
+                shape=shape,
                 dtype=dtype,
-                compression=compression
+                **hdf.get_storage_kwargs(shape, dtype, **self.storage)
             )
         self.out_file[name][self.idx:(self.idx + len(data))] = data
         if not stay:
@@ -133,6 +135,12 @@ class App(object):
             help='Batch size',
             type=int,
             default=128)
+        p.add_argument(
+            '--data_q_size',
+            help='Number of batches that are read ahead while computing the'
+            ' previous batch. Disabled if 0.',
+            type=int,
+            default=10)
         p.add_argument(
             '--seed',
             help='Seed of random number generator',
@@ -149,6 +157,8 @@ class App(object):
         p.add_argument(
             '--log_file',
             help='Write log messages to file')
+
+        hdf.add_storage_args(p)
         return p
 
     def main(self, name, opts):
@@ -184,6 +194,7 @@ class App(object):
                                   nb_sample=nb_sample,
                                   batch_size=opts.batch_size,
                                   loop=False, shuffle=False)
+        data_reader = loader.prefetch(data_reader, opts.data_q_size)
 
         meta_reader = hdf.reader(opts.data_files, ['chromo', 'pos'],
                                  nb_sample=nb_sample,
@@ -192,7 +203,8 @@ class App(object):
 
         writer = None
         if opts.out_data:
-            writer = H5Writer(opts.out_data, nb_sample)
+            writer = H5Writer(opts.out_data, nb_sample,
+                              storage=hdf.get_storage_opts(opts))
 
         log.info('Predicting ...')
         nb_tot = 0
@@ -232,6 +244,8 @@ class App(object):
                 nb_eval = 0
 
         progbar.close()
+        if isinstance(data_reader, loader.Prefetcher):
+            log.info('Data queue: %s' % data_reader)
         if writer:
             writer.close()
 
@@ -59,15 +59,13 @@ def annotate(chromos, pos, anno):
         Binary :class:`numpy.ndarray` of same length as `chromos` indicating if
         positions are annotated.
     """
-    idx = []
+    idx = np.zeros(len(pos), dtype=bool)
     for chromo in np.unique(chromos):
-        chromo_pos = pos[chromos == chromo]
+        chromo_idx = np.nonzero(chromos == chromo)[0]
         chromo_anno = anno.loc[anno.chromo == chromo]
-        chromo_idx = is_in(chromo_pos,
-                           chromo_anno['start'].values,
-                           chromo_anno['end'].values)
-        idx.append(chromo_idx)
-    idx = np.hstack(idx)
+        idx[chromo_idx] = is_in(pos[chromo_idx],
+                                chromo_anno['start'].values,
+                                chromo_anno['end'].values)
     return idx
 
 
@@ -52,7 +52,7 @@ import six
 
 from deepcpg import data as dat
 from deepcpg import models as mod
-from deepcpg.data import hdf, dna
+from deepcpg.data import hdf, dna, loader
 from deepcpg.utils import ProgressBar, to_list, linear_weights
 
 
@@ -121,6 +121,12 @@ class App(object):
             help='Batch size',
             type=int,
             default=128)
+        g.add_argument(
+            '--data_q_size',
+            help='Number of batches that are read ahead while computing the'
+            ' previous batch. Disabled if 0.',
+            type=int,
+            default=10)
         g.add_argument(
             '--seed',
             help='Seed of random number generator',
@@ -133,6 +139,8 @@ class App(object):
         g.add_argument(
             '--log_file',
             help='Write log messages to file')
+
+        hdf.add_storage_args(p)
         return p
 
     def main(self, name, opts):
@@ -185,6 +193,7 @@ class App(object):
                                   batch_size=opts.batch_size,
                                   loop=False,
                                   shuffle=opts.shuffle)
+        data_reader = loader.prefetch(data_reader, opts.data_q_size)
 
         meta_reader = hdf.reader(opts.data_files, ['chromo', 'pos'],
                                  nb_sample=nb_sample,
@@ -199,15 +208,18 @@ class App(object):
         out_group['weights/weights'] = weights[0]
         out_group['weights/bias'] = weights[1]
 
-        def h5_dump(path, data, idx, dtype=None, compression='gzip'):
+        storage = hdf.get_storage_opts(opts)
+
+        def h5_dump(path, data, idx, dtype=None):
             if path not in out_group:
                 if dtype is None:
                     dtype = data.dtype
+                shape = [nb_sample] + list(data.shape[1:])
                 out_group.create_dataset(
                     name=path,
-                    shape=[nb_sample] + list(data.shape[1:]),
+                    shape=shape,
                     dtype=dtype,
-                    compression=compression
+                    **hdf.get_storage_kwargs(shape, dtype, **storage)
                 )
             out_group[path][idx:idx+len(data)] = data
 
@@ -264,6 +276,8 @@ class App(object):
 
             idx += batch_size
         progbar.close()
+        if isinstance(data_reader, loader.Prefetcher):
+            log.info('Data queue: %s' % data_reader)
 
         out_file.close()
         log.info('Done!')
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""Build a genome index from FASTA files.
+
+Integer-encodes the DNA sequence of each chromosome once and stores it as
+binary `.npy` file together with a JSON file that describes the index.
+``dcpg_data.py --dna_files`` accepts the output directory instead of FASTA
+files and then memory-maps chromosomes instead of parsing FASTA files, which
+makes repeated data creation start instantly.
+
+Examples
+--------
+
+.. code:: bash
+
+    dcpg_genome_index.py
+        ./mm10
+        --out_dir ./mm10_index
+
+    dcpg_data.py
+        --cpg_profiles ./cpg/*.tsv
+        --dna_files ./mm10_index
+        --dna_wlen 1001
+        --out_dir ./data
+
+See Also
+--------
+* ``dcpg_data.py``: For creating DeepCpG data files.
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+
+import argparse
+import logging
+
+from deepcpg.data import fasta
+
+
+class App(object):
+
+    def run(self, args):
+        name = os.path.basename(args[0])
+        parser = self.create_parser(name)
+        opts = parser.parse_args(args[1:])
+        return self.main(name, opts)
+
+    def create_parser(self, name):
+        p = argparse.ArgumentParser(
+            prog=name,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+            description='Builds a genome index from FASTA files.')
+        p.add_argument(
+            'dna_files',
+            help='Directory or FASTA files named "*.chromosome.`chromo`.fa*"'
+            ' with the DNA sequences for chromosome `chromo`.',
+            nargs='+')
+        p.add_argument(
+            '-o', '--out_dir',
+            help='Output directory',
+            required=True)
+        p.add_argument(
+            '--chromos',
+            nargs='+',
+            help='Chromosomes that are indexed')
+        p.add_argument(
+            '--verbose',
+            help='More detailed log messages',
+            action='store_true')
+        p.add_argument(
+            '--log_file',
+            help='Write log messages to file')
+        return p
+
+    def main(self, name, opts):
+        logging.basicConfig(filename=opts.log_file,
+                            format='%(levelname)s (%(asctime)s): %(message)s')
+        log = logging.getLogger(name)
+        if opts.verbose:
+            log.setLevel(logging.DEBUG)
+        else:
+            log.setLevel(logging.INFO)
+        log.debug(opts)
+
+        log.info('Indexing chromosomes ...')
+        index = fasta.build_genome_index(opts.dna_files, opts.out_dir,
+                                         chromos=opts.chromos, log=log.info)
+        if not index['chromos']:
+            raise ValueError('No FASTA files found!')
+        log.info('%d chromosomes indexed' % len(index['chromos']))
+
+        log.info('Done!')
+        return 0
+
+
+if __name__ == '__main__':
+    app = App()
+    app.run(sys.argv)
@@ -41,7 +41,7 @@ import logging
 
 from deepcpg import data as dat
 from deepcpg import models as mod
-from deepcpg.data import hdf
+from deepcpg.data import hdf, loader
 from deepcpg.utils import ProgressBar, linear_weights
 
 
@@ -108,6 +108,12 @@ class App(object):
             help='Batch size',
             type=int,
             default=128)
+        p.add_argument(
+            '--data_q_size',
+            help='Number of batches that are read ahead while computing the'
+            ' previous batch. Disabled if 0.',
+            type=int,
+            default=10)
         p.add_argument(
             '--seed',
             help='Seed of random number generator',
@@ -120,6 +126,8 @@ class App(object):
         p.add_argument(
             '--log_file',
             help='Write log messages to file')
+
+        hdf.add_storage_args(p)
         return p
 
     def main(self, name, opts):
@@ -183,6 +191,7 @@ class App(object):
                                   batch_size=opts.batch_size,
                                   loop=False,
                                   shuffle=False)
+        data_reader = loader.prefetch(data_reader, opts.data_q_size)
 
         meta_reader = hdf.reader(opts.data_files, ['chromo', 'pos'],
                                  nb_sample=nb_sample,
@@ -193,15 +202,18 @@ class App(object):
         out_file = h5.File(opts.out_file, 'w')
         out_group = out_file
 
-        def h5_dump(path, data, idx, dtype=None, compression='gzip'):
+        storage = hdf.get_storage_opts(opts)
+
+        def h5_dump(path, data, idx, dtype=None):
             if path not in out_group:
                 if dtype is None:
                     dtype = data.dtype
+                shape = [nb_sample] + list(data.shape[1:])
                 out_group.create_dataset(
                     name=path,
-                    shape=[nb_sample] + list(data.shape[1:]),
+                    shape=shape,
                     dtype=dtype,
-                    compression=compression
+                    **hdf.get_storage_kwargs(shape, dtype, **storage)
                 )
             out_group[path][idx:idx+len(data)] = data
 
@@ -254,6 +266,8 @@ class App(object):
 
             idx += batch_size
         progbar.close()
+        if isinstance(data_reader, loader.Prefetcher):
+            log.info('Data queue: %s' % data_reader)
 
         out_file.close()
         log.info('Done!')
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+"""Benchmark HDF5 storage options of data files.
+
+Rewrites data files with different compression filters, byte-shuffle filter,
+and chunk shapes (see ``--compression``, ``--shuffle_filter``, and
+``--chunk_rows`` of ``dcpg_data.py``), and reports for each setting the write
+time, file size, and read throughput when reading files batch-wise like
+``dcpg_train.py``.
+
+Examples
+--------
+
+.. code:: bash
+
+    dcpg_storage_bench.py
+        ./data/c1_000000-032768.h5
+        --batch_size 128
+        --out_tsv ./storage_bench.tsv
+
+See Also
+--------
+* ``dcpg_data.py``: For creating DeepCpG data files.
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+from collections import OrderedDict
+import os
+import shutil
+import sys
+import tempfile
+from time import time
+
+import argparse
+import logging
+import h5py as h5
+import pandas as pd
+
+from deepcpg.data import hdf
+
+
+def parse_compression(compression):
+    """Parse compression 'gzip', 'gzip:`level`', 'lzf', or 'none'."""
+    tokens = compression.split(':')
+    level = None
+    if len(tokens) > 1:
+        level = int(tokens[1])
+    return (tokens[0], level)
+
+
+def get_settings(compressions, chunk_rows):
+    """Return list of storage options that are benchmarked."""
+    settings = []
+    for compression in compressions:
+        compression, level = parse_compression(compression)
+        shuffles = [False] if compression == 'none' else [False, True]
+        for shuffle in shuffles:
+            for _chunk_rows in [None, chunk_rows]:
+                settings.append(dict(compression=compression,
+                                     compression_level=level,
+                                     shuffle=shuffle,
+                                     chunk_rows=_chunk_rows))
+    return settings
+
+
+def copy_file(src_file, dst_file, names, storage):
+    """Copy datasets `names` from `src_file` to `dst_file` using storage
+    options `storage`."""
+    src_file = h5.File(src_file, 'r')
+    dst_file = h5.File(dst_file, 'w')
+    for name in names:
+        data = src_file[name][()]
+        dst_file.create_dataset(
+            name, data=data,
+            **hdf.get_storage_kwargs(data.shape, data.dtype, **storage))
+    src_file.close()
+    dst_file.close()
+
+
+def bench_setting(data_files, names, storage, tmp_dir, batch_size):
+    """Benchmark storage options `storage`."""
+    stats = OrderedDict()
+    out_files = [os.path.join(tmp_dir, os.path.basename(data_file))
+                 for data_file in data_files]
+
+    start = time()
+    for data_file, out_file in zip(data_files, out_files):
+        copy_file(data_file, out_file, names, storage)
+    stats['write_time'] = time() - start
+    stats['file_size'] = sum([os.path.getsize(out_file)
+                              for out_file in out_files])
+
+    nb_sample = 0
+    nb_byte = 0
+    start = time()
+    for data_batch in hdf.reader(out_files, names, batch_size=batch_size):
+        nb_sample += len(data_batch[names[0]])
+        nb_byte += sum([value.nbytes for value in data_batch.values()])
+    read_time = time() - start
+    stats['read_time'] = read_time
+    stats['read_samples_per_sec'] = nb_sample / read_time
+    stats['read_mb_per_sec'] = nb_byte / read_time / 2**20
+
+    hdf.get_file_pool().close()
+    for out_file in out_files:
+        os.remove(out_file)
+    return stats
+
+
+class App(object):
+
+    def run(self, args):
+        name = os.path.basename(args[0])
+        parser = self.create_parser(name)
+        opts = parser.parse_args(args[1:])
+        return self.main(name, opts)
+
+    def create_parser(self, name):
+        p = argparse.ArgumentParser(
+            prog=name,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+            description='Benchmarks HDF5 storage options of data files')
+        p.add_argument(
+            'data_files',
+            nargs='+',
+            help='Data files')
+        p.add_argument(
+            '-o', '--out_tsv',
+            help='Write benchmark results to tsv file')
+        p.add_argument(
+            '--names',
+            help='Regex to select datasets that are benchmarked. If missing,'
+            ' all datasets are used.',
+            nargs='+')
+        p.add_argument(
+            '--compressions',
+            help='Compression filters that are benchmarked. Compression level'
+            ' of gzip can be specified by "gzip:`level`".',
+            nargs='+',
+            default=['gzip:1', 'gzip', 'gzip:9', 'lzf', 'none'])
+        p.add_argument(
+            '--batch_size',
+            help='Batch size for reading data and aligning chunks',
+            type=int,
+            default=128)
+        p.add_argument(
+            '--tmp_dir',
+            help='Directory for temporary files')
+        p.add_argument(
+            '--verbose',
+            help='More detailed log messages',
+            action='store_true')
+        p.add_argument(
+            '--log_file',
+            help='Write log messages to file')
+        return p
+
+    def main(self, name, opts):
+        logging.basicConfig(filename=opts.log_file,
+                            format='%(levelname)s (%(asctime)s): %(message)s')
+        log = logging.getLogger(name)
+        if opts.verbose:
+            log.setLevel(logging.DEBUG)
+        else:
+            log.setLevel(logging.INFO)
+        log.debug(opts)
+
+        names = hdf.ls(opts.data_files[0], recursive=True, regex=opts.names)
+        names = [name.lstrip('/') for name in names]
+        if not names:
+            raise ValueError('No datasets found!')
+        log.info('Benchmarking %d datasets' % len(names))
+
+        tmp_dir = tempfile.mkdtemp(dir=opts.tmp_dir)
+        try:
+            stats = []
+            for storage in get_settings(opts.compressions, opts.batch_size):
+                log.info(storage)
+                stat = OrderedDict(storage)
+                stat.update(bench_setting(opts.data_files, names, storage,
+                                          tmp_dir, opts.batch_size))
+                stats.append(stat)
+        finally:
+            shutil.rmtree(tmp_dir)
+        stats = pd.DataFrame(stats, columns=list(stats[0].keys()))
+
+        print(stats.to_string())
+        if opts.out_tsv:
+            stats.to_csv(opts.out_tsv, sep='\t', index=False)
+
+        log.info('Done!')
+        return 0
+
+
+if __name__ == '__main__':
+    app = App()
+    app.run(sys.argv)
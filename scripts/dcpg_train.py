@@ -102,14 +102,17 @@ def rename_layers(model, scope=None):
         layer.name = '%s/%s' % (scope, layer.name)
 
 
-def get_output_stats(output):
+def get_output_stats(counts):
     stats = OrderedDict()
-    output = np.ma.masked_values(output, dat.CPG_NAN)
-    stats['nb_tot'] = len(output)
-    stats['nb_obs'] = np.sum(output != dat.CPG_NAN)
+    stats['nb_tot'] = counts['nb_tot']
+    stats['nb_obs'] = counts['nb_obs']
     stats['frac_obs'] = stats['nb_obs'] / stats['nb_tot']
-    stats['mean'] = float(np.mean(output))
-    stats['var'] = float(np.var(output))
+    stats['mean'] = np.nan
+    stats['var'] = np.nan
+    if stats['nb_obs']:
+        stats['mean'] = counts['sum'] / stats['nb_obs']
+        stats['var'] = max(counts['sum2'] / stats['nb_obs'] -
+                           stats['mean']**2, 0)
     return stats
 
 
@@ -131,8 +134,9 @@ def get_output_weights(output_names, weight_patterns):
     return output_weights
 
 
-def get_class_weights(labels, nb_class=None):
-    freq = np.bincount(labels) / len(labels)
+def get_class_weights(counts, nb_class=None):
+    counts = np.asarray(counts)
+    freq = counts / counts.sum()
 
     if nb_class is None:
         nb_class = len(freq)
@@ -146,15 +150,17 @@ def get_class_weights(labels, nb_class=None):
     return weights
 
 
-def get_output_class_weights(output_name, output):
-    output = output[output != dat.CPG_NAN]
+def get_output_class_weights(output_name, counts):
+    counts = counts['counts']
     _output_name = output_name.split(OUTPUT_SEP)
-    if _output_name[0] == 'cpg':
-        weights = get_class_weights(output, 2)
+    if counts is None:
+        return None
+    elif _output_name[0] == 'cpg':
+        weights = get_class_weights(counts, 2)
     elif _output_name[-1] == 'cat_var':
-        weights = get_class_weights(output, 3)
+        weights = get_class_weights(counts, 3)
     elif _output_name[-1] in ['cat2_var', 'diff', 'mode']:
-        weights = get_class_weights(output, 2)
+        weights = get_class_weights(counts, 2)
     else:
         return None
     weights = OrderedDict(zip(range(len(weights)), weights))
@@ -306,6 +312,19 @@ class App(object):
             help='Batch size',
             type=int,
             default=128)
+        g.add_argument(
+            '--shuffle_block',
+            help='Shuffle training samples by reading contiguous blocks of'
+            ' this number of samples in random order instead of reading'
+            ' entire files into memory. Should be a multiple of'
+            ' `--chunk_rows` of `dcpg_data.py`.',
+            type=int)
+        g.add_argument(
+            '--shuffle_buffer',
+            help='Number of samples in the buffer from which training batches'
+            ' are drawn randomly if `--shuffle_block` is used. Defaults to 16'
+            ' blocks.',
+            type=int)
         g.add_argument(
             '--early_stopping',
             help='Early stopping patience',
@@ -394,6 +413,12 @@ class App(object):
             help='Number of worker for data generator queue',
             type=int,
             default=1)
+        g.add_argument(
+            '--data_nb_proc',
+            help='Number of processes for reading and preprocessing training'
+            ' data',
+            type=int,
+            default=1)
         return p
 
     def get_callbacks(self):
@@ -725,12 +750,12 @@ class App(object):
             class_weights = OrderedDict()
 
         for name in output_names:
-            output = hdf.read(opts.train_files, 'outputs/%s' % name,
-                              nb_sample=opts.nb_train_sample)
-            output = list(output.values())[0]
-            output_stats[name] = get_output_stats(output)
+            # Read from sample index if data files are indexed
+            counts = dat.get_output_counts(opts.train_files, name,
+                                           nb_sample=opts.nb_train_sample)
+            output_stats[name] = get_output_stats(counts)
             if class_weights is not None:
-                class_weights[name] = get_output_class_weights(name, output)
+                class_weights[name] = get_output_class_weights(name, counts)
 
         self.print_output_stats(output_stats)
         if class_weights:
@@ -767,12 +792,22 @@ class App(object):
             model, replicate_names=replicate_names)
         nb_train_sample = dat.get_nb_sample(opts.train_files,
                                             opts.nb_train_sample)
+        # Reader processes are started here and not by the data queue of
+        # `fit_generator`. They are started by a fork server, since forking
+        # while TensorFlow threads are running can deadlock processes.
         train_data = data_reader(opts.train_files,
                                  class_weights=class_weights,
                                  batch_size=opts.batch_size,
                                  nb_sample=nb_train_sample,
                                  shuffle=True,
-                                 loop=True)
+                                 shuffle_block=opts.shuffle_block,
+                                 shuffle_buffer=opts.shuffle_buffer,
+                                 loop=True,
+                                 nb_proc=opts.data_nb_proc,
+                                 start_method='forkserver' if six.PY3
+                                 else None,
+                                 nb_hold=opts.data_q_size +
+                                 opts.data_nb_worker + 1)
 
         if opts.val_files:
             nb_val_sample = dat.get_nb_sample(opts.val_files,
@@ -826,6 +861,10 @@ class App(object):
         model.metrics_tensors = None
         model.save(os.path.join(opts.out_dir, 'model.h5'))
 
+        stats = hdf.get_file_pool().stats()
+        log.debug('HDF5 files opened: %d, reused: %d' %
+                  (stats['nb_open'], stats['nb_hit']))
+
         log.info('Done!')
 
         return 0
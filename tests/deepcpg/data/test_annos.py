@@ -1,6 +1,10 @@
 from __future__ import division
 from __future__ import print_function
 
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
 import numpy as np
 import numpy.testing as npt
 import pandas as pd
@@ -8,6 +12,26 @@ import pandas as pd
 from deepcpg.data import annotations as annos
 
 
+def test_read_anno_index():
+    tmp_dir = mkdtemp(prefix='test_annos_')
+    cache_dir = os.path.join(tmp_dir, 'cache')
+    filename = os.path.join(tmp_dir, 'anno.bed')
+    with open(filename, 'w') as f:
+        f.write('# comment\n')
+        f.write('chr2\t5\t8\n1\t10\t20\nchr1\t1\t3\n1\t15\t25\n')
+
+    for cache in [None, cache_dir, cache_dir]:
+        index = annos.read_anno_index(filename, cache_dir=cache)
+        assert list(index.keys()) == ['1', '2']
+        start, end = index['1']
+        npt.assert_array_equal(start, [1, 10])
+        npt.assert_array_equal(end, [3, 25])
+        npt.assert_array_equal(index['2'][0], [5])
+    assert isinstance(index['1'][0], np.memmap)
+
+    rmtree(tmp_dir)
+
+
 def test_join_overlapping():
     f = annos.join_overlapping
 
@@ -51,6 +75,29 @@ def test_in_which():
     result = f(x, ys, ye)
     npt.assert_array_equal(result, expect)
 
+    x = [16, 8, -1, 2]
+    expect = [-1, 1, -1, 0]
+    result = f(x, ys, ye)
+    npt.assert_array_equal(result, expect)
+
+    npt.assert_array_equal(f([1, 2], [], []), [-1, -1])
+
+
+def test_join_overlapping_frame():
+    d = pd.DataFrame({
+        'chromo': ['2', '1', '1', '2', '1', '1'],
+        'start':  [1, 5, 1, 3, 9, 3],
+        'end':    [4, 6, 2, 5, 10, 5]
+    })
+    d = d.loc[:, ['chromo', 'start', 'end']]
+    expect = [['1', 1, 2], ['1', 3, 6], ['1', 9, 10], ['2', 1, 5]]
+    actual = annos.join_overlapping_frame(d)
+    assert list(actual.columns) == ['chromo', 'start', 'end']
+    npt.assert_array_equal(actual.values.tolist(), expect)
+
+    actual = annos.join_overlapping_frame(d.iloc[:0])
+    assert len(actual) == 0
+
 
 def test_is_in():
     ys = [2, 4, 12, 17]
@@ -82,6 +129,21 @@ def test_distance():
     npt.assert_array_equal(actual, expect)
 
 
+def test_overlap_frac():
+    start = [3, 10, 17]
+    end = [6, 15, 18]
+    pos = [0, 2, 5, 8, 12, 16, 19, 30]
+    expect = [0, 2, 4, 2, 5, 4, 2, 0]
+    actual = annos.overlap_frac(pos, start, end, 5)
+    npt.assert_array_almost_equal(actual, np.array(expect) / 5)
+
+    expect = [0, 0, 2, 0, 2, 1, 1, 0]
+    actual = annos.overlap_frac(pos, start, end, 2)
+    npt.assert_array_almost_equal(actual, np.array(expect) / 2)
+
+    npt.assert_array_equal(annos.overlap_frac(pos, [], [], 5), 0)
+
+
 def test_extend_frame():
     d = pd.DataFrame({
         'chromo': '1',
@@ -0,0 +1,143 @@
+from __future__ import division
+from __future__ import print_function
+
+import gzip
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import h5py as h5
+import numpy as np
+import numpy.testing as npt
+
+from deepcpg import data as dat
+from deepcpg.data import hdf
+
+
+def test_read_cpg_profile_chromos():
+    tmp_dir = mkdtemp(prefix='test_utils_')
+    lines = ['chr2\t30\t1', 'chr1\t20\t0', 'chrX\t5\t1', 'chr1\t10\t1',
+             '# comment', 'chr2\t10\t0', 'chr1\t15\t1']
+    filename = os.path.join(tmp_dir, 'cell.tsv.gz')
+    with gzip.open(filename, 'wt') as f:
+        f.write('\n'.join(lines))
+
+    for chunksize in [1, 2, 100]:
+        profile = dat.read_cpg_profile_chromos(filename, chunksize=chunksize)
+        assert list(profile.keys()) == ['1', '2', 'X']
+        pos, value = profile['1']
+        assert pos.dtype == np.int32
+        assert value.dtype == np.int8
+        npt.assert_array_equal(pos, [10, 15, 20])
+        npt.assert_array_equal(value, [1, 1, 0])
+        npt.assert_array_equal(profile['2'][0], [10, 30])
+
+        profile = dat.read_cpg_profile_chromos(filename, chromos=['2', 'X'],
+                                               chunksize=chunksize)
+        assert list(profile.keys()) == ['2', 'X']
+
+        # Only the first samples in the file are read
+        profile = dat.read_cpg_profile_chromos(filename, nb_sample=3,
+                                               chunksize=chunksize)
+        assert list(profile.keys()) == ['1', '2', 'X']
+        npt.assert_array_equal(profile['1'][0], [20])
+
+    filename = os.path.join(tmp_dir, 'cell.bedGraph')
+    with open(filename, 'w') as f:
+        f.write('track type=bedGraph\n')
+        f.write('1\t10\t11\t0.5\n1\t5\t6\t1\n')
+    profile = dat.read_cpg_profile_chromos(filename)
+    pos, value = profile['1']
+    assert value.dtype == np.float32
+    npt.assert_array_equal(pos, [5, 10])
+    npt.assert_array_equal(value, [1, 0.5])
+
+    rmtree(tmp_dir)
+
+
+def test_read_cpg_profile_cache():
+    tmp_dir = mkdtemp(prefix='test_utils_')
+    cache_dir = os.path.join(tmp_dir, 'cache')
+    filename = os.path.join(tmp_dir, 'cell.tsv')
+    with open(filename, 'w') as f:
+        f.write('1\t20\t1\n1\t10\t0\n2\t5\t0.5\n')
+
+    assert dat.read_cpg_profile_cache(filename, cache_dir) is None
+    expect = dat.read_cpg_profile_chromos(filename)
+    actual = dat.read_cpg_profile_chromos(filename, cache_dir=cache_dir)
+    cached = dat.read_cpg_profile_cache(filename, cache_dir)
+    assert isinstance(cached['1'][0], np.memmap)
+    for profile in [actual, cached]:
+        assert list(profile.keys()) == list(expect.keys())
+        for chromo, (pos, value) in expect.items():
+            npt.assert_array_equal(profile[chromo][0], pos)
+            npt.assert_array_equal(profile[chromo][1], value)
+
+    # States are binary on selected chromosomes
+    actual = dat.read_cpg_profile_chromos(filename, chromos=['1'],
+                                          cache_dir=cache_dir)
+    assert list(actual.keys()) == ['1']
+    assert actual['1'][1].dtype == np.int8
+
+    # Cache is invalidated if file changes
+    with open(filename, 'w') as f:
+        f.write('1\t30\t1\n')
+    assert dat.read_cpg_profile_cache(filename, cache_dir) is None
+    actual = dat.read_cpg_profile_chromos(filename, cache_dir=cache_dir)
+    npt.assert_array_equal(actual['1'][0], [30])
+    assert dat.read_cpg_profile_cache(filename, cache_dir) is not None
+
+    rmtree(tmp_dir)
+
+
+def test_get_output_counts():
+    tmp_dir = mkdtemp(prefix='test_utils_')
+    outputs = [np.array([1, 0, -1, 1], dtype=np.int8),
+               np.array([-1, 0, 0], dtype=np.int8)]
+    data_files = []
+    for i, output in enumerate(outputs):
+        filename = os.path.join(tmp_dir, 'c1_%d.h5' % i)
+        with h5.File(filename, 'w') as h5_file:
+            h5_file['chromo'] = np.repeat(b'1', len(output))
+            h5_file['pos'] = np.arange(len(output)) + i * 10
+            h5_file['outputs/cpg/cell'] = output
+        data_files.append(filename)
+
+    def check(nb_sample, expect):
+        counts = dat.get_output_counts(data_files, 'cpg/cell',
+                                       nb_sample=nb_sample)
+        assert counts['nb_tot'] == len(expect)
+        assert counts['nb_obs'] == np.sum(expect >= 0)
+        assert counts['counts'] == np.bincount(expect[expect >= 0]).tolist()
+        npt.assert_almost_equal(counts['sum'], expect[expect >= 0].sum())
+
+    expect = np.hstack(outputs)
+    for indexed in [False, True]:
+        if indexed:
+            files = dict()
+            for data_file in data_files:
+                files[os.path.basename(data_file)] = \
+                    dat.describe_data_file(data_file)
+            hdf.write_sample_index(tmp_dir, files)
+            entry = hdf.get_index_entry(data_files[1])
+            assert entry['nb_sample'] == 3
+            assert entry['chromos'] == ['1']
+            assert entry['pos_min'] == 10 and entry['pos_max'] == 12
+        assert dat.get_nb_sample(data_files) == 7
+        check(None, expect)
+        check(5, expect[:5])
+        check(2, expect[:2])
+
+    # Index entries of changed files are ignored
+    hdf.get_file_pool().close()
+    with h5.File(data_files[1], 'w') as h5_file:
+        h5_file['pos'] = np.arange(10)
+    assert hdf.get_index_entry(data_files[1]) is None
+    assert dat.get_nb_sample(data_files) == 14
+    stat = os.stat(data_files[0])
+    assert hdf.get_index_entry(data_files[0]) is not None
+    os.utime(data_files[0], (stat.st_atime, stat.st_mtime + 10))
+    assert hdf.get_index_entry(data_files[0]) is None
+
+    hdf.get_file_pool().close()
+    rmtree(tmp_dir)
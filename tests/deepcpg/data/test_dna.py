@@ -0,0 +1,38 @@
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import numpy.testing as npt
+
+from deepcpg.data import dna
+
+
+def test_encode_seq():
+    seq = 'ATGCNatgcn'
+    expect = dna.char_to_int(seq)
+    actual = dna.encode_seq(seq)
+    assert actual.dtype == np.uint8
+    npt.assert_array_equal(actual, expect)
+
+    npt.assert_array_equal(dna.encode_seq(b'ACGT'), [0, 3, 2, 1])
+    npt.assert_array_equal(dna.encode_seq(bytearray(b'ACGT')), [0, 3, 2, 1])
+    npt.assert_array_equal(dna.encode_seq('ARYK-'), [0, 4, 4, 4, 4])
+    assert len(dna.encode_seq('')) == 0
+
+
+def test_get_cpg_pos():
+    seq = 'CGaCGTNCGGcgC'
+    expect = [i + 1 for i in range(len(seq) - 1)
+              if seq[i:(i + 2)].upper() == 'CG']
+    npt.assert_array_equal(dna.get_cpg_pos(seq), expect)
+    actual = dna.get_cpg_pos(dna.encode_seq(seq), seq_index=0)
+    assert actual.dtype == np.int32
+    npt.assert_array_equal(actual, np.array(expect) - 1)
+    assert len(dna.get_cpg_pos('')) == 0
+
+    # CpG sites whose C is within intervals
+    npt.assert_array_equal(dna.get_cpg_pos(seq, [4, 1], [8, 1]), [1, 4, 8])
+    npt.assert_array_equal(dna.get_cpg_pos(seq, [2, 3, 11], [3, 4, 20]),
+                           [4, 11])
+    npt.assert_array_equal(dna.get_cpg_pos(seq, [5], [3]), [])
+    npt.assert_array_equal(dna.get_cpg_pos(seq, [13], [13]), [])
@@ -0,0 +1,98 @@
+from __future__ import division
+from __future__ import print_function
+
+import gzip
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import numpy as np
+import numpy.testing as npt
+
+from deepcpg.data import dna
+from deepcpg.data import fasta
+
+
+def test_iter_file():
+    tmp_dir = mkdtemp(prefix='test_fasta_')
+    lines = ['', '>seq1 desc ', 'ACGT', 'acgtN  ', '', '>seq2', 'NNNN', 'CG',
+             '>seq3']
+    expect = fasta.parse_lines(lines)
+    assert [seq.seq for seq in expect] == ['ACGTacgtN', 'NNNNCG', '']
+    for ext in ['.fa', '.fa.gz']:
+        filename = os.path.join(tmp_dir, 'seqs%s' % ext)
+        _open = gzip.open if ext.endswith('.gz') else open
+        with _open(filename, 'wt') as f:
+            f.write('\n'.join(lines))
+        for block_size in [1, 3, 1024]:
+            actual = list(fasta.iter_file(filename, block_size=block_size))
+            assert len(actual) == len(expect)
+            for act, exp in zip(actual, expect):
+                assert act.head == exp.head
+                assert act.seq == exp.seq
+
+            actual = fasta.read_file(filename, encode=True)
+            for act, exp in zip(actual, expect):
+                npt.assert_array_equal(act.seq, dna.char_to_int(exp.seq))
+    rmtree(tmp_dir)
+
+
+def test_iter_file_whitespace():
+    # Whitespace is only removed at the start and end of lines
+    tmp_dir = mkdtemp(prefix='test_fasta_')
+    filename = os.path.join(tmp_dir, 'seqs.fa')
+    lines = ['>seq1', ' AC GT\t', '\tA\tC  ', '  ', '>seq2 ', 'CG \r', 'TA']
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines))
+    expect = fasta.parse_lines(lines)
+    assert [seq.seq for seq in expect] == ['AC GTA\tC', 'CGTA']
+    for block_size in [1, 2, 3, 1024]:
+        actual = list(fasta.iter_file(filename, block_size=block_size))
+        assert [seq.head for seq in actual] == ['>seq1', '>seq2']
+        assert [seq.seq for seq in actual] == [seq.seq for seq in expect]
+    rmtree(tmp_dir)
+
+
+class TestGenomeIndex(object):
+
+    def setup_method(self):
+        self.tmp_dir = mkdtemp(prefix='test_fasta_')
+        self.dna_dir = os.path.join(self.tmp_dir, 'dna')
+        os.makedirs(self.dna_dir)
+        self.seqs = {'1': 'NNACGTacgtCGNN' * 10,
+                     'X': 'ACGCGTTA'}
+        for chromo, seq in self.seqs.items():
+            filename = 'Mus_musculus.GRCm38.dna.chromosome.%s.fa.gz' % chromo
+            with gzip.open(os.path.join(self.dna_dir, filename), 'wt') as f:
+                f.write('>%s dna:chromosome\n' % chromo)
+                for i in range(0, len(seq), 60):
+                    f.write(seq[i:(i + 60)] + '\n')
+
+    def teardown_method(self):
+        rmtree(self.tmp_dir)
+
+    def test_list_chromo_files(self):
+        chromo_files = fasta.list_chromo_files(self.dna_dir)
+        assert list(chromo_files.keys()) == ['1', 'X']
+        assert fasta.list_chromos(self.dna_dir) == ['1', 'X']
+
+    def test_read_chromo(self):
+        index_dir = os.path.join(self.tmp_dir, 'index')
+        index = fasta.build_genome_index(self.dna_dir, index_dir)
+        assert index['chromos']['1']['length'] == len(self.seqs['1'])
+        assert fasta.get_genome_index(self.dna_dir) is None
+        assert fasta.get_genome_index(index_dir)
+        assert fasta.list_chromos(index_dir) == ['1', 'X']
+
+        for chromo, seq in self.seqs.items():
+            expect = fasta.read_chromo(self.dna_dir, chromo)
+            assert expect == seq
+            actual = fasta.read_chromo(index_dir, chromo, encode=True)
+            assert isinstance(actual, np.memmap)
+            npt.assert_array_equal(actual, dna.char_to_int(seq))
+            actual = fasta.read_chromo(index_dir, chromo)
+            assert actual == seq.upper()
+            assert fasta.get_chromo_file(index_dir, chromo) == \
+                os.path.join(index_dir, '%s.npy' % chromo)
+            assert fasta.get_chromo_file(self.dna_dir, chromo).endswith(
+                'chromosome.%s.fa.gz' % chromo)
@@ -88,6 +88,20 @@ class TestKnnCpgFeatureExtractor(object):
         result = fe.KnnCpgFeatureExtractor(3).extract(x, y, ys)
         self._compare(result, expect)
 
+    def test_extract_empty(self):
+        e = fe.KnnCpgFeatureExtractor(2)
+        state, dist = e.extract(np.array([1, 5]), np.array([], dtype=np.int32),
+                                np.array([], dtype=np.int8))
+        assert state.shape == (2, 4)
+        assert dist.shape == (2, 4)
+        assert np.all(np.isnan(state))
+        assert np.all(np.isnan(dist))
+
+        state, dist = e.extract(np.array([], dtype=np.int32),
+                                np.array([1, 3]), np.array([0, 1]))
+        assert state.shape == (0, 4)
+        assert dist.shape == (0, 4)
+
 
 class TestIntervalFeatureExtractor(object):
 
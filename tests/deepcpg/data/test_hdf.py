@@ -3,6 +3,8 @@ from __future__ import print_function
 
 from collections import OrderedDict
 import os
+from shutil import rmtree
+from tempfile import mkdtemp
 
 import h5py as h5
 import numpy as np
@@ -32,6 +34,34 @@ def test_hnames_to_names():
     assert names == ['a/a1', 'b/b1', 'b/b2', 'c']
 
 
+def test_get_storage_kwargs():
+    kwargs = hdf.get_storage_kwargs((1000, 101), np.int8)
+    assert kwargs == {'compression': 'gzip'}
+
+    kwargs = hdf.get_storage_kwargs((1000, 101), np.int8, compression='none')
+    assert kwargs == dict()
+
+    kwargs = hdf.get_storage_kwargs((10000, 1001), np.int8,
+                                    compression='gzip', compression_level=1,
+                                    shuffle=True, chunk_rows=128)
+    assert kwargs['compression_opts'] == 1
+    assert kwargs['shuffle']
+    assert kwargs['chunks'] == (128, 1001)
+
+    # Chunks are multiples of `chunk_rows` with at least MIN_CHUNK_BYTES
+    kwargs = hdf.get_storage_kwargs((100000,), np.float32, chunk_rows=128)
+    nb_row = kwargs['chunks'][0]
+    assert nb_row % 128 == 0
+    assert nb_row * 4 >= hdf.MIN_CHUNK_BYTES
+    assert (nb_row - 128) * 4 < hdf.MIN_CHUNK_BYTES
+
+    # Chunks are not larger than dataset
+    kwargs = hdf.get_storage_kwargs((100,), np.int8, chunk_rows=128)
+    assert kwargs['chunks'] == (100,)
+    kwargs = hdf.get_storage_kwargs((0,), np.int8, chunk_rows=128)
+    assert 'chunks' not in kwargs
+
+
 class TestReader(object):
 
     def setup(self):
@@ -148,3 +178,118 @@ class TestReader(object):
             data_read = hdf.read_from(reader, nb_sample)
             for name in names:
                 assert np.all(data[name][:nb_sample] == data_read[name])
+
+
+def test_reader_shuffle_block():
+    tmp_dir = mkdtemp(prefix='test_hdf_')
+    data_files = []
+    nb_samples = [100, 37, 64]
+    start = 0
+    for i, nb_sample in enumerate(nb_samples):
+        data_file = os.path.join(tmp_dir, 'data%d.h5' % i)
+        h5_file = h5.File(data_file, 'w')
+        h5_file['pos'] = np.arange(start, start + nb_sample)
+        h5_file['x'] = np.arange(start, start + nb_sample)[:, None] * [1, -1]
+        h5_file.close()
+        data_files.append(data_file)
+        start += nb_sample
+    nb_sample = sum(nb_samples)
+
+    np.random.seed(0)
+    batches = list(hdf.reader(data_files, ['pos', 'x'], batch_size=10,
+                              shuffle=True, shuffle_block=8,
+                              shuffle_buffer=32))
+    assert max([len(batch['pos']) for batch in batches]) == 10
+    pos = np.hstack([batch['pos'] for batch in batches])
+    x = np.vstack([batch['x'] for batch in batches])
+    npt.assert_array_equal(np.sort(pos), np.arange(nb_sample))
+    npt.assert_array_equal(x[:, 0], pos)
+    npt.assert_array_equal(x[:, 1], -pos)
+    assert np.any(pos != np.arange(nb_sample))
+
+    # Samples are only read from the first files
+    batches = hdf.reader(data_files, ['pos'], batch_size=10, nb_sample=120,
+                         shuffle=True, shuffle_block=8)
+    pos = np.hstack([batch['pos'] for batch in batches])
+    assert len(pos) == 120
+    assert len(np.unique(pos)) == 120
+
+    # Epochs are repeated if `loop=True`
+    batches = hdf.reader(data_files, ['pos'], batch_size=10, shuffle=True,
+                         shuffle_block=8, loop=True)
+    pos = np.hstack([next(batches)['pos'] for _ in range(100)])
+    assert len(pos) >= 2 * nb_sample
+    npt.assert_array_equal(np.sort(pos[:nb_sample]), np.arange(nb_sample))
+
+    rmtree(tmp_dir)
+
+
+def test_file_pool():
+    tmp_dir = mkdtemp(prefix='test_hdf_')
+    filenames = []
+    for i in range(3):
+        filename = os.path.join(tmp_dir, 'data%d.h5' % i)
+        h5_file = h5.File(filename, 'w')
+        h5_file['pos'] = np.arange(i + 1)
+        h5_file.close()
+        filenames.append(filename)
+
+    pool = hdf.FilePool(max_size=2)
+    h5_file = pool.acquire(filenames[0])
+    assert len(h5_file['pos']) == 1
+    pool.release(filenames[0])
+    assert pool.acquire(filenames[0]) is h5_file
+    pool.release(filenames[0])
+    assert pool.nb_open == 1
+    assert pool.nb_hit == 1
+
+    # Least recently used file is closed
+    pool.acquire(filenames[1])
+    pool.release(filenames[1])
+    pool.acquire(filenames[2])
+    pool.release(filenames[2])
+    assert len(pool) == 2
+    assert not h5_file.id.valid
+    pool.acquire(filenames[0])
+    assert pool.nb_open == 4
+
+    # Acquired files are not closed
+    h5_file = pool.acquire(filenames[2])
+    pool.acquire(filenames[1])
+    pool.release(filenames[1])
+    assert len(pool) == 2
+    assert h5_file.id.valid
+    pool.release(filenames[0])
+    pool.release(filenames[2])
+
+    # Replaced files are reopened
+    h5_file = h5.File(filenames[0] + '.tmp', 'w')
+    h5_file['pos'] = np.arange(10)
+    h5_file.close()
+    os.rename(filenames[0] + '.tmp', filenames[0])
+    assert len(pool.acquire(filenames[0])['pos']) == 10
+    pool.release(filenames[0])
+    assert pool.nb_open == 6
+
+    # Files that change while acquired are reopened, and old handles closed
+    # when released
+    old_file = pool.acquire(filenames[1])
+    h5_file = h5.File(filenames[1] + '.tmp', 'w')
+    h5_file['pos'] = np.arange(20)
+    h5_file.close()
+    os.rename(filenames[1] + '.tmp', filenames[1])
+    new_file = pool.acquire(filenames[1])
+    assert new_file is not old_file
+    assert len(new_file['pos']) == 20
+    assert len(old_file['pos']) == 2
+    pool.release(filenames[1], old_file)
+    assert not old_file.id.valid
+    assert new_file.id.valid
+    assert pool.acquire(filenames[1]) is new_file
+    pool.release(filenames[1], new_file)
+    pool.release(filenames[1], new_file)
+    pool.close()
+    assert len(pool) == 0
+    assert not new_file.id.valid
+
+    rmtree(tmp_dir)
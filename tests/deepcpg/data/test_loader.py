@@ -0,0 +1,178 @@
+from __future__ import division
+from __future__ import print_function
+
+from collections import OrderedDict
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+import threading
+
+import h5py as h5
+import numpy as np
+from numpy import testing as npt
+from six.moves import range
+
+from deepcpg.data import hdf
+from deepcpg.data import loader
+
+
+def _write_data_files(tmp_dir, nb_samples):
+    data_files = []
+    start = 0
+    for i, nb_sample in enumerate(nb_samples):
+        filename = os.path.join(tmp_dir, 'c1_%d.h5' % i)
+        with h5.File(filename, 'w') as h5_file:
+            pos = np.arange(start, start + nb_sample, dtype=np.int32)
+            h5_file['pos'] = pos
+            h5_file['inputs/dna'] = np.repeat(pos % 5, 3).reshape(-1, 3)
+        data_files.append(filename)
+        start += nb_sample
+    return data_files
+
+
+def _batch_reader(data_files, **kwargs):
+    for batch in hdf.reader(data_files, ['pos', 'inputs/dna'], **kwargs):
+        yield (OrderedDict([('dna', batch['inputs/dna'].astype(np.float32))]),
+               [batch['pos']])
+
+
+def _failing_reader(data_files, **kwargs):
+    for i, batch in enumerate(_batch_reader(data_files, **kwargs)):
+        if i == 2:
+            raise ValueError('Failed!')
+        yield batch
+
+
+def test_write_batch():
+    batch = (OrderedDict([('a', np.arange(6).reshape(2, 3)),
+                          ('b', np.array([0.5, 1.5], dtype=np.float32))]),
+             [np.array([1, 0], dtype=np.int8)], 'name')
+    buf = np.zeros(loader.get_batch_nbytes(batch, 2), dtype=np.uint8)
+    template, meta = loader.write_batch(batch, buf)
+    actual = loader.read_batch(template, meta, buf)
+    assert list(actual[0].keys()) == ['a', 'b']
+    npt.assert_array_equal(actual[0]['a'], batch[0]['a'])
+    assert actual[0]['b'].dtype == np.float32
+    npt.assert_array_equal(actual[0]['b'], batch[0]['b'])
+    npt.assert_array_equal(actual[1][0], batch[1][0])
+    assert actual[2] == 'name'
+
+    try:
+        loader.write_batch(batch, buf[:10])
+        assert False
+    except ValueError:
+        pass
+
+
+def test_split_data_files():
+    tmp_dir = mkdtemp(prefix='test_loader_')
+    data_files = _write_data_files(tmp_dir, [10, 20, 30, 40])
+    splits = loader.split_data_files(data_files, 2)
+    assert splits == [(data_files[0::2], 40), (data_files[1::2], 60)]
+    splits = loader.split_data_files(data_files, 2, nb_sample=35)
+    assert splits == [([data_files[0], data_files[2]], 15),
+                      ([data_files[1]], 20)]
+    splits = loader.split_data_files(data_files, 8, nb_sample=5)
+    assert splits == [([data_files[0]], 5)]
+    hdf.get_file_pool().close()
+    rmtree(tmp_dir)
+
+
+def test_process_reader():
+    tmp_dir = mkdtemp(prefix='test_loader_')
+    data_files = _write_data_files(tmp_dir, [10, 25, 7, 30])
+    nb_sample = 72
+
+    reader = loader.ProcessReader(_batch_reader, data_files, nb_worker=3,
+                                  batch_size=4, shuffle=True)
+    pos = []
+    for inputs, outputs in reader:
+        npt.assert_array_equal(inputs['dna'][:, 0], outputs[0] % 5)
+        assert len(outputs[0]) <= 4
+        pos.append(outputs[0].copy())
+    reader.close()
+    npt.assert_array_equal(np.sort(np.hstack(pos)), np.arange(nb_sample))
+
+    # Batches are not overwritten while held
+    nb_hold = 3
+    reader = loader.ProcessReader(_batch_reader, data_files, nb_worker=2,
+                                  batch_size=4, nb_hold=nb_hold, loop=True)
+    held = []
+    for i in range(3 * nb_sample // 4):
+        batch = next(reader)
+        held.append((batch, batch[1][0].copy()))
+        held = held[-(nb_hold + 1):]
+        for batch, expect in held:
+            npt.assert_array_equal(batch[1][0], expect)
+    reader.close()
+
+    # Errors of worker processes are raised
+    reader = loader.ProcessReader(_failing_reader, data_files, nb_worker=2,
+                                  batch_size=4)
+    try:
+        list(reader)
+        assert False
+    except RuntimeError:
+        pass
+
+    hdf.get_file_pool().close()
+    rmtree(tmp_dir)
+
+
+def test_process_reader_thread():
+    # Processes are started from a background thread with the forkserver
+    # start method, e.g. as in the data queue of `fit_generator`.
+    tmp_dir = mkdtemp(prefix='test_loader_')
+    data_files = _write_data_files(tmp_dir, [10, 25, 7, 30])
+    pos = []
+
+    def read():
+        reader = loader.ProcessReader(_batch_reader, data_files, nb_worker=2,
+                                      batch_size=4, start_method='forkserver')
+        for inputs, outputs in reader:
+            pos.append(outputs[0].copy())
+        reader.close()
+
+    thread = threading.Thread(target=read)
+    thread.daemon = True
+    thread.start()
+    thread.join(60)
+    assert not thread.is_alive()
+    npt.assert_array_equal(np.sort(np.hstack(pos)), np.arange(72))
+
+    hdf.get_file_pool().close()
+    rmtree(tmp_dir)
+
+
+def test_prefetcher():
+    def generator(nb_batch, error=False):
+        for i in range(nb_batch):
+            if error and i == 3:
+                raise ValueError('Failed!')
+            yield np.array([i])
+
+    reader = loader.Prefetcher(generator(20), depth=3)
+    batches = [batch[0] for batch in reader]
+    assert batches == list(range(20))
+    stats = reader.stats()
+    assert stats['nb_batch'] == 20
+    assert 0 <= stats['mean_size'] <= 3
+    assert 0 <= stats['frac_empty'] <= 1
+    assert str(reader).startswith('20 batches')
+
+    reader = loader.Prefetcher(generator(10, error=True), depth=2)
+    batches = []
+    try:
+        for batch in reader:
+            batches.append(batch[0])
+        assert False
+    except ValueError:
+        pass
+    assert batches == [0, 1, 2]
+
+    reader = loader.Prefetcher(generator(1000), depth=2)
+    assert next(reader)[0] == 0
+    reader.close()
+
+    reader = loader.prefetch(generator(5), 0)
+    assert not isinstance(reader, loader.Prefetcher)
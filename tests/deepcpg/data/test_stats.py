@@ -0,0 +1,69 @@
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import numpy.testing as npt
+
+from deepcpg.data import stats
+
+
+def test_sparse_stats():
+    x = np.array([[1, 0, -1],
+                  [-1, -1, -1],
+                  [1, 1, 1],
+                  [0, -1, 0],
+                  [1, 0, 0]], dtype=np.int8)
+    obs = x != -1
+    indptr = np.hstack(([0], np.cumsum(obs.sum(axis=1))))
+    values = x[obs]
+    masked = np.ma.masked_values(x, -1)
+
+    names = ['mean', 'mode', 'var', 'cat_var', 'cat2_var', 'entropy', 'diff']
+    actual = stats.sparse_stats(names, indptr, values)
+    assert list(actual.keys()) == names
+    for name in names:
+        expect = stats.get(name)(masked)
+        npt.assert_array_equal(actual[name].mask, ~obs.any(axis=1))
+        npt.assert_array_almost_equal(actual[name][obs.any(axis=1)],
+                                      expect[obs.any(axis=1)])
+
+
+def test_window_stats():
+    cpg_tables = [(np.array([1, 3, 5, 10]), np.array([1, 0, 1, 1])),
+                  (np.array([2, 3, 20]), np.array([0, 0, 1])),
+                  (np.array([], dtype=np.int64), np.array([]))]
+    pos = np.array([3, 10, 30, 50])
+    win_stats = stats.WindowStats(cpg_tables)
+
+    actual = win_stats(['mean', 'var', 'diff'], pos, 5)
+    # Target sites are included in windows
+    npt.assert_array_equal(actual['mean'].mask, [False, False, True, True])
+    npt.assert_array_almost_equal(actual['mean'][:2], [(2 / 3 + 0) / 2, 1])
+    npt.assert_array_almost_equal(actual['var'][:2], [1 / 9, 0])
+    assert not actual['diff'][1]
+
+    actual = win_stats(['mean', 'var'], pos, 41)
+    npt.assert_array_equal(actual['mean'].mask, [False, False, False, True])
+    npt.assert_array_almost_equal(actual['mean'][:3],
+                                  [(3 / 4 + 1 / 3) / 2,
+                                   (3 / 4 + 1 / 3) / 2,
+                                   1])
+    npt.assert_array_almost_equal(actual['var'][2], 0)
+
+    # Same as masked [sites, cells, context] matrix of all sites in windows
+    names = ['mean', 'var', 'diff', 'mode']
+    for wlen in [1, 5, 21, 41]:
+        actual = win_stats(names, pos, wlen)
+        states = np.zeros((len(pos), len(cpg_tables), 10))
+        mask = np.ones_like(states, dtype=bool)
+        for i, p in enumerate(pos):
+            for j, (cpg_pos, cpg_value) in enumerate(cpg_tables):
+                idx = np.abs(cpg_pos - p) <= wlen // 2
+                states[i, j, :idx.sum()] = cpg_value[idx]
+                mask[i, j, :idx.sum()] = False
+        states = np.ma.masked_array(states, mask)
+        obs = ~mask.all(axis=(1, 2))
+        for name in names:
+            expect = stats.get(name)(states)
+            npt.assert_array_equal(actual[name].mask, ~obs)
+            npt.assert_array_almost_equal(actual[name][obs], expect[obs])
@@ -5,6 +5,9 @@ from shutil import rmtree
 import sys
 from tempfile import mkdtemp
 
+import h5py as h5
+import numpy as np
+
 PATH = os.path.dirname(os.path.realpath(__file__))
 sys.path.insert(0, os.path.join(PATH, '../../scripts'))
 
@@ -49,3 +52,47 @@ class TestData(object):
         self._test_simple(['--cpg_wlen', 10,
                            '--dna_files', self.dna_dir,
                            '--dna_wlen', 101])
+
+
+def test_get_cov_filter():
+    cov = np.array([0, 1, 2, 3])
+    idx = dcpg_data.get_cov_filter(cov, 2, keep_uncovered=True)
+    assert list(idx) == [True, False, True, True]
+    idx = dcpg_data.get_cov_filter(cov[1:], 2)
+    assert list(idx) == [False, True, True]
+    try:
+        dcpg_data.get_cov_filter(cov, 1)
+        assert False
+    except ValueError:
+        pass
+
+
+def test_all_cpgs():
+    # Test imputing all CpG sites of the genome given CpG profiles, which do
+    # not cover all sites.
+    tmp_dir = mkdtemp(dir='/tmp', prefix='test_data_')
+    dna_file = pt.join(tmp_dir, 'genome.chromosome.1.fa')
+    with open(dna_file, 'w') as f:
+        f.write('>1\n%s\n' % ('ACGTTCGA' * 20))
+    cpg_profiles = []
+    for cell in range(2):
+        cpg_profiles.append(pt.join(tmp_dir, 'cell%d.tsv' % cell))
+        with open(cpg_profiles[-1], 'w') as f:
+            for pos in range(2 + cell * 8, 160, 16):
+                f.write('1\t%d\t%d\n' % (pos, cell))
+    out_dir = pt.join(tmp_dir, 'data')
+    cmd = ['dcpg_data',
+           '--out_dir', out_dir,
+           '--dna_files', dna_file,
+           '--all_cpgs',
+           '--cpg_profiles'] + cpg_profiles + [
+           '--dna_wlen', 11,
+           '--cpg_wlen', 2]
+    cmd = [str(arg) for arg in cmd]
+    assert dcpg_data.App().run(cmd) == 0
+    data_files = glob(pt.join(out_dir, '*.h5'))
+    assert len(data_files) == 1
+    with h5.File(data_files[0], 'r') as h5_file:
+        assert len(h5_file['pos']) == 40
+        assert np.sum(h5_file['outputs/cpg/cell0'][()] != -1) == 10
+    rmtree(tmp_dir)